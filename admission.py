@@ -0,0 +1,89 @@
+"""Admission control for replay parses.
+
+waitress hands every request to a thread, and once its pool is busy further
+requests queue up where nobody can see them.  ``AdmissionQueue`` puts an explicit,
+bounded queue in front of the parser instead: at most ``concurrency`` parses run at
+once, the rest wait, and when the waiting + running *weight* (roughly replay size)
+would exceed ``max_weight`` the request is refused straight away with a
+``Retry-After`` estimate.
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+WEIGHT_UNIT_BYTES = 100 * 1024  # one weight unit per 100 KB of replay
+
+
+def replay_weight(size: int) -> int:
+    """Queue weight for a replay of ``size`` bytes (bigger replays parse longer)."""
+    return max(1, math.ceil(size / WEIGHT_UNIT_BYTES))
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after: int, depth: int):
+        super().__init__(f'parser queue is full (depth {depth}), retry in {retry_after}s')
+        self.retry_after = retry_after
+        self.depth = depth
+
+
+class AdmissionQueue:
+    def __init__(self, concurrency: int, max_weight: int):
+        self.concurrency = max(1, concurrency)
+        self.max_weight = max(1, max_weight)
+        self._cond = threading.Condition()
+        self._running = 0
+        self._waiting = 0
+        self._weight = 0
+        self._avg_seconds_per_weight = 1.0  # moving average, seeded pessimistically
+
+    @property
+    def depth(self) -> int:
+        """Requests admitted but not yet running."""
+        return self._waiting
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def weight(self) -> int:
+        return self._weight
+
+    def retry_after(self) -> int:
+        # time to drain what is already queued with every slot busy
+        return max(1, math.ceil(self._weight * self._avg_seconds_per_weight / self.concurrency))
+
+    def _refuse_if_full(self, weight: int) -> None:
+        # an idle service always takes the request, however heavy it is
+        if self._weight and self._weight + weight > self.max_weight:
+            raise QueueFull(self.retry_after(), self._waiting)
+
+    def check(self, weight: int = 1) -> None:
+        """Raise ``QueueFull`` if ``admit(weight)`` would be refused right now."""
+        with self._cond:
+            self._refuse_if_full(weight)
+
+    @contextmanager
+    def admit(self, weight: int = 1):
+        """Hold a parse slot for the ``with`` block or raise ``QueueFull``."""
+        with self._cond:
+            self._refuse_if_full(weight)
+            self._weight += weight
+            self._waiting += 1
+            while self._running >= self.concurrency:
+                self._cond.wait()
+            self._waiting -= 1
+            self._running += 1
+
+        started = time.monotonic()
+        try:
+            yield self
+        finally:
+            elapsed = time.monotonic() - started
+            with self._cond:
+                self._running -= 1
+                self._weight -= weight
+                self._avg_seconds_per_weight = 0.8 * self._avg_seconds_per_weight + 0.2 * (elapsed / weight)
+                self._cond.notify()
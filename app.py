@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, has_request_context, copy_current_request_context
 """Minimal StarCraft II replay parser producing build orders.
 
 Changes made 2025‑06‑18
@@ -19,12 +19,36 @@ Changes made 2025‑06‑18
 from flask_cors import CORS
 import sc2reader
 import io
+import os
+import json
+import zipfile
+import queue
+import threading
 import bisect 
+import gc
+import hashlib
+import hmac
 import re
+import signal
+import sys
+import time
+from contextlib import contextmanager, redirect_stdout, ExitStack
+from concurrent.futures import as_completed
+from functools import partial
+from itertools import chain
 from collections import defaultdict
 from sc2reader.constants import GAME_SPEED_FACTOR
 from name_map import NAME_MAP
-from typing import List, Dict, Any, Optional
+from replay_cache import ReplayStore, ResultCache, replay_hash, normalise_hash, options_key
+from admission import AdmissionQueue, QueueFull, replay_weight
+from rate_limit import RateLimiter, RateLimited, parse_limits
+from metrics import Metrics
+from jobs import JobStore, DONE, FAILED, RUNNING
+from timeline_codec import encode_timeline, decode_timeline
+import workers
+from profiling import ProfileBusy, profile_call, summary_header
+from sampler import StackSampler
+from typing import List, Dict, Any, Optional, Callable, NamedTuple
 
 import sc2reader.events.game as ge
 
@@ -48,8 +72,6 @@ HALLUCINATED_TYPE_COUNTS = {
     "Oracle": 1,
 }
 
-has_stargate = False
-
 upgrade_name_map = {
     "HighCapacityBarrels": "Infernal Pre-Igniter",
     "InterferenceMatrix": "Interference Matrix",
@@ -190,9 +212,7 @@ upgrade_times = {
     "Flyer Armor L1": 114,
     "Flyer Armor L2": 136,
     "Flyer Armor L3": 157,
-    "Flyer Attacks L1": 114,
-    "Flyer Attacks L1": 136,
-    "Flyer Attacks L1": 157,
+    "Flyer Attacks L1": 157,  # the value the old duplicated key resolved to
     "Overlord Speed": 43,
     "Metabolic Boost": 79,
     "Adrenal Glands": 93,
@@ -400,9 +420,263 @@ def prettify_upgrade(ability_name: str) -> str:
     return words.replace('_', ' ').strip().title()
 
 
+# ---- per-build game-data tables -------------------------------------
+# The hand-maintained dicts above are keyed by display strings, so every event
+# used to be name-formatted and regex-tidied before a lookup.  GameData compiles
+# them once per sc2reader datapack into records indexed by unit-type id; the
+# event loop does one lookup per event, keyed by the unit-type id sc2reader
+# attached to the event's unit (the name is only a fallback for types the
+# datapack lacks).  Upgrades have no ids in sc2reader, so their records are
+# interned by raw upgrade name instead.
+class UnitRecord(NamedTuple):
+    id: int
+    name: str                # format_name() of the raw type name
+    base_name: str           # without a "Hallucinated " prefix
+    label: Optional[str]     # tidy(name); None when the unit is never listed
+    build_time: int          # seconds, 0 when unknown
+    supply: int
+
+
+class UpgradeRecord(NamedTuple):
+    name: str
+    research_time: Optional[int]
+
+
+class GameData:
+    """Unit lookups for one sc2reader datapack, compiled on construction."""
+
+    def __init__(self, datapack):
+        self.unit_ids: Dict[str, int] = {}
+        self.units: List[Optional[UnitRecord]] = []
+        self._lock = threading.Lock()
+        for type_id, unit_type in datapack.units.items():
+            if isinstance(type_id, int):  # the datapack lists every type by id and by str_id
+                self._add(unit_type.str_id, type_id, unit_type.supply)
+
+    def _add(self, type_name: str, type_id: int, supply: int) -> UnitRecord:
+        name = format_name(type_name)
+        record = UnitRecord(
+            id=type_id,
+            name=name,
+            base_name=re.sub(r'^Hallucinated\s+', '', name, flags=re.I),
+            label=tidy(name),
+            build_time=BUILD_TIME.get(type_name, 0),
+            supply=supply,
+        )
+        if type_id >= len(self.units):
+            self.units.extend([None] * (type_id + 1 - len(self.units)))
+        self.units[type_id] = record
+        self.unit_ids[type_name] = type_id
+        return record
+
+    def unit_for(self, event) -> UnitRecord:
+        """The record for a born/init event, looked up by the unit-type id sc2reader resolved."""
+        unit_type = event.unit.type_history.get(event.frame)
+        if unit_type is not None and unit_type.str_id == event.unit_type_name:
+            record = self.units[unit_type.id]
+            if record is not None:
+                return record
+        # type changed within the same frame, or unknown to the datapack
+        return self.unit(event.unit_type_name)
+
+    def unit(self, type_name: str) -> UnitRecord:
+        type_id = self.unit_ids.get(type_name)
+        if type_id is not None:
+            return self.units[type_id]
+        with self._lock:
+            # a type this datapack does not know (mods, newer patches): give it a fresh id
+            type_id = self.unit_ids.get(type_name)
+            return self.units[type_id] if type_id is not None else self._add(type_name, len(self.units), 0)
+
+
+_game_data: Dict[tuple, GameData] = {}
+_game_data_lock = threading.Lock()
+_upgrades: Dict[str, Optional[UpgradeRecord]] = {}
+
+
+def game_data_for(replay) -> GameData:
+    """The compiled tables for the replay's datapack (shared by every replay of that build)."""
+    key = (replay.expansion, getattr(replay.datapack, 'id', None))
+    data = _game_data.get(key)
+    if data is None:
+        with _game_data_lock:
+            data = _game_data.get(key)
+            if data is None:
+                data = _game_data[key] = GameData(replay.datapack)
+    return data
+
+
+def upgrade_record(upgrade_type_name: str) -> Optional[UpgradeRecord]:
+    """Display name and research time of an upgrade, None for cosmetic ones (sprays ...)."""
+    try:
+        return _upgrades[upgrade_type_name]
+    except KeyError:
+        pass
+    name = tidy(upgrade_type_name)
+    record = None
+    if name is not None:
+        mapped = upgrade_name_map.get(name, name)
+        record = UpgradeRecord(mapped, upgrade_times.get(mapped))
+    _upgrades[upgrade_type_name] = record
+    return record
+
+
 # ---- Flask setup --------------------------------------------------
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Replay-SHA256', 'X-Replay-Cache', 'X-Queue-Depth', 'Retry-After',
+                         'X-Parse-Truncated', 'X-Profile'])
+
+# ---- replay / result caches ---------------------------------------
+# Replays are kept by SHA-256 so the client can ask for a build order by hash
+# (``/upload/hash``) and only send the file when we don't hold it yet.
+replay_store = ReplayStore(int(os.environ.get('REPLAY_STORE_MB', '64')) * 1024 * 1024)
+result_cache = ResultCache(int(os.environ.get('RESULT_CACHE_SIZE', '512')))
+# Extracted rows (encoded with timeline_codec) per replay + extraction options:
+# a build order asked for again with only compact / exclude_supply / exclude_time
+# changed is re-rendered from here instead of re-parsed.
+timeline_cache = ResultCache(int(os.environ.get('TIMELINE_CACHE_SIZE', '256')))
+RENDER_OPTIONS = ('exclude_supply', 'exclude_time', 'compact')
+
+
+def timeline_key(sha: str, options: Dict[str, Any]) -> tuple:
+    return sha, options_key({k: v for k, v in options.items() if k not in RENDER_OPTIONS})
+
+# ---- admission control --------------------------------------------
+# At most PARSE_CONCURRENCY parses run at once; PARSE_QUEUE_DEPTH bounds the
+# queued + running weight (1 unit per 100 KB of replay) before we shed load.
+admission = AdmissionQueue(
+    int(os.environ.get('PARSE_CONCURRENCY', '2')),
+    int(os.environ.get('PARSE_QUEUE_DEPTH', '16')),
+)
+metrics = Metrics()
+
+# ---- per-client rate limits ---------------------------------------
+# Every client – a known X-API-Key (RATE_LIMIT_KEYS) or else its IP – has a token
+# bucket per parse route, charged the replay's admission weight when a parse is
+# admitted (cache hits are free).  RATE_LIMITS overrides single routes
+# (route=PER_MINUTE[:BURST], 0 lifts the limit); RATE_LIMITS=off disables them.
+DEFAULT_RATE_LIMITS = 'upload=60:30,players=120:60,batch=120:60,jobs=120:60,align=120:60,series=60:30,similar=60:30'
+RATE_LIMIT_KEYS = set(filter(None, os.environ.get('RATE_LIMIT_KEYS', '').split(',')))
+TRUST_FORWARDED_FOR = os.environ.get('TRUST_FORWARDED_FOR') == '1'
+_rate_limits = os.environ.get('RATE_LIMITS', '')
+rate_limiter = RateLimiter(
+    {} if _rate_limits == 'off' else {**parse_limits(DEFAULT_RATE_LIMITS), **parse_limits(_rate_limits)})
+
+
+def rate_limit_client() -> str:
+    key = request.headers.get('X-API-Key')
+    if key and key in RATE_LIMIT_KEYS:
+        return f'key:{key}'
+    if TRUST_FORWARDED_FOR:
+        # only behind a proxy that sets the header; otherwise clients pick their own
+        forwarded = request.headers.get('X-Forwarded-For', '').split(',')[0].strip()
+        if forwarded:
+            return f'ip:{forwarded}'
+    return f'ip:{request.remote_addr}'
+
+
+def charge_client(route: str, size: int) -> None:
+    """Take the parse's weight from the requesting client's bucket or raise ``RateLimited``."""
+    if route not in rate_limiter.limits or not has_request_context():
+        return  # warm-up and other server-initiated parses are not charged
+    try:
+        rate_limiter.take(route, rate_limit_client(), replay_weight(size))
+    except RateLimited:
+        metrics.inc('ratelimit_decisions_total', route=route, decision='limited')
+        raise
+    metrics.inc('ratelimit_decisions_total', route=route, decision='allowed')
+
+# ---- continuous sampling profiler ---------------------------------
+# SAMPLER_HZ stack samples per second of the threads inside parse_slot (0 turns
+# it off); /admin/profile/collapsed serves them for flamegraph tools.  Worker
+# processes sample their tasks themselves and send the stacks back with the
+# usage report; a request thread waiting on a worker is not sampled meanwhile.
+sampler = StackSampler(float(os.environ.get('SAMPLER_HZ', '50')))
+
+
+def worker_result(future):
+    """``future.result()``, without sampling the wait (the worker samples the parse)."""
+    with sampler.idle():
+        return future.result()
+
+# ---- resource-limited parse workers -------------------------------
+# With ISOLATE_PARSES (the default) /upload parses run on the worker pool like
+# jobs and batches, under the PARSE_MEMORY_MB / PARSE_CPU_SECONDS caps in
+# workers.py: a replay that balloons or spins costs one recycled worker, not the
+# server.  Over the memory cap answers 413, over the CPU cap (or a parse that
+# killed its worker) 422.  /upload/stream and profile=1 still parse in-process.
+ISOLATE_PARSES = os.environ.get('ISOLATE_PARSES', '1') != '0'
+_worker_peak_rss_mb = 0.0
+
+
+def record_worker_usage(usage: Dict[str, Any]) -> None:
+    global _worker_peak_rss_mb
+    task = usage['task']
+    sampler.merge(usage.get('stacks', {}))
+    if usage['limit'] is not None:
+        metrics.inc('worker_limit_hits_total', task=task, limit=usage['limit'])
+        return
+    metrics.observe('worker_cpu_seconds', usage['cpu_seconds'], task=task)
+    if usage['peak_rss_mb'] is not None:
+        metrics.observe('worker_peak_rss_mb', usage['peak_rss_mb'], task=task)
+        _worker_peak_rss_mb = max(_worker_peak_rss_mb, usage['peak_rss_mb'])
+        metrics.set('worker_peak_rss_mb_max', _worker_peak_rss_mb)
+
+
+workers.set_usage_listener(record_worker_usage)
+
+
+def _update_queue_gauges() -> None:
+    metrics.set('parser_queue_depth', admission.depth)
+    metrics.set('parser_queue_weight', admission.weight)
+    metrics.set('parser_running', admission.running)
+
+
+@contextmanager
+def parse_slot(route: str, size: int):
+    """Run the ``with`` body as one admitted parse.
+
+    Raises ``RateLimited`` when the client is over its limit for ``route`` and
+    ``QueueFull`` when the parser is saturated.
+    """
+    metrics.inc('parser_requests_total', route=route)
+    charge_client(route, size)
+    try:
+        with admission.admit(replay_weight(size)):
+            _update_queue_gauges()
+            started = time.perf_counter()
+            try:
+                with sampler.track():
+                    yield
+            finally:
+                metrics.observe('parser_parse_seconds', time.perf_counter() - started, route=route)
+    except QueueFull:
+        metrics.inc('parser_rejected_total', route=route)
+        raise
+    finally:
+        _update_queue_gauges()
+
+
+@app.errorhandler(QueueFull)
+def queue_full(e: QueueFull):
+    return f'Parser is busy, retry in {e.retry_after}s', 503, {'Retry-After': str(e.retry_after)}
+
+
+@app.errorhandler(RateLimited)
+def rate_limited(e: RateLimited):
+    return f'Too many requests, retry in {e.retry_after}s', 429, {'Retry-After': str(e.retry_after)}
+
+
+@app.errorhandler(workers.ResourceLimitExceeded)
+def parse_limit_exceeded(e: workers.ResourceLimitExceeded):
+    print(f"🧱 Parse stopped at its {e.kind} limit: {e}")
+    return str(e), e.status
+
+
+@app.after_request
+def add_queue_depth(response):
+    response.headers['X-Queue-Depth'] = str(admission.depth)
+    return response
 
 
 # --- helper: pretty unit names -------------------------------------
@@ -435,14 +709,161 @@ def players():
     if file.filename == '':
         return 'No replay uploaded', 400
 
-    replay_data = io.BytesIO(file.read())
+    data = file.read()
+    sha = replay_hash(data)
+    # remember the bytes – the follow-up /upload/hash call can then skip the upload
+    replay_store.put(sha, data)
+    document = result_cache.get((sha, TIMELINES_KEY))
+    if document is not None:
+        info = [{'pid': p['pid'], 'name': p['name'], 'race': p['race']} for p in document['players']]
+        return jsonify({'players': info, 'matchup': document['matchup']})
     try:
         # load_level=4 ensures tracker events are parsed
-        replay = sc2reader.load_replay(replay_data, load_map=False, load_level=4)
+        with parse_slot('players', len(data)), loaded_replay(data) as replay:
+            info, matchup = player_summary(replay)
+    except (QueueFull, RateLimited):
+        raise
     except Exception as e:
         print('❌ Failed to load replay:', e)
         return f'Failed to load replay: {e}', 400
 
+    return jsonify({'players': info, 'matchup': matchup})
+
+
+
+def parse_upload_options(form) -> Dict[str, Any]:
+    """Read the build-order options shared by every parse endpoint."""
+    def flag(name: str) -> bool:
+        return str(form.get(name, '')).lower() in {'1', 'true', 'yes', 'on'}
+
+    compact = flag('compact')
+    stop_supply_raw = form.get('stop_supply')
+    stop_time_raw = form.get('stop_time')
+    return {
+        'player': form.get('player') or (request.args.get('player') if has_request_context() else None),
+        'exclude_workers': flag('exclude_workers'),
+        'exclude_units': flag('exclude_units'),
+        'exclude_supply': flag('exclude_supply'),
+        # compact mode never shows timestamps
+        'exclude_time': flag('exclude_time') or compact,
+        'compact': compact,
+        'stop_limit': int(stop_supply_raw) if stop_supply_raw and stop_supply_raw.isdigit() else None,
+        'time_limit': int(stop_time_raw) * 60 if stop_time_raw and stop_time_raw.isdigit() else None,
+    }
+
+
+def load_replay_bytes(data: bytes):
+    # full load so that tracker events are available
+    return sc2reader.load_replay(io.BytesIO(data), load_map=False, load_level=4)
+
+
+# ---- replay lifetime / GC -----------------------------------------
+# A loaded Replay is one big cyclic graph (events <-> players <-> units), tens of
+# thousands of objects.  The cyclic GC keeps re-traversing it while it is being
+# decoded and walked, and once dropped it lingers until the next full collection.
+# So parses pause automatic collection, copy out plain rows and tear the graph
+# down themselves, which lets reference counting free it at once.  warm_up()
+# then freezes the start-up heap out of the GC.  GC_TUNING=0 turns all of it off.
+GC_TUNING = os.environ.get('GC_TUNING', '1') != '0'
+# Overlapping parses can keep collection paused indefinitely; force a full pass
+# once this many parses or seconds have gone by since it was paused.
+GC_PAUSE_MAX_PARSES = int(os.environ.get('GC_PAUSE_MAX_PARSES', '32'))
+GC_PAUSE_MAX_SECONDS = float(os.environ.get('GC_PAUSE_MAX_SECONDS', '30'))
+_gc_lock = threading.Lock()
+_gc_pauses = 0  # parses currently running with automatic collection paused
+_gc_paused_at = 0.0  # monotonic time of the last pause or forced collection
+_gc_paused_parses = 0  # parses finished since then
+
+
+def _reset_gc_state() -> None:
+    """Forked children start with no parses running, so automatic collection is back on."""
+    global _gc_lock, _gc_pauses, _gc_paused_parses
+    _gc_lock = threading.Lock()  # may have been held by another thread at fork time
+    _gc_pauses = 0
+    _gc_paused_parses = 0
+    gc.enable()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_gc_state)
+
+
+@contextmanager
+def gc_paused():
+    """Pause automatic garbage collection until every concurrent parse is done."""
+    global _gc_pauses, _gc_paused_at, _gc_paused_parses
+    if not GC_TUNING:
+        yield
+        return
+    with _gc_lock:
+        _gc_pauses += 1
+        if _gc_pauses == 1:
+            gc.disable()
+            _gc_paused_at = time.monotonic()
+            _gc_paused_parses = 0
+    try:
+        yield
+    finally:
+        overdue = False
+        with _gc_lock:
+            _gc_pauses -= 1
+            _gc_paused_parses += 1
+            if _gc_pauses == 0:
+                gc.enable()
+            elif (_gc_paused_parses >= GC_PAUSE_MAX_PARSES
+                  or time.monotonic() - _gc_paused_at >= GC_PAUSE_MAX_SECONDS):
+                overdue = True
+                _gc_paused_at = time.monotonic()
+                _gc_paused_parses = 0
+        if overdue:
+            gc.collect()
+
+
+def release_replay(replay) -> None:
+    """Break the replay's reference cycles so it is freed without a GC pass.
+
+    The replay is unusable afterwards.  Shared objects (the datapack, factory and
+    logger) are only unlinked, never cleared.  Events are left intact: sc2reader's
+    engine plugins are process-wide and keep the last events they saw, which a
+    concurrent load may still read.  Clearing the units and players they point
+    to is enough to break the cycles.
+    """
+    parts = chain(
+        getattr(replay, 'objects', {}).values(),
+        getattr(replay, 'entities', ()), getattr(replay, 'teams', ()),
+        getattr(replay, 'clients', ()), getattr(replay, 'people', ()),
+    )
+    for obj in parts:
+        state = getattr(obj, '__dict__', None)
+        if state is not None:
+            state.clear()
+    replay.__dict__.clear()
+
+
+@contextmanager
+def loaded_replay(data: bytes, load_level: int = 4):
+    """Load a replay for the duration of the block, with the GC paused.
+
+    Copy out everything needed inside the block; the replay is released on exit.
+    """
+    with gc_paused():
+        replay = sc2reader.load_replay(io.BytesIO(data), load_map=False, load_level=load_level)
+        try:
+            yield replay
+        finally:
+            if GC_TUNING:
+                release_replay(replay)
+
+
+def freeze_heap() -> None:
+    """Move everything allocated so far (modules, game data, caches) out of the GC's reach."""
+    if GC_TUNING:
+        gc.collect()
+        gc.freeze()
+
+
+def player_summary(replay):
+    """``([{'pid', 'name', 'race'}, ...], matchup)`` for the non-observer players."""
     players = [p for p in replay.players if not p.is_observer]
     info = [{'pid': p.pid, 'name': p.name, 'race': p.play_race} for p in players]
     matchup = None
@@ -450,419 +871,680 @@ def players():
         a = players[0].play_race[0].lower()
         b = players[1].play_race[0].lower()
         matchup = f"{a}v{b}"
-    return jsonify({'players': info, 'matchup': matchup})
+    return info, matchup
 
 
+def timeline_for_bytes(data: bytes, options: Dict[str, Any]):
+    """``(player, timeline)`` for the requested player: the structured rows behind
+    the ``/upload`` text.  Raises if the replay cannot be loaded or parsed."""
+    with loaded_replay(data) as replay:
+        player = select_player(replay, options.get('player'))
+        info = {'pid': player.pid, 'name': player.name, 'race': player.play_race}
+        entries, _ = extract_entries(replay, options)
+    return info, collapse_entries(entries)
 
-@app.route('/upload', methods=['POST'])
-def upload():
-    global has_stargate
-    has_stargate = False  # ✅ always reset for each replay
-    if 'replay' not in request.files:
-        return 'No replay uploaded', 400
 
-    file = request.files['replay']
-    if file.filename == '':
-        return 'No replay uploaded', 400
+def build_orders_for_all_players(data: bytes, options: Dict[str, Any],
+                                 time_budget: Optional[float] = None,
+                                 with_timeline: bool = False) -> Dict[str, Any]:
+    """Load a replay once and extract every player's build order (batch paths).
 
-    replay_data = io.BytesIO(file.read())
-    try:
-        # full load so that tracker events are available
-        replay = sc2reader.load_replay(replay_data, load_map=False, load_level=4)
-    except Exception as e:
-        print("❌ Failed to load replay:", e)
-        return f'Failed to load replay: {e}', 400
+    Uses the same extraction as ``/upload`` so offline results match the
+    website; ``time_budget`` (seconds, shared by all players) is off by default.
+    ``with_timeline`` adds each player's structured rows (``collapse_entries``)
+    as ``timeline``.  Raises if the replay cannot be loaded.
+    """
+    deadline = time.monotonic() + time_budget if time_budget else None
+    with loaded_replay(data) as replay:
+        info, matchup = player_summary(replay)
+        length = replay.game_length.seconds
+        played_at = replay.date.isoformat() if replay.date else None
+        for player in info:
+            player_options = dict(options, player=str(player['pid']))
+            try:
+                entries, truncated_sec = extract_entries(replay, player_options, deadline=deadline)
+                body, status = build_order_result(entries, truncated_sec, player_options)
+            except Exception as e:
+                print("❌ Error while processing events:", e)
+                entries, truncated_sec, body, status = [], None, f'Failed to parse replay: {e}', 500
+            player['status'] = status
+            player['build_order'] = body
+            if truncated_sec is not None:
+                player['truncated_at'] = truncated_at(body)
+            if with_timeline:
+                player['timeline'] = collapse_entries(entries)
+    return {
+        'players': info,
+        'matchup': matchup,
+        'length': length,
+        'played_at': played_at,
+    }
+
+
+ProgressCallback = Callable[[str, Dict[str, Any]], None]
+PROGRESS_EVERY_EVENTS = 2000
+
+# ---- per-parse time budget ----------------------------------------
+# A parse that runs past PARSE_TIME_BUDGET seconds (0 disables) stops walking the
+# event stream and returns what it has so far: status 200 with a closing
+# "# truncated at mm:ss" line, an X-Parse-Truncated header and no-store, since
+# the next attempt may well complete.  (Not 206: that answers Range requests.)
+PARSE_TIME_BUDGET = float(os.environ.get('PARSE_TIME_BUDGET', '20'))
+DEADLINE_CHECK_EVENTS = 256
+TRUNCATED_RE = re.compile(r'^# truncated at (\d+:\d{2})', re.M)
+
+
+def truncated_at(body: str) -> Optional[str]:
+    """The ``mm:ss`` a budget-truncated build order stops at, or None."""
+    m = TRUNCATED_RE.search(body)
+    return m.group(1) if m else None
+
+
+def result_headers(sha: str, body: str, cache_state: str) -> Dict[str, str]:
+    headers = {'X-Replay-SHA256': sha, 'X-Replay-Cache': cache_state}
+    cut = truncated_at(body)
+    if cut:
+        headers['X-Parse-Truncated'] = cut
+        headers['Cache-Control'] = 'no-store'
+    return headers
+
+
+def build_order_for_bytes(data: bytes, options: Dict[str, Any], on_progress: Optional[ProgressCallback] = None,
+                          on_timeline: Optional[Callable[[bytes], None]] = None):
+    """Load a replay and return ``(body, status)`` exactly like ``/upload``.
+
+    ``on_progress(stage, info)`` is told about each parse stage when given.  The
+    ``PARSE_TIME_BUDGET`` clock starts here, so decoding counts against it.
+    """
+    deadline = time.monotonic() + PARSE_TIME_BUDGET if PARSE_TIME_BUDGET > 0 else None
+    with ExitStack() as stack:
+        try:
+            if on_progress is not None:
+                # details only (a few ms) – lets the client show who played before the full decode
+                header = sc2reader.load_replay(io.BytesIO(data), load_map=False, load_level=2)
+                on_progress('header', {
+                    'players': [{'pid': p.pid, 'name': p.name, 'race': p.play_race}
+                                for p in header.players if not p.is_observer],
+                    'length': header.game_length.seconds,
+                })
+            replay = stack.enter_context(loaded_replay(data))
+        except Exception as e:
+            print("❌ Failed to load replay:", e)
+            return f'Failed to load replay: {e}', 400
+        if on_progress is not None:
+            on_progress('decoded', {'events': len(replay.events)})
+        return extract_build_order(replay, options, on_progress, deadline, on_timeline)
+
+
+def collapse_entries(entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Timeline in build-order form: start rows only, identical unit+supply
+    rows merged into one with a ``count``, sorted by ``clock_sec``."""
+    # keep only start rows (copied – collapsing below sets 'count') --
+    entries = [
+        dict(e) for e in entries
+        if (e.get('kind') == 'start') or (e.get('type') == 'upgrade')
+    ]
+
+    # collapse identical supply+unit rows (units only) ----------
+    tmp = []
+    for e in sorted(entries, key=lambda x: (
+        x.get('clock_sec', x.get('time', 0)),
+        x.get('supply', 0),
+        x.get('unit', x.get('label', ''))
+    )):
+        if e.get('kind') != 'start':
+            # do not collapse upgrades — just add
+            tmp.append(e)
+            continue
+
+        if (
+            tmp
+            and tmp[-1].get('kind') == 'start'
+            and e.get('unit') == tmp[-1].get('unit')
+            and e.get('supply') == tmp[-1].get('supply')
+        ):
+            tmp[-1]['count'] = tmp[-1].get('count', 1) + 1
+        else:
+            e['count'] = 1
+            tmp.append(e)
 
-    try:
-        players = [p for p in replay.players if not p.is_observer]
-        if not players:
-            return 'No player found in replay', 400
-
-        # ----- player selection ------------------------------------
-        requested = request.form.get('player') or request.args.get('player')
-        player = next((p for p in players if requested and (str(p.pid) == requested or p.name == requested)), None)
-        if player is None:
-            player = players[0]
-
-        # ----- flags ------------------------------------------------
-        exclude_flag = request.form.get('exclude_workers', '')
-        exclude_workers = str(exclude_flag).lower() in {'1', 'true', 'yes', 'on'}
-        exclude_units_flag = request.form.get('exclude_units', '')
-        exclude_units = str(exclude_units_flag).lower() in {'1', 'true', 'yes', 'on'}
-        exclude_supply_flag = request.form.get('exclude_supply', '')
-        exclude_supply = str(exclude_supply_flag).lower() in {'1', 'true', 'yes', 'on'}
-        exclude_time_flag = request.form.get('exclude_time', '')
-        exclude_time = str(exclude_time_flag).lower() in {'1', 'true', 'yes', 'on'}
-        compact_flag = request.form.get('compact', '')
-        compact = str(compact_flag).lower() in {'1', 'true', 'yes', 'on'}
-        if compact:
-            exclude_time = True
-        stop_supply_raw = request.form.get('stop_supply')
-        stop_time_raw = request.form.get('stop_time')
-        stop_limit = int(stop_supply_raw) if stop_supply_raw and stop_supply_raw.isdigit() else None
-        time_limit = int(stop_time_raw) * 60 if stop_time_raw and stop_time_raw.isdigit() else None
-
-        # ----- pre‑build supply → time map (fallback look‑up) --------
-        supply_events = {}
-        for ev in replay.events:
-            if isinstance(ev, sc2reader.events.tracker.PlayerStatsEvent) and ev.pid == player.pid:
-                used = int(getattr(ev, 'food_used', 0))
-                made = int(getattr(ev, 'food_made', 0))
-                supply_events[ev.second] = (used, made)
-        supply_times = sorted(supply_events)
-
-        def get_supply(sec: int):
-            """Return (food_used, food_made) for the closest snapshot ≤ sec."""
-            if not supply_times:
-                return 0, 0
-            idx = bisect.bisect_right(supply_times, sec) - 1
-            return supply_events[supply_times[idx]] if idx >= 0 else (0, 0)
-
-        # ----- event filters ---------------------------------------
-        skip_units = {
-            "Egg", "Larva", "Overlord Cocoon", "Mule", "M U L E", "Scanner Sweep",
-            "Kd8Charge", "KD8Charge", "Broodling", "Changeling",
-        }
-        skip_units_lower = {s.lower() for s in skip_units}
-        skip_keywords = ["Creep Tumor", "CreepTumor", "Phase Shift", "PhaseShift"]
-        if exclude_workers:
-            skip_units.update({"Drone", "Probe", "SCV"})
-
-        # ----- speed factor for in‑game clock -----------------------
-        speed_factor = GAME_SPEED_FACTOR.get(replay.expansion, {}).get(replay.speed, 1.0)
-        if replay.expansion == "LotV" and replay.speed == "Faster" and speed_factor == 1.0:
-            speed_factor = 1.4
-
-        # ---- containers -------------------------------------------
-        entries = []
-        init_map = {}
-
-
-        # NEW: running supply snapshot (O(1) look‑ups) --------------
-        current_used = 0
-        current_made = 0
-        have_stats = False
-
-        # Pre-compute supply snapshots
-        frames_by_pid: Dict[int, List[int]] = defaultdict(list)
-        supply_by_pid: Dict[int, List[int]] = defaultdict(list)
-        for ev in replay.tracker_events:
-            if isinstance(ev, sc2reader.events.tracker.PlayerStatsEvent):
-                frames_by_pid[ev.pid].append(ev.frame)
-                supply_by_pid[ev.pid].append(int(ev.food_used))
-
-        # ✅ Ensure every player has a starting snapshot at frame 0
-        for p in players:
-            frames = frames_by_pid[p.pid]
-            supplies = supply_by_pid[p.pid]
-            if not frames or frames[0] > 0:
-                # If no snapshot exists, assume standard starting supply: 12 for SC2 LotV
-                starting_supply = 12 if p.play_race in ['Protoss', 'Terran', 'Zerg'] else 6
-                initial_supply = supplies[0] if supplies else starting_supply
-
-                frames.insert(0, 0)
-                supplies.insert(0, initial_supply)
-
-
-        def supply_at_frame(pid: int, frame: int) -> int:
-            """Return food_used for the last snapshot at or before frame."""
-            frames = frames_by_pid.get(pid)
-            supplies = supply_by_pid.get(pid)
-            if not frames:
-                return 0
-            idx = bisect.bisect_right(frames, frame) - 1
-            return supplies[idx] if idx >= 0 else 0
-
-        def supply_after_frame(pid: int, frame: int) -> int:
-            """Return food_used for the first snapshot strictly after frame."""
-            frames = frames_by_pid.get(pid)
-            supplies = supply_by_pid.get(pid)
-            if not frames:
-                return 0
-            idx = bisect.bisect_right(frames, frame)
-            if idx < len(supplies):
-                return supplies[idx]
-            return supplies[-1]
-
-
-        last_hallucination_frame = -9999
-        last_hallucination_pid = None
-        pending_hallucinations = []
-        roach_deaths = []  # (frame, supply, unit_id)
-        unit_supply_map = {}
-
-        # ---- iterate event stream --------------------------------
-        for event in replay.events:
-            if event.second == 0:
+    entries = tmp
+
+
+    # final sort ------------------------------------------------
+    entries.sort(key=lambda e: e.get('clock_sec', e.get('time', 0)))
+    return entries
+
+
+def render_build_lines(entries: List[Dict[str, Any]], options: Dict[str, Any]) -> List[str]:
+    """Collapse, sort and stringify extracted rows into build-order lines."""
+    exclude_supply = options['exclude_supply']
+    exclude_time = options['exclude_time']
+    compact = options['compact']
+    entries = collapse_entries(entries)
+
+    # ----- stringify build lines -------------------------------
+    build_lines = []
+    if compact:
+        i = 0
+        n = len(entries)
+        while i < n:
+            first = entries[i]
+            if first.get('type') == 'upgrade':
+                minutes, seconds = divmod(first.get('clock_sec', first.get('time', 0)), 60)
+                label = first.get('label', 'Unknown')
+
+                parts = []
+                if not exclude_supply:
+                    parts.append(str(first['supply']))
+                if not exclude_time:    
+                    parts.append(f"{minutes:02d}:{seconds:02d}")
+
+                prefix = f"[{' '.join(parts)}] " if parts else ""
+
+                build_lines.append(prefix + label)
+                i += 1
                 continue
 
-            # 🔍 Test all UnitTypeChangeEvents
-            if isinstance(event, sc2reader.events.tracker.UnitTypeChangeEvent):
-                print(f"🟢 Seen UnitTypeChangeEvent: {event}")
-                if getattr(event, "unit", None):
-                    print(f"   unit={event.unit}")
-                    print(f"   type_history={getattr(event.unit, 'type_history', None)}")
-
-            # ---- UnitDiedEvent: fallback for Roach → Ravager morph ----
-            if isinstance(event, sc2reader.events.tracker.UnitDiedEvent):
-                if getattr(event.unit, "owner", None) and event.unit.owner.pid == player.pid:
-                    unit_name = format_name(event.unit.name)
-                    if unit_name.lower() == "roach":
-                        roach_deaths.append((
-                            event.frame,
-                            supply_at_frame(player.pid, event.frame),
-                            event.unit_id
-                        ))
-                        print(f"🐛 Fallback: Tracked Roach death at frame {event.frame}")
-
-
-
-            
-            # ---- AbilityEvent or CommandEvent (safe for all versions) ----
-            if hasattr(event, "ability_name") and event.ability_name:
-                ability_name = event.ability_name
-                ability_lower = ability_name.lower()
-
-                if "hallucination" in ability_lower or "hallucinate" in ability_lower:
-                    unit_raw = None
-                    m = re.search(r"hallucinat(?:e|ion)[^A-Za-z]*([A-Za-z]+)", ability_name, re.I)
-                    if m:
-                        unit_raw = m.group(1)
-                    else:
-                        flat = re.sub(r"[^a-zA-Z]+", "", ability_lower)
-                        for u in HALLUCINATED_TYPE_COUNTS.keys():
-                            if u.replace(" ", "").lower() in flat:
-                                unit_raw = u
-                                break
-
-                    if unit_raw:
-                        unit_formatted = format_name(unit_raw)
-                        unit_lower = unit_formatted.lower()
-                        count = HALLUCINATED_TYPE_COUNTS.get(unit_formatted, 1)
-
-                        for _ in range(count):
-                            pending_hallucinations.append({
-                                "type": unit_formatted,
-                                "frame": event.frame,
-                                "pid": event.pid,
-                                "expiry": event.frame + HALLUCINATION_WINDOW_FRAMES
-                            })
-
-            # ------ capture live supply snapshot -------------------
-            if isinstance(event, sc2reader.events.tracker.PlayerStatsEvent) and event.pid == player.pid:
-                current_used = int(getattr(event, 'food_used', 0))
-                current_made = int(getattr(event, 'food_made', 0))
-                have_stats = True
-                # no continue – we still want to process other events on this frame
-
-
-            # ------ GET ability name for Chrono Boost -------------------
-            ability_raw = getattr(event, "ability_name", None)
-            ability = str(ability_raw) if ability_raw else ""
-    
 
-            # ----- global stop limits ------------------------------
-            game_time = int(event.second / speed_factor)  # in‑game seconds
-            if time_limit is not None and game_time > time_limit:
-                break
-            if stop_limit is not None and current_used > stop_limit:  # uses live snapshot
-                break
+            supply = first['supply']
+            made = first['made']
+            start_time = first['clock_sec']
+            units = []
+            while (
+                i < n
+                and entries[i]['kind'] == 'start'
+                and entries[i]['supply'] == supply
+                and entries[i]['clock_sec'] == start_time
+            ):
+                e = entries[i]
+                qty = e.get('count', 1)
+                label = f"{qty} {e['unit']}" if qty > 1 else e['unit']
+                units.append(label)
+                i += 1
+            parts = []
+            if not exclude_supply:
+                parts.append(str(supply))
+            prefix = f"[{' '.join(parts)}] " if parts else ""
+            build_lines.append(prefix + " + ".join(units))
+    else:
+        for item in entries:
+            if item.get('type') == 'upgrade':
+                minutes, seconds = divmod(item.get('clock_sec', item.get('time', 0)), 60)
+                label = item.get('label', 'Unknown')
 
+                parts = []
+                if not exclude_supply:
+                    parts.append(str(item['supply']))
+
+                if not exclude_time:
+                    parts.append(f"{minutes:02d}:{seconds:02d}")
+
+                prefix = f"[{' '.join(parts)}] " if parts else ""
+
+                build_lines.append(prefix + label)
+                continue
+
+            parts = []
+            if not exclude_supply:
+                parts.append(str(item['supply']))
+            if not exclude_time:
+                minutes, seconds = divmod(item.get('clock_sec', item.get('time', 0)), 60)
+                parts.append(f"{minutes:02d}:{seconds:02d}")
+            prefix = f"[{' '.join(parts)}] " if parts else ""
+            qty = item.get('count', 1)
+            label = f"{qty} {item['unit']}" if qty > 1 else item['unit']
+            build_lines.append(prefix + label)
+
+    # ---- oversupply correction ---------------------------------
+    try:
+        ov_idx = next(i for i, line in enumerate(build_lines)
+                     if re.search(r"\[14\]\s+.*Overlord", line))
+    except StopIteration:
+        ov_idx = None
+
+    if ov_idx is not None:
+        for j in range(ov_idx):
+            if re.match(r"\[15\]", build_lines[j]):
+                build_lines[j] = build_lines[j].replace("[15]", "[15/14]", 1)
+
+    return build_lines
+
+
+class NoPlayersError(LookupError):
+    pass
+
+
+def select_player(replay, requested: Optional[str]):
+    """The player matching ``requested`` (pid or name), else the first one."""
+    players = [p for p in replay.players if not p.is_observer]
+    if not players:
+        raise NoPlayersError('No player found in replay')
+    player = next((p for p in players if requested and (str(p.pid) == requested or p.name == requested)), None)
+    return player if player is not None else players[0]
 
-            # ---- AbilityEvent for warp-ins and Zerg morphs --------------------
-            if isinstance(event, ABILITY_EVENTS):
-                ability_name = getattr(event, "ability_name", "")
-                if not ability_name:
-                    continue
 
-                # Zerg morph abilities (Roach→Ravager, Hydra→Lurker)
-                if ability_name in {"MorphToRavager", "MorphToLurker"}:
-                    pid = getattr(event, "player", None).pid if getattr(event, "player", None) else event.pid
-                    if pid == player.pid:
-                        unit_name = "Ravager" if "Ravager" in ability_name else "Lurker"
-                        ingame_sec = frame_to_ingame_seconds(event.frame, replay)
-                        used_s = supply_at_frame(player.pid, event.frame) + 1
-                        entries.append({
-                            'clock_sec': int(ingame_sec),
-                            'supply': used_s,
-                            'made': current_made if have_stats else get_supply(event.second)[1],
-                            'unit': unit_name,
-                            'kind': 'start',
-                            'source': 'morph'
+def extract_entries(replay, options: Dict[str, Any], on_progress: Optional[ProgressCallback] = None,
+                    deadline: Optional[float] = None, annotate: bool = False):
+    """Walk the event stream and return ``(entries, truncated_sec)`` for one player.
+
+    ``entries`` are the raw timeline rows (see ``collapse_entries``).  Every
+    ``PROGRESS_EVERY_EVENTS`` events ``on_progress('progress', info)`` gets the
+    position in the event stream plus the rows extracted so far (``info['entries']``).
+    Past ``deadline`` (``time.monotonic()``) the walk stops early and
+    ``truncated_sec`` is the in-game second it stopped at, otherwise None.
+
+    With ``annotate`` every row also records what the filter options would have
+    decided (see ``filter_timeline``): ``event_sec`` and ``peak_supply`` of the
+    event that produced it and ``is_unit`` for rows ``exclude_units`` drops.
+    """
+    has_stargate = False
+
+    players = [p for p in replay.players if not p.is_observer]
+    player = select_player(replay, options.get('player'))
+
+    # ----- flags ------------------------------------------------
+    exclude_workers = options['exclude_workers']
+    exclude_units = options['exclude_units']
+    stop_limit = options['stop_limit']
+    time_limit = options['time_limit']
+
+    # ----- pre‑build supply → time map (fallback look‑up) --------
+    supply_events = {}
+    for ev in replay.events:
+        if isinstance(ev, sc2reader.events.tracker.PlayerStatsEvent) and ev.pid == player.pid:
+            used = int(getattr(ev, 'food_used', 0))
+            made = int(getattr(ev, 'food_made', 0))
+            supply_events[ev.second] = (used, made)
+    supply_times = sorted(supply_events)
+
+    def get_supply(sec: int):
+        """Return (food_used, food_made) for the closest snapshot ≤ sec."""
+        if not supply_times:
+            return 0, 0
+        idx = bisect.bisect_right(supply_times, sec) - 1
+        return supply_events[supply_times[idx]] if idx >= 0 else (0, 0)
+
+    # ----- event filters ---------------------------------------
+    skip_units = {
+        "Egg", "Larva", "Overlord Cocoon", "Mule", "M U L E", "Scanner Sweep",
+        "Kd8Charge", "KD8Charge", "Broodling", "Changeling",
+    }
+    skip_units_lower = {s.lower() for s in skip_units}
+    skip_keywords = ["Creep Tumor", "CreepTumor", "Phase Shift", "PhaseShift"]
+    if exclude_workers:
+        skip_units.update({"Drone", "Probe", "SCV"})
+
+    # ----- speed factor for in‑game clock -----------------------
+    speed_factor = GAME_SPEED_FACTOR.get(replay.expansion, {}).get(replay.speed, 1.0)
+    if replay.expansion == "LotV" and replay.speed == "Faster" and speed_factor == 1.0:
+        speed_factor = 1.4
+
+    game = game_data_for(replay)
+
+    # ---- containers -------------------------------------------
+    entries = []
+    init_map = {}
+
+
+    # NEW: running supply snapshot (O(1) look‑ups) --------------
+    current_used = 0
+    current_made = 0
+    have_stats = False
+
+    # Pre-compute supply snapshots
+    frames_by_pid: Dict[int, List[int]] = defaultdict(list)
+    supply_by_pid: Dict[int, List[int]] = defaultdict(list)
+    for ev in replay.tracker_events:
+        if isinstance(ev, sc2reader.events.tracker.PlayerStatsEvent):
+            frames_by_pid[ev.pid].append(ev.frame)
+            supply_by_pid[ev.pid].append(int(ev.food_used))
+
+    # ✅ Ensure every player has a starting snapshot at frame 0
+    for p in players:
+        frames = frames_by_pid[p.pid]
+        supplies = supply_by_pid[p.pid]
+        if not frames or frames[0] > 0:
+            # If no snapshot exists, assume standard starting supply: 12 for SC2 LotV
+            starting_supply = 12 if p.play_race in ['Protoss', 'Terran', 'Zerg'] else 6
+            initial_supply = supplies[0] if supplies else starting_supply
+
+            frames.insert(0, 0)
+            supplies.insert(0, initial_supply)
+
+
+    def supply_at_frame(pid: int, frame: int) -> int:
+        """Return food_used for the last snapshot at or before frame."""
+        frames = frames_by_pid.get(pid)
+        supplies = supply_by_pid.get(pid)
+        if not frames:
+            return 0
+        idx = bisect.bisect_right(frames, frame) - 1
+        return supplies[idx] if idx >= 0 else 0
+
+    def supply_after_frame(pid: int, frame: int) -> int:
+        """Return food_used for the first snapshot strictly after frame."""
+        frames = frames_by_pid.get(pid)
+        supplies = supply_by_pid.get(pid)
+        if not frames:
+            return 0
+        idx = bisect.bisect_right(frames, frame)
+        if idx < len(supplies):
+            return supplies[idx]
+        return supplies[-1]
+
+
+    last_hallucination_frame = -9999
+    last_hallucination_pid = None
+    pending_hallucinations = []
+    roach_deaths = []  # (frame, supply, unit_id)
+    unit_supply_map = {}
+
+    # ---- iterate event stream --------------------------------
+    total_events = len(replay.events)
+    truncated_sec = None
+    annotated = 0  # rows before this index carry event_sec / peak_supply
+    event_sec = peak_supply = 0
+    for event_index, event in enumerate(replay.events):
+        if annotate and annotated < len(entries):
+            for row in entries[annotated:]:
+                row['event_sec'] = event_sec
+                row['peak_supply'] = peak_supply
+            annotated = len(entries)
+
+        if (
+            deadline is not None
+            and event_index % DEADLINE_CHECK_EVENTS == 0
+            and time.monotonic() > deadline
+        ):
+            truncated_sec = int(event.second / speed_factor)
+            print(f"⏱️ Parse budget exceeded at {truncated_sec}s in-game")
+            break
+
+        if on_progress is not None and event_index % PROGRESS_EVERY_EVENTS == 0:
+            on_progress('progress', {
+                'done': event_index,
+                'total': total_events,
+                'game_time': int(event.second / speed_factor),
+                'entries': entries,
+            })
+
+        if event.second == 0:
+            continue
+
+        # 🔍 Test all UnitTypeChangeEvents
+        if isinstance(event, sc2reader.events.tracker.UnitTypeChangeEvent):
+            print(f"🟢 Seen UnitTypeChangeEvent: {event}")
+            if getattr(event, "unit", None):
+                print(f"   unit={event.unit}")
+                print(f"   type_history={getattr(event.unit, 'type_history', None)}")
+
+        # ---- UnitDiedEvent: fallback for Roach → Ravager morph ----
+        if isinstance(event, sc2reader.events.tracker.UnitDiedEvent):
+            if getattr(event.unit, "owner", None) and event.unit.owner.pid == player.pid:
+                unit_name = format_name(event.unit.name)
+                if unit_name.lower() == "roach":
+                    roach_deaths.append((
+                        event.frame,
+                        supply_at_frame(player.pid, event.frame),
+                        event.unit_id
+                    ))
+                    print(f"🐛 Fallback: Tracked Roach death at frame {event.frame}")
+
+
+
+        
+        # ---- AbilityEvent or CommandEvent (safe for all versions) ----
+        if hasattr(event, "ability_name") and event.ability_name:
+            ability_name = event.ability_name
+            ability_lower = ability_name.lower()
+
+            if "hallucination" in ability_lower or "hallucinate" in ability_lower:
+                unit_raw = None
+                m = re.search(r"hallucinat(?:e|ion)[^A-Za-z]*([A-Za-z]+)", ability_name, re.I)
+                if m:
+                    unit_raw = m.group(1)
+                else:
+                    flat = re.sub(r"[^a-zA-Z]+", "", ability_lower)
+                    for u in HALLUCINATED_TYPE_COUNTS.keys():
+                        if u.replace(" ", "").lower() in flat:
+                            unit_raw = u
+                            break
+
+                if unit_raw:
+                    unit_formatted = format_name(unit_raw)
+                    unit_lower = unit_formatted.lower()
+                    count = HALLUCINATED_TYPE_COUNTS.get(unit_formatted, 1)
+
+                    for _ in range(count):
+                        pending_hallucinations.append({
+                            "type": unit_formatted,
+                            "frame": event.frame,
+                            "pid": event.pid,
+                            "expiry": event.frame + HALLUCINATION_WINDOW_FRAMES
                         })
-                    continue
 
-                # Only handle Protoss warp-ins
-                if "Warp" in ability_name and ("Zealot" in ability_name or "Stalker" in ability_name or "Sentry" in ability_name or "Adept" in ability_name or "Dark Templar" in ability_name or "High Templar" in ability_name):
-                    name = format_name(ability_name)
-                    name = tidy(name)
-                    if name is None:
-                        continue
+        # ------ capture live supply snapshot -------------------
+        if isinstance(event, sc2reader.events.tracker.PlayerStatsEvent) and event.pid == player.pid:
+            current_used = int(getattr(event, 'food_used', 0))
+            current_made = int(getattr(event, 'food_made', 0))
+            have_stats = True
+            # no continue – we still want to process other events on this frame
 
-                    # ✅ Normalize warp-in names
-                    name = base_unit_name(name)
 
-                    # Snapshot supply at the moment the player clicked warp-in
-                    ingame_sec = frame_to_ingame_seconds(event.frame, replay)
-                    used_s = supply_at_frame(player.pid, event.frame)
+        # ------ GET ability name for Chrono Boost -------------------
+        ability_raw = getattr(event, "ability_name", None)
+        ability = str(ability_raw) if ability_raw else ""
+    
+
+        # ----- global stop limits ------------------------------
+        game_time = int(event.second / speed_factor)  # in‑game seconds
+        if time_limit is not None and game_time > time_limit:
+            break
+        if stop_limit is not None and current_used > stop_limit:  # uses live snapshot
+            break
+        event_sec = game_time
+        peak_supply = max(peak_supply, current_used)
+
 
+        # ---- AbilityEvent for warp-ins and Zerg morphs --------------------
+        if isinstance(event, ABILITY_EVENTS):
+            ability_name = getattr(event, "ability_name", "")
+            if not ability_name:
+                continue
+
+            # Zerg morph abilities (Roach→Ravager, Hydra→Lurker)
+            if ability_name in {"MorphToRavager", "MorphToLurker"}:
+                pid = getattr(event, "player", None).pid if getattr(event, "player", None) else event.pid
+                if pid == player.pid:
+                    unit_name = "Ravager" if "Ravager" in ability_name else "Lurker"
+                    ingame_sec = frame_to_ingame_seconds(event.frame, replay)
+                    used_s = supply_at_frame(player.pid, event.frame) + 1
                     entries.append({
                         'clock_sec': int(ingame_sec),
                         'supply': used_s,
                         'made': current_made if have_stats else get_supply(event.second)[1],
-                        'unit': name,
+                        'unit': unit_name,
                         'kind': 'start',
-                        'source': 'warp-in'  # new!
+                        'source': 'morph'
                     })
+                continue
 
-            # ---- UnitBornEvent ------------------------------------
-            if isinstance(event, sc2reader.events.tracker.UnitBornEvent):
-                if getattr(event, "control_pid", None) != player.pid:
-                    continue
-
-                unit = event.unit
-                if getattr(unit, "is_building", False):
-                    continue
-                if exclude_units:
-                    continue
-
-                name = format_name(event.unit_type_name)
-                base_type_name = re.sub(r'^Hallucinated\s+', '', name, flags=re.I)
-
-                # Skip morph results handled via abilities
-                if base_type_name in {"Ravager", "Lurker"}:
+            # Only handle Protoss warp-ins
+            if "Warp" in ability_name and ("Zealot" in ability_name or "Stalker" in ability_name or "Sentry" in ability_name or "Adept" in ability_name or "Dark Templar" in ability_name or "High Templar" in ability_name):
+                name = format_name(ability_name)
+                name = tidy(name)
+                if name is None:
                     continue
 
-                hallucinated = getattr(event.unit, "is_hallucination", False)
-                slot_match_found = False
-
-                # ✅ Slot match for illusions
-                if not hallucinated:
-                    for pending in pending_hallucinations:
-                        frame_diff = event.frame - pending["frame"]
-                        if (
-                            frame_diff >= 0 and frame_diff <= HALLUCINATION_WINDOW_FRAMES
-                            and event.control_pid == pending["pid"]
-                            and base_type_name.lower() == pending["type"].lower()
-                        ):
-                            hallucinated = True
-                            slot_match_found = True
-                            pending_hallucinations.remove(pending)
-                            break
+                # ✅ Normalize warp-in names
+                name = base_unit_name(name)
 
-                # ✅ Fallback: Phoenix / Oracle only + Stargate logic
-                if not hallucinated and base_type_name in {"Phoenix", "Oracle"}:
-                    prev_supply = supply_at_frame(event.control_pid, event.frame - 32)
-                    next_supply = supply_after_frame(event.control_pid, event.frame + 32)
-                    print(f"Unit: {name}, Frame: {event.frame}, Prev: {prev_supply}, Next: {next_supply}")
+                # Snapshot supply at the moment the player clicked warp-in
+                ingame_sec = frame_to_ingame_seconds(event.frame, replay)
+                used_s = supply_at_frame(player.pid, event.frame)
 
-                    if prev_supply == next_supply or not has_stargate:
-                        hallucinated = True
+                entries.append({
+                    'clock_sec': int(ingame_sec),
+                    'supply': used_s,
+                    'made': current_made if have_stats else get_supply(event.second)[1],
+                    'unit': name,
+                    'kind': 'start',
+                    'source': 'warp-in'  # new!
+                })
 
-                if hallucinated:
-                    event.unit.is_hallucination = True
-                    name += " (hallucination)"
+        # ---- UnitBornEvent ------------------------------------
+        if isinstance(event, sc2reader.events.tracker.UnitBornEvent):
+            if getattr(event, "control_pid", None) != player.pid:
+                continue
 
-                name = tidy(name)
-                if name is None:
-                    continue
+            unit = event.unit
+            if getattr(unit, "is_building", False):
+                continue
+            if exclude_units:
+                continue
 
-                lower_name = name.lower()
-                if (
-                    not name
-                    or "Beacon" in name
-                    or name in skip_units
-                    or lower_name in skip_units_lower
-                    or any(k.lower() in lower_name for k in skip_keywords)
-                ):
-                    continue
+            unit_record = game.unit_for(event)
+            name = unit_record.name
+            base_type_name = unit_record.base_name
 
-                # ✅ Normal supply logic
-                unit_name_lower = name.lower()
-                if unit_name_lower in ["probe", "drone", "scv"]:
-                    start_frame = event.frame
-                    start_ingame_sec = frame_to_ingame_seconds(start_frame, replay) - 12
-                    used_s = supply_at_frame(player.pid, start_frame) - 1
-
-                elif unit_name_lower in [
-                    "zealot", "stalker", "sentry", "adept", "dark templar", "high templar"
-                ]:
-                    fallback_ok = True
-                    born_ingame_sec = frame_to_ingame_seconds(event.frame, replay)
-                    for e in entries:
-                        if (
-                            e['unit'] == name
-                            and abs(e['clock_sec'] - int(born_ingame_sec)) <= 1
-                            and e.get('source') == 'warp-in'
-                        ):
-                            fallback_ok = False
-                            break
+            # Skip morph results handled via abilities
+            if base_type_name in {"Ravager", "Lurker"}:
+                continue
 
-                    if fallback_ok:
-                        build_time = BUILD_TIME.get(event.unit_type_name, 0)
-                        fps = replay.game_fps
-                        born_frame = event.frame
-                        build_frames = int(build_time * fps)
-                        start_frame = max(born_frame - build_frames, 0)
-
-                        start_ingame_sec = frame_to_ingame_seconds(start_frame, replay) - 6
-                        used_s = supply_at_frame(player.pid, start_frame)
-
-                        if unit_name_lower in [
-                            "sentry", "stalker", "adept", "dark templar", "high templar"
-                        ]:
-                            used_s -= 2
-                        elif unit_name_lower == "zealot":
-                            used_s -= 1
-                    else:
-                        continue
+            hallucinated = getattr(event.unit, "is_hallucination", False)
+            slot_match_found = False
+
+            # ✅ Slot match for illusions
+            if not hallucinated:
+                for pending in pending_hallucinations:
+                    frame_diff = event.frame - pending["frame"]
+                    if (
+                        frame_diff >= 0 and frame_diff <= HALLUCINATION_WINDOW_FRAMES
+                        and event.control_pid == pending["pid"]
+                        and base_type_name.lower() == pending["type"].lower()
+                    ):
+                        hallucinated = True
+                        slot_match_found = True
+                        pending_hallucinations.remove(pending)
+                        break
+
+            # ✅ Fallback: Phoenix / Oracle only + Stargate logic
+            if not hallucinated and base_type_name in {"Phoenix", "Oracle"}:
+                prev_supply = supply_at_frame(event.control_pid, event.frame - 32)
+                next_supply = supply_after_frame(event.control_pid, event.frame + 32)
+                print(f"Unit: {name}, Frame: {event.frame}, Prev: {prev_supply}, Next: {next_supply}")
+
+                if prev_supply == next_supply or not has_stargate:
+                    hallucinated = True
+
+            if hallucinated:
+                event.unit.is_hallucination = True
+                name = tidy(name + " (hallucination)")
+            else:
+                name = unit_record.label
+            if name is None:
+                continue
 
-                else:
-                    build_time = BUILD_TIME.get(event.unit_type_name, 0)
-                    if build_time == 0:
-                        continue
+            lower_name = name.lower()
+            if (
+                not name
+                or "Beacon" in name
+                or name in skip_units
+                or lower_name in skip_units_lower
+                or any(k.lower() in lower_name for k in skip_keywords)
+            ):
+                continue
 
+            # ✅ Normal supply logic
+            unit_name_lower = name.lower()
+            if unit_name_lower in ["probe", "drone", "scv"]:
+                start_frame = event.frame
+                start_ingame_sec = frame_to_ingame_seconds(start_frame, replay) - 12
+                used_s = supply_at_frame(player.pid, start_frame) - 1
+
+            elif unit_name_lower in [
+                "zealot", "stalker", "sentry", "adept", "dark templar", "high templar"
+            ]:
+                fallback_ok = True
+                born_ingame_sec = frame_to_ingame_seconds(event.frame, replay)
+                for e in entries:
+                    if (
+                        e['unit'] == name
+                        and abs(e['clock_sec'] - int(born_ingame_sec)) <= 1
+                        and e.get('source') == 'warp-in'
+                    ):
+                        fallback_ok = False
+                        break
+
+                if fallback_ok:
+                    build_time = unit_record.build_time
                     fps = replay.game_fps
                     born_frame = event.frame
                     build_frames = int(build_time * fps)
                     start_frame = max(born_frame - build_frames, 0)
-                    start_ingame_sec = frame_to_ingame_seconds(start_frame, replay)
+
+                    start_ingame_sec = frame_to_ingame_seconds(start_frame, replay) - 6
                     used_s = supply_at_frame(player.pid, start_frame)
-                    # Normal Roach or other unit born logic:
-                    unit_id = event.unit_id
-                    supply_at = supply_at_frame(player.pid, event.frame)
-                    unit_supply_map[unit_id] = supply_at  # ✅ store exact supply for this unit
 
-                entries.append({
-                    'clock_sec': int(start_ingame_sec),
-                    'supply': used_s,
-                    'made': current_made if have_stats else get_supply(event.second)[1],
-                    'unit': name,
-                    'kind': 'start'
-                })
-                # ✅ Fallback: match Ravager Cocoon births to Roach deaths
-                # ✅ Fallback: match Ravager Cocoon births to Roach deaths
-                if name.lower() == "ravager cocoon":
-                    cocoon_frame = event.frame
-                    match = None
-                    for death_frame, death_supply, unit_id in roach_deaths:
-                        if abs(cocoon_frame - death_frame) <= 280:
-                            match = (death_frame, death_supply, unit_id)
-                            break
+                    if unit_name_lower in [
+                        "sentry", "stalker", "adept", "dark templar", "high templar"
+                    ]:
+                        used_s -= 2
+                    elif unit_name_lower == "zealot":
+                        used_s -= 1
+                else:
+                    continue
 
-                    if match:
-                        roach_supply = match[1]
-                        ravager_supply = roach_supply + 1
-                        entries.append({
-                            'clock_sec': int(frame_to_ingame_seconds(cocoon_frame, replay)),
-                            'supply': ravager_supply,
-                            'made': current_made if have_stats else get_supply(event.second)[1],
-                            'unit': 'Ravager',
-                            'kind': 'start',
-                        })
-                        print(f"✅ Fallback: Added Ravager from Roach supply {roach_supply} → {ravager_supply}")
-                        roach_deaths.remove(match)
+            else:
+                build_time = unit_record.build_time
+                if build_time == 0:
+                    continue
 
+                fps = replay.game_fps
+                born_frame = event.frame
+                build_frames = int(build_time * fps)
+                start_frame = max(born_frame - build_frames, 0)
+                start_ingame_sec = frame_to_ingame_seconds(start_frame, replay)
+                used_s = supply_at_frame(player.pid, start_frame)
+                # Normal Roach or other unit born logic:
+                unit_id = event.unit_id
+                supply_at = supply_at_frame(player.pid, event.frame)
+                unit_supply_map[unit_id] = supply_at  # ✅ store exact supply for this unit
+
+            entries.append({
+                'clock_sec': int(start_ingame_sec),
+                'supply': used_s,
+                'made': current_made if have_stats else get_supply(event.second)[1],
+                'unit': name,
+                'kind': 'start'
+            })
+            if annotate:
+                entries[-1]['is_unit'] = True
+            # ✅ Fallback: match Ravager Cocoon births to Roach deaths
+            # ✅ Fallback: match Ravager Cocoon births to Roach deaths
+            if name.lower() == "ravager cocoon":
+                cocoon_frame = event.frame
+                match = None
+                for death_frame, death_supply, unit_id in roach_deaths:
+                    if abs(cocoon_frame - death_frame) <= 280:
+                        match = (death_frame, death_supply, unit_id)
+                        break
+
+                if match:
+                    roach_supply = match[1]
+                    ravager_supply = roach_supply + 1
+                    entries.append({
+                        'clock_sec': int(frame_to_ingame_seconds(cocoon_frame, replay)),
+                        'supply': ravager_supply,
+                        'made': current_made if have_stats else get_supply(event.second)[1],
+                        'unit': 'Ravager',
+                        'kind': 'start',
+                    })
+                    if annotate:
+                        entries[-1]['is_unit'] = True
+                    print(f"✅ Fallback: Added Ravager from Roach supply {roach_supply} → {ravager_supply}")
+                    roach_deaths.remove(match)
 
 
 
@@ -874,255 +1556,1153 @@ def upload():
 
 
 
-            # ---- UnitInitEvent ------------------------------------
-            if isinstance(event, sc2reader.events.tracker.UnitInitEvent):
-                if event.control_pid != player.pid:
-                    continue
 
-                unit = event.unit
-                name = format_name(event.unit_type_name)
+        # ---- UnitInitEvent ------------------------------------
+        if isinstance(event, sc2reader.events.tracker.UnitInitEvent):
+            if event.control_pid != player.pid:
+                continue
 
-                # ✅ Track if a Stargate has been built
-                if "stargate" in name.lower():
-                    has_stargate = True
+            unit = event.unit
+            unit_record = game.unit_for(event)
+            name = unit_record.name
 
-                # --- skip workers & illusions for buildings ---
-                if not getattr(unit, "is_building", False) and exclude_units:
-                    continue
+            # ✅ Track if a Stargate has been built
+            if "stargate" in name.lower():
+                has_stargate = True
 
-                unit_type_name = format_name(event.unit_type_name)
-                base_type_name = re.sub(r'^Hallucinated\s+', '', unit_type_name, flags=re.I)
+            # --- skip workers & illusions for buildings ---
+            if not getattr(unit, "is_building", False) and exclude_units:
+                continue
 
-                hallucinated = getattr(event.unit, "is_hallucination", False)
-                pending_hallucinations = [p for p in pending_hallucinations if p["expiry"] >= event.frame]
+            base_type_name = unit_record.base_name
 
-                unit_lower = base_type_name.lower()
+            hallucinated = getattr(event.unit, "is_hallucination", False)
+            pending_hallucinations = [p for p in pending_hallucinations if p["expiry"] >= event.frame]
 
-                # ✅ Slot match for illusions
-                if not hallucinated:
-                    for pending in pending_hallucinations:
-                        if pending["type"].lower() == unit_lower:
-                            hallucinated = True
-                            pending_hallucinations.remove(pending)
-                            break
+            unit_lower = base_type_name.lower()
 
-                # ✅ Fallback (buildings rarely hallucinated — safe to skip fallback)
+            # ✅ Slot match for illusions
+            if not hallucinated:
+                for pending in pending_hallucinations:
+                    if pending["type"].lower() == unit_lower:
+                        hallucinated = True
+                        pending_hallucinations.remove(pending)
+                        break
 
-                if hallucinated:
-                    event.unit.is_hallucination = True
-                    name += " (hallucination)"
+            # ✅ Fallback (buildings rarely hallucinated — safe to skip fallback)
 
-                name = tidy(name)
-                if name is None:
-                    continue
+            if hallucinated:
+                event.unit.is_hallucination = True
+                name = tidy(name + " (hallucination)")
+            else:
+                name = unit_record.label
+            if name is None:
+                continue
 
-                lower_name = name.lower()
-                if (
-                    not name
-                    or "Beacon" in name
-                    or name in skip_units
-                    or lower_name in skip_units_lower
-                    or any(k.lower() in lower_name for k in skip_keywords)
-                ):
-                    continue
+            lower_name = name.lower()
+            if (
+                not name
+                or "Beacon" in name
+                or name in skip_units
+                or lower_name in skip_units_lower
+                or any(k.lower() in lower_name for k in skip_keywords)
+            ):
+                continue
 
-                # ✅ Frame-based structure start
-                init_frame = event.frame
-                init_ingame_sec = frame_to_ingame_seconds(init_frame, replay)
-                supply_at_start = supply_at_frame(player.pid, init_frame)
+            # ✅ Frame-based structure start
+            init_frame = event.frame
+            init_ingame_sec = frame_to_ingame_seconds(init_frame, replay)
+            supply_at_start = supply_at_frame(player.pid, init_frame)
 
-                init_map[event.unit_id] = name
+            init_map[event.unit_id] = name
 
-                entries.append({
-                    'clock_sec': int(init_ingame_sec),
-                    'supply': supply_at_start,
-                    'made': current_made if have_stats else get_supply(event.second)[1],
-                    'unit': name,
-                    'kind': 'start'
-                })
-                continue
+            entries.append({
+                'clock_sec': int(init_ingame_sec),
+                'supply': supply_at_start,
+                'made': current_made if have_stats else get_supply(event.second)[1],
+                'unit': name,
+                'kind': 'start'
+            })
+            if annotate and not getattr(unit, "is_building", False):
+                entries[-1]['is_unit'] = True
+            continue
 
 
 
-            # ---- UnitDoneEvent ------------------------------------
-            if isinstance(event, sc2reader.events.tracker.UnitDoneEvent):
-                if event.unit_id in init_map:
-                    name = init_map[event.unit_id]
-                    entries.append({'clock_sec': int(event.second / speed_factor), 'supply': current_used if have_stats else get_supply(event.second)[0], 'made': current_made if have_stats else get_supply(event.second)[1], 'unit': name, 'kind': 'finish'})
+        # ---- UnitDoneEvent ------------------------------------
+        if isinstance(event, sc2reader.events.tracker.UnitDoneEvent):
+            if event.unit_id in init_map:
+                name = init_map[event.unit_id]
+                entries.append({'clock_sec': int(event.second / speed_factor), 'supply': current_used if have_stats else get_supply(event.second)[0], 'made': current_made if have_stats else get_supply(event.second)[1], 'unit': name, 'kind': 'finish'})
+            continue
+
+        # ---- UpgradeCompleteEvent -----------------------------------------
+        if isinstance(event, sc2reader.events.tracker.UpgradeCompleteEvent):
+            if event.pid != player.pid:
                 continue
 
-            # ---- UpgradeCompleteEvent -----------------------------------------
-            if isinstance(event, sc2reader.events.tracker.UpgradeCompleteEvent):
-                if event.pid != player.pid:
-                    continue
+            upgrade = upgrade_record(event.upgrade_type_name)
+            if upgrade is None:
+                continue
 
-                name = tidy(event.upgrade_type_name)
-                if name is None:
-                    continue
+            mapped_name = upgrade.name
+            duration_secs = upgrade.research_time
 
-                mapped_name = upgrade_name_map.get(name, name)
+            frame_sec = frame_to_ingame_seconds(event.frame, replay)
 
-                duration_secs = upgrade_times.get(mapped_name)
+            if duration_secs:
+                start_real = frame_sec - duration_secs
+                boosted_secs = 0.0
+            else:
+                start_real = frame_sec
 
-                frame_sec = frame_to_ingame_seconds(event.frame, replay)
 
-                if duration_secs:
-                    start_real = frame_sec - duration_secs
-                    boosted_secs = 0.0
-                else:
-                    start_real = frame_sec
+            start_frame = int(start_real * replay.game_fps * speed_factor)
+            idx = bisect.bisect_right(frames_by_pid[player.pid], start_frame) - 1
 
+            if idx >= 0 and (start_frame - frames_by_pid[player.pid][idx]) <= 4:
+                used_s = supply_by_pid[player.pid][idx]
+                made_s = 0
+            else:
+                real_sec = start_real * speed_factor
+                used_s, made_s = get_supply(real_sec)
+
+
+            entries.append({
+                'clock_sec': int(start_real),
+                'supply': used_s,
+                'made': made_s,
+                'unit': mapped_name,
+                'kind': 'start',
+                'type': 'upgrade',
+                'label': mapped_name
+            })
+
+    if annotate:
+        for row in entries[annotated:]:
+            row['event_sec'] = event_sec
+            row['peak_supply'] = peak_supply
+    return entries, truncated_sec
+
+
+def build_order_result(entries: List[Dict[str, Any]], truncated_sec: Optional[int], options: Dict[str, Any]):
+    """``(body, status)`` for extracted rows, marking budget-truncated parses."""
+    build_lines = render_build_lines(entries, options)
+    if truncated_sec is not None:
+        minutes, seconds = divmod(truncated_sec, 60)
+        build_lines.append(f"# truncated at {minutes:02d}:{seconds:02d} (parse time budget exceeded)")
+    return '\n'.join(build_lines), 200
+
+
+def extract_build_order(replay, options: Dict[str, Any], on_progress: Optional[ProgressCallback] = None,
+                        deadline: Optional[float] = None, on_timeline: Optional[Callable[[bytes], None]] = None):
+    """Turn a loaded replay into build-order text; returns ``(body, status)``.
+
+    A parse cut short by ``deadline`` ends in a ``# truncated at`` line.  A
+    complete parse hands its encoded rows to ``on_timeline`` if given.
+    """
+    try:
+        entries, truncated_sec = extract_entries(replay, options, on_progress, deadline)
+        if on_timeline is not None and truncated_sec is None:
+            on_timeline(encode_timeline(entries))
+        return build_order_result(entries, truncated_sec, options)
+    except NoPlayersError:
+        return 'No player found in replay', 400
+    except Exception as e:
+        print("❌ Error while processing events:", e)
+        return f'Failed to parse replay: {e}', 500
 
-                start_frame = int(start_real * replay.game_fps * speed_factor)
-                idx = bisect.bisect_right(frames_by_pid[player.pid], start_frame) - 1
 
-                if idx >= 0 and (start_frame - frames_by_pid[player.pid][idx]) <= 4:
-                    used_s = supply_by_pid[player.pid][idx]
-                    made_s = 0
-                else:
-                    real_sec = start_real * speed_factor
-                    used_s, made_s = get_supply(real_sec)
+def cached_build_order(sha: str, data: Optional[bytes], options: Dict[str, Any],
+                       on_progress: Optional[ProgressCallback] = None):
+    """Serve ``(body, status, cache_state)`` from the caches or parse ``data``.
 
+    ``data`` may be None when the replay's ``format=json`` timelines are cached;
+    if every cache misses after all, the answer is a 404.
+    """
+    key = (sha, options_key(options))
+    text = result_cache.get(key)
+    if text is not None:
+        return text, 200, 'hit'
+    tkey = timeline_key(sha, options)
+    blob = timeline_cache.get(tkey)
+    if blob is not None:
+        body, _ = build_order_result(decode_timeline(blob), None, options)
+        result_cache.put(key, body)
+        return body, 200, 'hit'
+    document = result_cache.get((sha, TIMELINES_KEY))
+    if document is not None:
+        if not document['players']:
+            return 'No player found in replay', 400, 'hit'
+        player = timeline_player(document, options.get('player'))
+        body, _ = build_order_result(timeline_entries(player['timeline'], options), None, options)
+        result_cache.put(key, body)
+        return body, 200, 'hit'
+    if data is None:
+        return 'Replay not found, upload it first', 404, 'miss'
+    with parse_slot('upload', len(data)):
+        if ISOLATE_PARSES and on_progress is None:
+            # the worker sends the rows back; its own caches die with it
+            body, status, blob = worker_result(workers.submit_upload(data, options))
+            if blob is not None:
+                timeline_cache.put(tkey, blob)
+        else:
+            body, status = build_order_for_bytes(data, options, on_progress, partial(timeline_cache.put, tkey))
+    if status == 200 and truncated_at(body) is None:
+        result_cache.put(key, body)
+    return body, status, 'miss'
+
+
+# ---- structured timelines (format=json) ---------------------------
+# ``format=json`` on /upload and /upload/hash answers with every player's
+# timeline extracted once *without* the filter options, so the client can apply
+# exclude_* / stop limits and render the text itself (README "Rendering a
+# timeline", src/js/modules/replayTimeline.js) – changing an option then costs
+# no request at all.  Each row is a start row as ``extract_entries`` produces it
+# plus:
+#   event_sec    in-game second of the event that produced the row (stop_time)
+#   peak_supply  highest supply seen up to that event (stop_supply)
+#   flags        any of 'unit' (dropped by exclude_units), 'worker'
+#                (exclude_workers), 'upgrade', 'hallucination'
+# ``timeline_entries`` + ``build_order_result`` are the reference renderer.
+TIMELINE_FORMAT_VERSION = 1
+TIMELINES_KEY = 'timelines'  # result_cache key next to the options keys
+WORKER_UNITS = frozenset({'Drone', 'Probe', 'SCV'})
+UNFILTERED_OPTIONS = {'exclude_workers': False, 'exclude_units': False, 'stop_limit': None, 'time_limit': None}
+
+
+def timeline_row(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """An annotated ``extract_entries`` row in the ``format=json`` shape."""
+    row = {key: entry[key] for key in ('unit', 'kind', 'clock_sec', 'supply', 'made', 'event_sec', 'peak_supply')}
+    if 'source' in entry:
+        row['source'] = entry['source']
+    upgrade = entry.get('type') == 'upgrade'
+    flags = []
+    if entry.get('is_unit'):
+        flags.append('unit')
+    if entry['unit'] in WORKER_UNITS and not upgrade:
+        flags.append('worker')
+    if upgrade:
+        flags.append('upgrade')
+    if entry['unit'].endswith('(hallucination)'):
+        flags.append('hallucination')
+    if flags:
+        row['flags'] = flags
+    return row
+
+
+def timeline_entries(rows: List[Dict[str, Any]], options: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The rows ``extract_entries(replay, options)`` would have kept, from a
+    ``format=json`` timeline (finish rows aside – they never render)."""
+    entries = []
+    for row in rows:
+        flags = row.get('flags', ())
+        if options['time_limit'] is not None and row['event_sec'] > options['time_limit']:
+            continue
+        if options['stop_limit'] is not None and row['peak_supply'] > options['stop_limit']:
+            continue
+        if (options['exclude_units'] and 'unit' in flags) or (options['exclude_workers'] and 'worker' in flags):
+            continue
+        entry = {key: row[key] for key in ('clock_sec', 'supply', 'made', 'unit', 'kind')}
+        if 'source' in row:
+            entry['source'] = row['source']
+        if 'upgrade' in flags:
+            entry['type'] = 'upgrade'
+            entry['label'] = row['unit']
+        entries.append(entry)
+    return entries
+
+
+def timeline_player(document: Dict[str, Any], requested: Optional[str]) -> Dict[str, Any]:
+    """``select_player`` over a timeline document's players."""
+    players = document['players']
+    match = next((p for p in players if requested and (str(p['pid']) == requested or p['name'] == requested)), None)
+    return match if match is not None else players[0]
+
+
+def timeline_document(data: bytes, time_budget: Optional[float] = None) -> Dict[str, Any]:
+    """Every player's unfiltered, annotated timeline (the ``format=json`` body).
+
+    A player cut short by ``time_budget`` gets ``truncated_at``.  Raises if the
+    replay cannot be loaded.
+    """
+    deadline = time.monotonic() + time_budget if time_budget else None
+    with loaded_replay(data) as replay:
+        info, matchup = player_summary(replay)
+        length = replay.game_length.seconds
+        for player in info:
+            entries, truncated_sec = extract_entries(
+                replay, dict(UNFILTERED_OPTIONS, player=str(player['pid'])), deadline=deadline, annotate=True)
+            player['timeline'] = [timeline_row(e) for e in entries if e['kind'] == 'start']
+            if truncated_sec is not None:
+                player['truncated_at'] = f'{truncated_sec // 60:02d}:{truncated_sec % 60:02d}'
+    return {
+        'version': TIMELINE_FORMAT_VERSION,
+        'players': info,
+        'matchup': matchup,
+        'length': length,
+    }
+
+
+def json_requested() -> bool:
+    return request.values.get('format') == 'json'
+
+
+def timelines_response(sha: str, data: Optional[bytes]):
+    """The ``format=json`` response; ``data`` may be None when it is cached."""
+    document = result_cache.get((sha, TIMELINES_KEY))
+    cache_state = 'hit'
+    if document is None:
+        cache_state = 'miss'
+        try:
+            with parse_slot('upload', len(data)):
+                if ISOLATE_PARSES:
+                    document = worker_result(workers.submit_timelines(data, PARSE_TIME_BUDGET))
+                else:
+                    document = timeline_document(data, PARSE_TIME_BUDGET)
+        except (QueueFull, RateLimited, workers.ResourceLimitExceeded):
+            raise
+        except Exception as e:
+            print("❌ Failed to load replay:", e)
+            return f'Failed to load replay: {e}', 400
+        if not any('truncated_at' in p for p in document['players']):
+            result_cache.put((sha, TIMELINES_KEY), document)
+    headers = {'X-Replay-SHA256': sha, 'X-Replay-Cache': cache_state}
+    cuts = [p['truncated_at'] for p in document['players'] if 'truncated_at' in p]
+    if cuts:
+        headers.update({'X-Parse-Truncated': min(cuts), 'Cache-Control': 'no-store'})
+    return jsonify(dict(document, sha256=sha)), 200, headers
+
+
+# ---- opt-in profiling ---------------------------------------------
+# ``profile=1`` on /upload re-runs the parse (bypassing the caches) under cProfile
+# and tracemalloc, dumps the stats to PROFILE_DIR named by replay hash and adds an
+# X-Profile summary header.  It needs the PROFILE_TOKEN in X-Profile-Token, or
+# PROFILE_REQUESTS=1 to allow it for everyone (local debugging only).
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS') == '1'
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+
+
+def profile_requested() -> bool:
+    return str(request.values.get('profile', '')).lower() in {'1', 'true', 'yes', 'on'}
+
+
+def profile_allowed() -> bool:
+    if PROFILE_REQUESTS:
+        return True
+    token = request.headers.get('X-Profile-Token', '')
+    return bool(PROFILE_TOKEN) and hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode())
+
+
+def profiled_build_order(sha: str, data: bytes, options: Dict[str, Any]):
+    try:
+        with parse_slot('upload', len(data)):
+            (body, status), summary = profile_call(
+                lambda: build_order_for_bytes(data, options), PROFILE_DIR, sha)
+    except ProfileBusy as e:
+        return str(e), 409
+    metrics.inc('parser_profiled_total')
+    print(f"🔬 Profiled {sha[:12]}: {summary_header(summary)}")
+    headers = result_headers(sha, body, 'bypass')
+    headers['X-Profile'] = summary_header(summary)
+    return body, status, headers
+
+
+@app.route('/admin/profile/collapsed')
+def sampled_stacks():
+    """Aggregated parse stacks in collapsed format; ``reset=1`` starts a new window."""
+    if not profile_allowed():
+        return 'Forbidden', 403
+    reset = str(request.args.get('reset', '')).lower() in {'1', 'true', 'yes', 'on'}
+    headers = {
+        'Content-Type': 'text/plain; charset=utf-8',
+        'X-Sampler-Samples': str(sampler.samples),
+        'X-Sampler-Overhead': f'{sampler.overhead_ratio():.4%}',
+    }
+    return sampler.collapsed(reset), 200, headers
 
-                entries.append({
-                    'clock_sec': int(start_real),
-                    'supply': used_s,
-                    'made': made_s,
-                    'unit': mapped_name,
-                    'kind': 'start',
-                    'type': 'upgrade',
-                    'label': mapped_name
-                })
 
+@app.route('/upload', methods=['POST'])
+def upload():
+    if 'replay' not in request.files:
+        return 'No replay uploaded', 400
 
-        # keep only start rows --------------------------------------
-        entries = [
-            e for e in entries
-            if (e.get('kind') == 'start') or (e.get('type') == 'upgrade')
-        ]
-
-        # collapse identical supply+unit rows (units only) ----------
-        tmp = []
-        for e in sorted(entries, key=lambda x: (
-            x.get('clock_sec', x.get('time', 0)),
-            x.get('supply', 0),
-            x.get('unit', x.get('label', ''))
-        )):
-            if e.get('kind') != 'start':
-                # do not collapse upgrades — just add
-                tmp.append(e)
-                continue
+    file = request.files['replay']
+    if file.filename == '':
+        return 'No replay uploaded', 400
 
-            if (
-                tmp
-                and tmp[-1].get('kind') == 'start'
-                and e.get('unit') == tmp[-1].get('unit')
-                and e.get('supply') == tmp[-1].get('supply')
-            ):
-                tmp[-1]['count'] = tmp[-1].get('count', 1) + 1
+    data = file.read()
+    sha = replay_hash(data)
+    replay_store.put(sha, data)
+    if profile_requested():
+        if not profile_allowed():
+            return 'Profiling is not enabled for this request', 403
+        return profiled_build_order(sha, data, parse_upload_options(request.form))
+    if json_requested():
+        return timelines_response(sha, data)
+    body, status, cache_state = cached_build_order(sha, data, parse_upload_options(request.form))
+    return body, status, result_headers(sha, body, cache_state)
+
+
+@app.route('/upload/hash', methods=['POST'])
+def upload_by_hash():
+    """Hash-first upload: answer from the replay we already hold, or ask for the bytes."""
+    sha = normalise_hash(request.form.get('sha256') or request.args.get('sha256'))
+    if sha is None:
+        return 'Missing or invalid sha256', 400
+
+    options = parse_upload_options(request.form)
+    text = None if json_requested() else result_cache.get((sha, options_key(options)))
+    if text is not None:
+        return text, 200, {'X-Replay-SHA256': sha, 'X-Replay-Cache': 'hit'}
+
+    data = replay_store.get(sha)
+    if data is None and result_cache.get((sha, TIMELINES_KEY)) is None:
+        # the client falls back to a normal /upload with the file attached
+        return jsonify({'status': 'send_bytes', 'sha256': sha}), 404
+    # without the bytes, the cached timelines answer both forms
+    if json_requested():
+        return timelines_response(sha, data)
+
+    body, status, cache_state = cached_build_order(sha, data, options)
+    return body, status, result_headers(sha, body, cache_state)
+
+
+# ---- cacheable build orders by replay hash --------------------------
+# GET /builds/<sha256>/<pid>?exclude_workers=1&... serves a replay the server
+# already holds (or has cached results for).  The body is a pure function of the
+# replay, the options and the parser, so the ETag is derived from just those and
+# a matching If-None-Match is answered 304 before any cache lookup.  Bump
+# PARSER_VERSION whenever extraction or rendering output changes.
+PARSER_VERSION = f'1+sc2reader-{sc2reader.__version__}'
+BUILDS_MAX_AGE = int(os.environ.get('BUILDS_MAX_AGE', str(7 * 24 * 3600)))
+
+
+PLAYERS_KEY = 'pids'  # result_cache key of a replay's player ids
+
+
+def build_etag(sha: str, options: Dict[str, Any]) -> str:
+    digest = hashlib.sha256(repr((sha, options_key(options), PARSER_VERSION)).encode())
+    return digest.hexdigest()[:32]
+
+
+def replay_pids(sha: str, data: Optional[bytes]) -> Optional[List[int]]:
+    """The replay's player ids, or None when neither they nor the bytes are at hand."""
+    document = result_cache.get((sha, TIMELINES_KEY))
+    if document is not None:
+        return [p['pid'] for p in document['players']]
+    pids = result_cache.get((sha, PLAYERS_KEY))
+    if pids is None and data is not None:
+        try:
+            with loaded_replay(data, load_level=2) as replay:  # details only, a few ms
+                pids = [p['pid'] for p in player_summary(replay)[0]]
+        except Exception:
+            return None  # the parse reports the broken replay
+        result_cache.put((sha, PLAYERS_KEY), pids)
+    return pids
+
+
+@app.route('/builds/<sha>/<int:pid>', methods=['GET'])
+def build_by_hash(sha: str, pid: int):
+    sha = normalise_hash(sha)
+    if sha is None:
+        return 'Invalid sha256', 400
+    data = replay_store.get(sha)
+    pids = replay_pids(sha, data)
+    if pids is None and data is None:
+        return 'Replay not found, upload it first', 404, {'Cache-Control': 'no-store'}
+    if pids is not None and pid not in pids:
+        # /upload would fall back to the first player; a link must not
+        return f'No player {pid} in replay', 404, {'Cache-Control': 'no-store'}
+
+    options = parse_upload_options(dict(request.args.items(), player=str(pid)))
+    etag = build_etag(sha, options)
+    cacheable = {'ETag': f'"{etag}"', 'Cache-Control': f'public, max-age={BUILDS_MAX_AGE}'}
+    if request.if_none_match.contains(etag):
+        metrics.inc('builds_not_modified_total')
+        return '', 304, cacheable
+    # the caches may still drop the replay before this; that answers 404, not cached
+    body, status, cache_state = cached_build_order(sha, data, options)
+    headers = result_headers(sha, body, cache_state)
+    # truncated and failed parses may come out differently next time
+    headers.update(cacheable if status == 200 and 'X-Parse-Truncated' not in headers
+                   else {'Cache-Control': 'no-store'})
+    return body, status, headers
+
+
+# ---- Server-Sent Events progress stream ---------------------------
+# Rows are back-dated from the event that reveals them by at most the longest
+# build/research time (+ the worker/warp-gate offsets), so anything older than
+# that behind the current event is final and can be streamed early.
+MAX_BACKDATE_SECONDS = max(max(BUILD_TIME.values()), max(upgrade_times.values())) + 12
+
+
+def _sse(event: str, payload: Dict[str, Any]) -> str:
+    return f'event: {event}\ndata: {json.dumps(payload)}\n\n'
+
+
+@app.route('/upload/stream', methods=['GET', 'POST'])
+def upload_stream():
+    """Parse like ``/upload`` but stream stages and early build-order lines as SSE.
+
+    Events: ``received``, ``header``, ``decoded``, ``progress`` (N/M events),
+    ``lines`` (build-order lines that can no longer change, appended from index
+    ``from``), then ``rendered`` with the final text or ``error``.  The final text
+    is authoritative – e.g. the 15/14 overlord correction is only applied there.
+    Send a ``replay`` part, or ``sha256`` for a replay the server already holds
+    (which also works with a plain ``EventSource`` GET).
+    """
+    file = request.files.get('replay')
+    if file is not None and file.filename:
+        data = file.read()
+        sha = replay_hash(data)
+        replay_store.put(sha, data)
+    else:
+        sha = normalise_hash(request.values.get('sha256'))
+        data = replay_store.get(sha) if sha else None
+        if data is None:
+            return jsonify({'status': 'send_bytes', 'sha256': sha}), 404
+
+    options = parse_upload_options(request.values)
+    events: "queue.Queue" = queue.Queue()
+    sent_lines = 0
+
+    def on_progress(stage: str, info: Dict[str, Any]) -> None:
+        nonlocal sent_lines
+        if stage != 'progress':
+            events.put((stage, info))
+            return
+        entries = info.pop('entries')
+        events.put((stage, info))
+        watermark = info['game_time'] - MAX_BACKDATE_SECONDS
+        stable = [e for e in entries if e['clock_sec'] < watermark]
+        # hold back the last line: later rows may still collapse into it
+        lines = render_build_lines(stable, options)[:-1]
+        if len(lines) > sent_lines:
+            events.put(('lines', {'from': sent_lines, 'lines': lines[sent_lines:]}))
+            sent_lines = len(lines)
+
+    @copy_current_request_context  # the rate limit is charged to this request's client
+    def run() -> None:
+        try:
+            body, status, cache_state = cached_build_order(sha, data, options, on_progress)
+            if status == 200:
+                events.put(('rendered', {'build_order': body, 'cache': cache_state,
+                                         'truncated_at': truncated_at(body)}))
             else:
-                e['count'] = 1
-                tmp.append(e)
+                events.put(('error', {'status': status, 'message': body}))
+        except QueueFull as e:
+            events.put(('error', {'status': 503, 'message': str(e), 'retry_after': e.retry_after}))
+        except RateLimited as e:
+            events.put(('error', {'status': 429, 'message': str(e), 'retry_after': e.retry_after}))
+        except Exception as e:
+            print("❌ Streamed parse failed:", e)
+            events.put(('error', {'status': 500, 'message': f'Failed to parse replay: {e}'}))
+        finally:
+            events.put(None)
+
+    def stream():
+        yield _sse('received', {'bytes': len(data), 'sha256': sha})
+        while True:
+            item = events.get()
+            if item is None:
+                break
+            yield _sse(*item)
 
-        entries = tmp
+    threading.Thread(target=run, daemon=True).start()
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
-        # final sort ------------------------------------------------
-        entries.sort(key=lambda e: e.get('clock_sec', e.get('time', 0)))
+# ---- multi-replay batch upload -------------------------------------
+BATCH_MAX_REPLAYS = int(os.environ.get('BATCH_MAX_REPLAYS', '16'))
+BATCH_MAX_REPLAY_MB = int(os.environ.get('BATCH_MAX_REPLAY_MB', '10'))
 
 
-        # ----- stringify build lines -------------------------------
-        build_lines = []
-        if compact:
-            i = 0
-            n = len(entries)
-            while i < n:
-                first = entries[i]
-                if first.get('type') == 'upgrade':
-                    minutes, seconds = divmod(first.get('clock_sec', first.get('time', 0)), 60)
-                    label = first.get('label', 'Unknown')
+class BatchTooLarge(Exception):
+    """Too many replays, or one too big, for a batch; answered with 413."""
 
-                    parts = []
-                    if not exclude_supply:
-                        parts.append(str(first['supply']))
-                    if not exclude_time:    
-                        parts.append(f"{minutes:02d}:{seconds:02d}")
 
-                    prefix = f"[{' '.join(parts)}] " if parts else ""
+def _batch_payloads():
+    """``[(file name, bytes)]`` from repeated ``replay`` parts and/or zip archives.
 
-                    build_lines.append(prefix + label)
-                    i += 1
-                    continue
+    Raises ``BatchTooLarge`` before anything is decompressed when the archives
+    hold more than ``BATCH_MAX_REPLAYS`` replays or one over ``BATCH_MAX_REPLAY_MB``.
+    """
+    max_bytes = BATCH_MAX_REPLAY_MB * 1024 * 1024
+    payloads = []
+    for file in request.files.getlist('replay') + request.files.getlist('archive'):
+        if not file.filename:
+            continue
+        data = file.read()
+        if zipfile.is_zipfile(io.BytesIO(data)):
+            with zipfile.ZipFile(io.BytesIO(data)) as zf:
+                # the central directory is cheap to read; the members are not
+                members = sorted((info for info in zf.infolist() if info.filename.lower().endswith('.sc2replay')),
+                                 key=lambda info: info.filename)
+                if len(payloads) + len(members) > BATCH_MAX_REPLAYS:
+                    raise BatchTooLarge(f'Too many replays (max {BATCH_MAX_REPLAYS})')
+                if any(info.file_size > max_bytes for info in members):
+                    raise BatchTooLarge(f'Replay too large (max {BATCH_MAX_REPLAY_MB} MB)')
+                # ZipFile never inflates a member past its recorded file_size
+                payloads.extend((info.filename, zf.read(info)) for info in members)
+        else:
+            if len(data) > max_bytes:
+                raise BatchTooLarge(f'Replay too large (max {BATCH_MAX_REPLAY_MB} MB)')
+            payloads.append((file.filename, data))
+    return payloads
 
 
-                supply = first['supply']
-                made = first['made']
-                start_time = first['clock_sec']
-                units = []
-                while (
-                    i < n
-                    and entries[i]['kind'] == 'start'
-                    and entries[i]['supply'] == supply
-                    and entries[i]['clock_sec'] == start_time
-                ):
-                    e = entries[i]
-                    qty = e.get('count', 1)
-                    label = f"{qty} {e['unit']}" if qty > 1 else e['unit']
-                    units.append(label)
-                    i += 1
-                parts = []
-                if not exclude_supply:
-                    parts.append(str(supply))
-                prefix = f"[{' '.join(parts)}] " if parts else ""
-                build_lines.append(prefix + " + ".join(units))
-        else:
-            for item in entries:
-                if item.get('type') == 'upgrade':
-                    minutes, seconds = divmod(item.get('clock_sec', item.get('time', 0)), 60)
-                    label = item.get('label', 'Unknown')
+def _batch_record(name: str, sha: str, options: Dict[str, Any], future) -> Dict[str, Any]:
+    record = {'file': name, 'sha256': sha}
+    try:
+        result = future.result()
+    except Exception as e:
+        print("❌ Batch replay failed:", e)
+        record['error'] = str(e)
+        return record
+    record.update(result)
+    for player in result.get('players', []):
+        if player['status'] == 200 and 'truncated_at' not in player:
+            # individual /upload or /upload/hash requests for this player are now free
+            result_cache.put((sha, options_key(dict(options, player=str(player['pid'])))), player['build_order'])
+    return record
+
+
+def _cancel_futures(futures) -> None:
+    for future in futures:
+        future.cancel()
+
+
+@app.route('/upload/batch', methods=['POST'])
+def upload_batch():
+    """Parse a whole series at once: every player's build order for each replay.
+
+    Accepts several ``replay`` parts and/or zip archives.  Replays are parsed in
+    parallel on the worker pool; failures are reported per replay.  With
+    ``stream=1`` (or ``Accept: application/x-ndjson``) each replay is sent as one
+    NDJSON line as soon as it is done, otherwise one JSON document is returned.
+    """
+    try:
+        payloads = _batch_payloads()
+    except BatchTooLarge as e:
+        return str(e), 413
+    if not payloads:
+        return 'No replay uploaded', 400
+    if len(payloads) > BATCH_MAX_REPLAYS:
+        return f'Too many replays (max {BATCH_MAX_REPLAYS})', 413
+
+    options = parse_upload_options(request.form)
+    stream = (
+        str(request.values.get('stream', '')).lower() in {'1', 'true', 'yes', 'on'}
+        or 'application/x-ndjson' in request.headers.get('Accept', '')
+    )
+
+    futures = {}
+    with ExitStack() as slot:
+        # the whole series is admitted as one unit, weighted by its total size
+        slot.enter_context(parse_slot('batch', sum(len(data) for _, data in payloads)))
+        # on any way out (an error below, a client hanging up) drop what has not started
+        slot.callback(_cancel_futures, futures)
+        started = time.perf_counter()
+        for name, data in payloads:
+            sha = replay_hash(data)
+            replay_store.put(sha, data)
+            futures[workers.submit_all_players(data, options, PARSE_TIME_BUDGET)] = (name, sha)
+
+        if stream:
+            def generate():
+                with sampler.idle():
+                    for future in as_completed(futures):
+                        yield json.dumps(_batch_record(*futures[future], options, future)) + '\n'
+            response = Response(generate(), mimetype='application/x-ndjson')
+            # the slot now belongs to the response: released when it is closed,
+            # even if the client hangs up early
+            response.call_on_close(slot.pop_all().close)
+            return response
+
+        with sampler.idle():
+            records = {future: _batch_record(*futures[future], options, future) for future in as_completed(futures)}
+    return jsonify({
+        'replays': [records[future] for future in futures],  # upload order
+        'seconds': round(time.perf_counter() - started, 3),
+    })
+
+
+# ---- supply / economy time series ----------------------------------
+SERIES_DEFAULT_POINTS = 200
+SERIES_MAX_POINTS = 2000
+SERIES_MIN_POINTS = 3  # LTTB keeps the first and last point; fewer would mean "no downsampling"
+
+
+def player_stats_series(replay) -> List[Dict[str, Any]]:
+    """Every ``PlayerStatsEvent`` snapshot per player as parallel lists (in-game seconds)."""
+    players = [p for p in replay.players if not p.is_observer]
+    series = {p.pid: {'pid': p.pid, 'name': p.name, 'race': p.play_race, 'clock_sec': [],
+                      'supply': [], 'supply_cap': [], 'workers': [], 'minerals_rate': [], 'gas_rate': []}
+              for p in players}
+    for event in replay.tracker_events:
+        if event.name != 'PlayerStatsEvent' or event.pid not in series:
+            continue
+        s = series[event.pid]
+        s['clock_sec'].append(round(frame_to_ingame_seconds(event.frame, replay), 1))
+        s['supply'].append(int(event.food_used))
+        s['supply_cap'].append(int(event.food_made))
+        s['workers'].append(event.workers_active_count)
+        s['minerals_rate'].append(event.minerals_collection_rate)
+        s['gas_rate'].append(event.vespene_collection_rate)
+    return list(series.values())
+
+
+@app.route('/series', methods=['POST'])
+def stats_series():
+    """Per-player supply, worker and income curves, LTTB-downsampled to ``points``.
+
+    Takes a ``replay`` part or the ``sha256`` of one already uploaded.
+    """
+    from downsample import downsample  # numpy only when the feature is used
+
+    if 'replay' in request.files and request.files['replay'].filename:
+        data = request.files['replay'].read()
+        sha = replay_hash(data)
+        replay_store.put(sha, data)
+    else:
+        sha = normalise_hash(request.values.get('sha256'))
+        if sha is None:
+            return 'No replay uploaded', 400
+        data = replay_store.get(sha)
+        if data is None:
+            return jsonify({'status': 'send_bytes', 'sha256': sha}), 404
+    points_raw = str(request.values.get('points', ''))
+    points = (max(SERIES_MIN_POINTS, min(int(points_raw), SERIES_MAX_POINTS)) if points_raw.isdigit()
+              else SERIES_DEFAULT_POINTS)
 
-                    parts = []
-                    if not exclude_supply:
-                        parts.append(str(item['supply']))
+    try:
+        # tracker events are all we need – an order of magnitude faster than level 4
+        with parse_slot('series', len(data)), loaded_replay(data, load_level=3) as replay:
+            players = player_stats_series(replay)
+    except (QueueFull, RateLimited):
+        raise
+    except Exception as e:
+        print("❌ Failed to load replay:", e)
+        return f'Failed to load replay: {e}', 400
+    for player in players:
+        clock = player.pop('clock_sec')
+        player['series'] = downsample(clock, {
+            name: player.pop(name) for name in ('supply', 'supply_cap', 'workers', 'minerals_rate', 'gas_rate')
+        }, points)
+    return jsonify({'sha256': sha, 'points': points, 'players': players}), 200, {'X-Replay-SHA256': sha}
+
+
+# ---- build similarity search --------------------------------------
+# Directory written by ``python -m build_similarity build``; loaded on first use.
+SIMILARITY_INDEX = os.environ.get('SIMILARITY_INDEX')
+_similarity_index = None
+_similarity_lock = threading.Lock()
+
+
+def get_similarity_index():
+    global _similarity_index
+    with _similarity_lock:
+        if _similarity_index is None and SIMILARITY_INDEX:
+            from build_similarity import SimilarityIndex  # numpy only when the feature is used
+            _similarity_index = SimilarityIndex(SIMILARITY_INDEX)
+        return _similarity_index
+
+
+@app.route('/similar', methods=['POST'])
+def similar_builds():
+    """The ``k`` known builds closest to one player's build in the uploaded replay."""
+    index = get_similarity_index()
+    if index is None:
+        return 'Similarity search is not configured', 404
+    if 'replay' not in request.files or request.files['replay'].filename == '':
+        return 'No replay uploaded', 400
 
-                    if not exclude_time:
-                        parts.append(f"{minutes:02d}:{seconds:02d}")
+    data = request.files['replay'].read()
+    sha = replay_hash(data)
+    replay_store.put(sha, data)
+    options = parse_upload_options(request.form)
+    k_raw = request.form.get('k', '')
+    k = min(int(k_raw), 100) if k_raw.isdigit() else 10
+    try:
+        with parse_slot('similar', len(data)):
+            player, timeline = timeline_for_bytes(data, options)
+    except (QueueFull, RateLimited):
+        raise
+    except Exception as e:
+        print("❌ Failed to parse replay:", e)
+        return f'Failed to parse replay: {e}', 400
+    matches = index.query([timeline], k, request.form.get('matchup'), exclude=sha)[0]
+    return jsonify({'player': player, 'matches': matches})
 
-                    prefix = f"[{' '.join(parts)}] " if parts else ""
 
-                    build_lines.append(prefix + label)
-                    continue
+# ---- alignment against a reference build ---------------------------
+@app.route('/align', methods=['POST'])
+def align_builds():
+    """Score one or more replays against a reference build order.
 
-                parts = []
-                if not exclude_supply:
-                    parts.append(str(item['supply']))
-                if not exclude_time:
-                    minutes, seconds = divmod(item.get('clock_sec', item.get('time', 0)), 60)
-                    parts.append(f"{minutes:02d}:{seconds:02d}")
-                prefix = f"[{' '.join(parts)}] " if parts else ""
-                qty = item.get('count', 1)
-                label = f"{qty} {item['unit']}" if qty > 1 else item['unit']
-                build_lines.append(prefix + label)
+    ``reference`` is build-order text in the ``/upload`` format; replays come as
+    in ``/upload/batch`` and ``player`` (pid or name) picks the side to score.
+    Each replay gets per-step timing / supply deltas, missed and extra steps.
+    """
+    from build_alignment import Reference  # numpy only when the feature is used
 
-        # ---- oversupply correction ---------------------------------
-        try:
-            ov_idx = next(i for i, line in enumerate(build_lines)
-                         if re.search(r"\[14\]\s+.*Overlord", line))
-        except StopIteration:
-            ov_idx = None
+    try:
+        reference = Reference(request.form.get('reference', ''))
+    except ValueError as e:
+        return str(e), 400
+    try:
+        payloads = _batch_payloads()
+    except BatchTooLarge as e:
+        return str(e), 413
+    if not payloads:
+        return 'No replay uploaded', 400
+    if len(payloads) > BATCH_MAX_REPLAYS:
+        return f'Too many replays (max {BATCH_MAX_REPLAYS})', 413
+
+    options = parse_upload_options(request.form)
+    records, timelines = [], []
+    with parse_slot('align', sum(len(data) for _, data in payloads)):
+        futures = [(name, data, workers.submit_timeline(data, options)) for name, data in payloads]
+        for name, data, future in futures:
+            record = {'file': name, 'sha256': replay_hash(data)}
+            try:
+                record['player'], blob = worker_result(future)
+                timeline = decode_timeline(blob)
+            except Exception as e:
+                print("❌ Alignment replay failed:", e)
+                record['error'] = f'Failed to parse replay: {e}'
+                timeline = None
+            records.append(record)
+            timelines.append(timeline)
+    parsed = [i for i, timeline in enumerate(timelines) if timeline is not None]
+    for i, report in zip(parsed, reference.align([timelines[i] for i in parsed])):
+        records[i].update(report)
+    return jsonify({'reference_steps': len(reference.steps), 'replays': records})
+
+
+# ---- asynchronous jobs --------------------------------------------
+job_store = JobStore(float(os.environ.get('JOB_TTL_SECONDS', '3600')))
+
+
+def _finish_job_item(job, index: int, key, future) -> None:
+    try:
+        result = future.result()
+    except workers.ResourceLimitExceeded as e:
+        job_store.update(job, index, status=FAILED, code=e.status, error=str(e))
+        return
+    except Exception as e:
+        print("❌ Job worker failed:", e)
+        job_store.update(job, index, status=FAILED, code=500, error=f'Failed to parse replay: {e}')
+        return
+    cut = truncated_at(result['build_order'])
+    if result['status'] == 200 and cut is None:
+        result_cache.put(key, result['build_order'])
+        job_store.update(job, index, status=DONE, code=200, build_order=result['build_order'])
+    elif result['status'] == 200:
+        job_store.update(job, index, status=DONE, code=200, build_order=result['build_order'], truncated_at=cut)
+    else:
+        job_store.update(job, index, status=FAILED, code=result['status'], error=result['build_order'])
+
+
+def _run_job(job, options: Dict[str, Any], pending: List[tuple]) -> None:
+    """Parse a job's uncached replays as one admitted parse, like ``/upload/batch``."""
+    futures = []
+    try:
+        with parse_slot('jobs', sum(len(data) for _, _, data in pending)):
+            for index, key, data in pending:
+                job_store.update(job, index, status=RUNNING)
+                futures.append((index, key, workers.submit_parse(data, options)))
+            with sampler.idle():
+                for index, key, future in futures:
+                    _finish_job_item(job, index, key, future)
+    except QueueFull as e:
+        for index, _, _ in pending:
+            job_store.update(job, index, status=FAILED, code=503, error=str(e))
+    except Exception as e:
+        print("❌ Job failed:", e)
+        for _, _, future in futures:
+            future.cancel()
+        for index, _, _ in pending:
+            if job.items[index]['status'] not in (DONE, FAILED):
+                job_store.update(job, index, status=FAILED, code=500, error=f'Failed to parse replay: {e}')
 
-        if ov_idx is not None:
-            for j in range(ov_idx):
-                if re.match(r"\[15\]", build_lines[j]):
-                    build_lines[j] = build_lines[j].replace("[15]", "[15/14]", 1)
 
-        return '\n'.join(build_lines)
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Queue one or more ``replay`` parts for background parsing; returns the job id.
 
+    The parses count against admission control and the client's ``jobs`` rate
+    limit like any other; a job the queue cannot take is refused up front.
+    """
+    files = [f for f in request.files.getlist('replay') if f.filename]
+    if not files:
+        return 'No replay uploaded', 400
+    if len(files) > BATCH_MAX_REPLAYS:
+        return f'Too many replays (max {BATCH_MAX_REPLAYS})', 413
+
+    options = parse_upload_options(request.form)
+    payloads = [(f.filename, f.read()) for f in files]
+    cached, pending = {}, []
+    for index, (_, data) in enumerate(payloads):
+        sha = replay_hash(data)
+        replay_store.put(sha, data)
+        key = (sha, options_key(options))
+        text = result_cache.get(key)
+        if text is not None:
+            cached[index] = (sha, text)
+        else:
+            pending.append((index, key, data))
+    if pending:
+        for _, _, data in pending:
+            charge_client('jobs', len(data))
+        try:
+            admission.check(sum(replay_weight(len(data)) for _, _, data in pending))
+        except QueueFull:
+            metrics.inc('parser_rejected_total', route='jobs')
+            raise
+
+    job = job_store.create([name for name, _ in payloads])
+    metrics.inc('jobs_created_total')
+    metrics.inc('jobs_replays_total', len(payloads))
+    for index, (sha, text) in cached.items():
+        job_store.update(job, index, sha256=sha, status=DONE, code=200, build_order=text)
+    for index, (sha, _), _ in pending:
+        job_store.update(job, index, sha256=sha)
+    if pending:
+        threading.Thread(target=_run_job, args=(job, options, pending), name='job', daemon=True).start()
+    return jsonify(job_store.to_dict(job)), 202, {'Location': f'/jobs/{job.id}'}
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
+        return 'Unknown or expired job', 404
+    return jsonify(job_store.to_dict(job))
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    _update_queue_gauges()
+    metrics.set('jobs_active', job_store.active())
+    metrics.set('replay_store_entries', len(replay_store))
+    metrics.set('result_cache_entries', len(result_cache))
+    metrics.set('ratelimit_buckets', len(rate_limiter))
+    metrics.set('sampler_samples', sampler.samples)
+    metrics.set('sampler_overhead_ratio', round(sampler.overhead_ratio(), 6))
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+
+# ---- cold start / readiness ---------------------------------------
+# The first parse in a fresh process pays for sc2reader's lazy set-up, the
+# GameData compile and Flask's first-request work (~2x a warm parse).  At boot
+# a background thread parses a small bundled replay so the first real upload
+# doesn't; /ready answers 503 until that is done (point health checks there).
+WARMUP_REPLAY = os.environ.get(
+    'WARMUP_REPLAY', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'replay', 'replaytest5.SC2Replay'))
+_warm = threading.Event()
+_warmup_seconds: Optional[float] = None
+
+
+def warm_up() -> None:
+    global _warmup_seconds
+    started = time.perf_counter()
+    try:
+        with open(WARMUP_REPLAY, 'rb') as f:
+            data = f.read()
+        with redirect_stdout(io.StringIO()):  # the extraction loop is chatty
+            build_order_for_bytes(data, parse_upload_options({}))
+        app.test_client().get('/')
+        # after the warm parse, so sc2reader's lazily built tables are frozen too;
+        # before the pool forks, so workers don't dirty the inherited pages either
+        freeze_heap()
+        if ISOLATE_PARSES:
+            # forks the pool from this now-warm process
+            workers.submit_parse(data, parse_upload_options({})).result()
     except Exception as e:
-        print("❌ Error while processing events:", e)
-        return f'Failed to parse replay: {e}', 500
+        # a missing warm-up replay only costs speed, never readiness
+        print("⚠️ Warm-up failed:", e)
+    _warmup_seconds = time.perf_counter() - started
+    metrics.set('warmup_seconds', _warmup_seconds)
+    print(f"🔥 Warm-up done in {_warmup_seconds:.2f}s")
+    _warm.set()
+
+
+def start_warm_up() -> threading.Thread:
+    thread = threading.Thread(target=warm_up, name='warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+@app.route('/ready')
+def ready():
+    if not _warm.is_set():
+        return jsonify({'ready': False}), 503, {'Retry-After': '1'}
+    return jsonify({'ready': True, 'warmup_seconds': round(_warmup_seconds, 3)})
+
+
+# ---- cache pre-warming --------------------------------------------
+# Replays that will be popular (tournament games, featured builds) can be parsed
+# ahead of their first visitor: PREWARM names a directory, a .zip or a manifest
+# (one path per line, relative to the manifest; # comments).  After warm-up each
+# replay is parsed once on the worker pool into its format=json timelines
+# document, which answers /players, /upload, /upload/hash and /builds for every
+# player and option.  Live traffic comes first: one replay at a time, only while
+# no parse is running or queued, PREWARM_INTERVAL seconds apart, and at most half
+# the result cache.  POST /admin/prewarm (PROFILE_TOKEN) starts a run for a path.
+PREWARM_PATH = os.environ.get('PREWARM')
+PREWARM_INTERVAL = float(os.environ.get('PREWARM_INTERVAL', '1'))
+PREWARM_TOKEN = os.environ.get('PREWARM_TOKEN')
+# /admin/prewarm only reads replays below this directory (unset: only PREWARM itself)
+PREWARM_ROOT = os.path.realpath(os.environ['PREWARM_ROOT']) if os.environ.get('PREWARM_ROOT') else None
+PREWARM_IDLE_POLL = 0.5
+_prewarm_lock = threading.Lock()
+_prewarm_thread: Optional[threading.Thread] = None
+
+
+def prewarm_sources(path: str) -> list:
+    # batch_parse pulls in multiprocessing; only import it when pre-warming
+    from batch_parse import iter_sources, REPLAY_SUFFIX
+
+    if os.path.isfile(path) and not zipfile.is_zipfile(path) and not path.lower().endswith(REPLAY_SUFFIX):
+        base = os.path.dirname(os.path.abspath(path))
+        with open(path, encoding='utf-8') as f:
+            lines = [line.strip() for line in f]
+        paths = [os.path.join(base, line) for line in lines if line and not line.startswith('#')]
+        return list(iter_sources(paths))
+    return list(iter_sources([path]))
+
+
+def under_prewarm_root(path: str) -> bool:
+    if PREWARM_ROOT is None:
+        return False
+    return os.path.commonpath([os.path.realpath(path), PREWARM_ROOT]) == PREWARM_ROOT
+
+
+def wait_for_idle_parser() -> None:
+    # pool work outside admission (warm-up, other pre-warm runs) counts as busy too
+    while admission.running or admission.depth or workers.pending():
+        time.sleep(PREWARM_IDLE_POLL)
+
+
+def prewarm_timelines(data: bytes) -> Dict[str, Any]:
+    """Parse ``data`` once the parser is idle, as an admitted parse so live traffic sees it."""
+    while True:
+        wait_for_idle_parser()
+        try:
+            with admission.admit(replay_weight(len(data))):
+                _update_queue_gauges()
+                # no time budget, so the document is never truncated
+                return workers.submit_timelines(data).result()
+        except QueueFull:
+            continue  # traffic arrived in between; wait for it again
+        finally:
+            _update_queue_gauges()
+
+
+def prewarm(path: str, restricted: bool = False) -> int:
+    """Parse the replays under ``path`` into the result cache; returns how many are cached.
+
+    With ``restricted``, replays outside ``PREWARM_ROOT`` (via a manifest or a
+    symlink) are skipped.
+    """
+    from batch_parse import read_source, source_name
+
+    limit = result_cache.max_entries // 2
+    warmed = 0
+    for source in prewarm_sources(path):
+        if warmed >= limit:
+            print(f"⚠️ Pre-warm stopped at {limit} replays (half of RESULT_CACHE_SIZE)")
+            break
+        if restricted and not under_prewarm_root(source[0]):
+            print(f"⚠️ Pre-warm skipped {source_name(source)}: outside PREWARM_ROOT")
+            metrics.inc('prewarm_replays_total', result='error')
+            continue
+        try:
+            data = read_source(source)
+        except (OSError, zipfile.BadZipFile) as e:
+            print(f"⚠️ Pre-warm could not read {source_name(source)}: {e}")
+            metrics.inc('prewarm_replays_total', result='error')
+            continue
+        sha = replay_hash(data)
+        if result_cache.get((sha, TIMELINES_KEY)) is None:
+            try:
+                document = prewarm_timelines(data)
+            except Exception as e:
+                print(f"⚠️ Pre-warm of {source_name(source)} failed: {e}")
+                metrics.inc('prewarm_replays_total', result='error')
+                continue
+            result_cache.put((sha, TIMELINES_KEY), document)
+            metrics.inc('prewarm_replays_total', result='parsed')
+            time.sleep(PREWARM_INTERVAL)
+        warmed += 1
+    print(f"🔥 Pre-warmed {warmed} replays from {path}")
+    return warmed
+
+
+def start_prewarm(path: str, restricted: bool = False) -> bool:
+    """Pre-warm ``path`` in the background once warm-up is done; False if a run is active."""
+    global _prewarm_thread
+
+    def run() -> None:
+        _warm.wait()
+        try:
+            prewarm(path, restricted)
+        except Exception as e:
+            print("⚠️ Pre-warm failed:", e)
+
+    with _prewarm_lock:
+        if _prewarm_thread is not None and _prewarm_thread.is_alive():
+            return False
+        _prewarm_thread = threading.Thread(target=run, name='prewarm', daemon=True)
+        _prewarm_thread.start()
+        return True
+
+
+def prewarm_allowed() -> bool:
+    # reads server-side files, so there is no tokenless mode like PROFILE_REQUESTS
+    token = request.headers.get('X-Prewarm-Token', '')
+    return bool(PREWARM_TOKEN) and hmac.compare_digest(token.encode(), PREWARM_TOKEN.encode())
+
+
+@app.route('/admin/prewarm', methods=['POST'])
+def admin_prewarm():
+    if not prewarm_allowed():
+        return 'Forbidden', 403
+    path = request.values.get('path')
+    restricted = bool(path)
+    if restricted and not under_prewarm_root(path):
+        return 'Path outside PREWARM_ROOT', 403
+    path = path or PREWARM_PATH
+    if not path or not os.path.exists(path):
+        return 'Missing or unknown path', 400
+    if not start_prewarm(path, restricted):
+        return 'A pre-warm run is already active', 409
+    return jsonify({'status': 'started', 'path': path}), 202
 
 
 if __name__ == '__main__':
     from waitress import serve
-    serve(app, host='0.0.0.0', port=5000)
+    # worker processes import `app`; let them find this (already warm) module
+    sys.modules.setdefault('app', sys.modules[__name__])
+    sampler.start()
+
+    def stop(signum, frame) -> None:
+        # SIGTERM's default action would leave the parse workers running
+        workers.shutdown()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    if os.environ.get('WARMUP', '1') != '0':
+        start_warm_up()
+    else:
+        _warm.set()
+    if PREWARM_PATH:
+        start_prewarm(PREWARM_PATH)
+    # more threads than parse slots, so overload reaches the admission queue
+    # (and gets a fast 503) instead of waiting invisibly inside waitress
+    serve(app, host='0.0.0.0', port=int(os.environ.get('PORT', '5000')),
+          threads=int(os.environ.get('WAITRESS_THREADS', '16')))
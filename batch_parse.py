@@ -0,0 +1,194 @@
+"""Offline batch parser: every player's build order for a pile of replays.
+
+    python -m batch_parse REPLAYS [REPLAYS ...] -o builds.jsonl [-j 8] [--exclude-workers ...]
+
+``REPLAYS`` may be directories (walked recursively) or ``.zip`` files.  Replays
+are parsed on a multiprocessing pool with the same extraction code as
+``/upload`` and written to the JSONL output as they finish, one line per replay.
+Re-running against an existing output file skips replays whose SHA-256 is
+already in it, so an interrupted run can simply be restarted.
+
+With ``--index corpus.sqlite`` the structured timelines are also ingested into a
+``replay_index.ReplayIndex`` for matchup / player / timing queries.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import zipfile
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+from replay_cache import replay_hash
+from timeline_codec import encode_timeline
+
+REPLAY_SUFFIX = '.sc2replay'
+
+# (path, member) – member is None for plain files, the archive name inside zips
+ReplaySource = Tuple[str, Optional[str]]
+
+_done_hashes: Set[str] = set()
+_options: Dict[str, Any] = {}
+_with_timeline = False
+
+
+def iter_sources(paths) -> Iterator[ReplaySource]:
+    for path in paths:
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as zf:
+                for name in sorted(zf.namelist()):
+                    if name.lower().endswith(REPLAY_SUFFIX):
+                        yield path, name
+        elif os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(REPLAY_SUFFIX):
+                        yield os.path.join(root, name), None
+        elif path.lower().endswith(REPLAY_SUFFIX):
+            yield path, None
+
+
+def read_source(source: ReplaySource) -> bytes:
+    path, member = source
+    if member is None:
+        with open(path, 'rb') as f:
+            return f.read()
+    with zipfile.ZipFile(path) as zf:
+        return zf.read(member)
+
+
+def source_name(source: ReplaySource) -> str:
+    path, member = source
+    return path if member is None else f'{path}!{member}'
+
+
+def load_done_hashes(output: str) -> Set[str]:
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, encoding='utf-8') as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)['sha256'])
+            except (ValueError, KeyError):
+                continue  # half-written line from an interrupted run
+    return done
+
+
+def _init_worker(done_hashes: Set[str], options: Dict[str, Any], with_timeline: bool) -> None:
+    global _done_hashes, _options, _with_timeline
+    _done_hashes = done_hashes
+    _options = options
+    _with_timeline = with_timeline
+    # the extraction loop prints debug lines; keep them out of the terminal
+    sys.stdout = open(os.devnull, 'w')
+
+
+def parse_source(source: ReplaySource) -> Dict[str, Any]:
+    """Worker: read, hash and parse one replay into a JSONL record."""
+    from app import build_orders_for_all_players
+
+    started = time.perf_counter()
+    record: Dict[str, Any] = {'file': source_name(source)}
+    try:
+        data = read_source(source)
+    except OSError as e:
+        record.update(sha256=None, error=f'Failed to read replay: {e}')
+        return record
+    record['sha256'] = replay_hash(data)
+    record['bytes'] = len(data)
+    if record['sha256'] in _done_hashes:
+        record['skipped'] = True
+        return record
+    try:
+        record.update(build_orders_for_all_players(data, _options, with_timeline=_with_timeline))
+        for player in record['players']:
+            if 'timeline' in player:
+                # shipped back to the parent and stored in the index in encoded form
+                player['timeline'] = encode_timeline(player['timeline'])
+    except Exception as e:
+        record['error'] = f'Failed to load replay: {e}'
+    record['seconds'] = round(time.perf_counter() - started, 3)
+    return record
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m batch_parse', description=__doc__.split('\n')[0])
+    parser.add_argument('inputs', nargs='+', help='replay directories, .zip archives or .SC2Replay files')
+    parser.add_argument('-o', '--output', required=True, help='JSONL file to append results to')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='worker processes')
+    parser.add_argument('--exclude-workers', action='store_true')
+    parser.add_argument('--exclude-units', action='store_true')
+    parser.add_argument('--exclude-supply', action='store_true')
+    parser.add_argument('--exclude-time', action='store_true')
+    parser.add_argument('--compact', action='store_true')
+    parser.add_argument('--stop-supply', type=int)
+    parser.add_argument('--stop-time', type=int, help='minutes')
+    parser.add_argument('--index', help='also ingest timelines into this SQLite replay index')
+    args = parser.parse_args(argv)
+
+    from app import parse_upload_options
+
+    options = parse_upload_options({
+        'exclude_workers': args.exclude_workers,
+        'exclude_units': args.exclude_units,
+        'exclude_supply': args.exclude_supply,
+        'exclude_time': args.exclude_time,
+        'compact': args.compact,
+        'stop_supply': str(args.stop_supply) if args.stop_supply is not None else None,
+        'stop_time': str(args.stop_time) if args.stop_time is not None else None,
+    })
+    written = load_done_hashes(args.output)
+    done = set(written)
+    index = None
+    if args.index:
+        from replay_index import ReplayIndex
+
+        index = ReplayIndex(args.index)
+        done &= index.hashes()  # only skip replays that are both written and indexed
+
+    parsed = skipped = failed = total_bytes = 0
+    started = time.perf_counter()
+    with open(args.output, 'a', encoding='utf-8') as out, \
+            multiprocessing.Pool(args.jobs, _init_worker, (done, options, index is not None)) as pool:
+        for record in pool.imap_unordered(parse_source, iter_sources(args.inputs)):
+            if record.get('skipped') or record['sha256'] in done:
+                # already in the output, or the same replay seen twice in this run
+                skipped += 1
+                continue
+            if record['sha256']:
+                done.add(record['sha256'])
+            if 'error' in record:
+                failed += 1
+            else:
+                parsed += 1
+                total_bytes += record['bytes']
+                if index is not None:
+                    index.add(record)
+                    for player in record['players']:
+                        player.pop('timeline', None)
+            if record['sha256'] in written:
+                continue
+            out.write(json.dumps(record) + '\n')
+            out.flush()
+            if (parsed + failed) % 100 == 0:
+                rate = (parsed + failed) / (time.perf_counter() - started)
+                print(f'… {parsed + failed} replays ({rate:.1f}/s)', file=sys.stderr)
+
+    if index is not None:
+        index.close()
+    elapsed = time.perf_counter() - started
+    print(
+        f'✅ {parsed} parsed, {failed} failed, {skipped} already done in {elapsed:.1f}s – '
+        f'{parsed / elapsed if elapsed else 0:.1f} replays/s, '
+        f'{total_bytes / 1e6 / elapsed if elapsed else 0:.2f} MB/s on {args.jobs} workers',
+        file=sys.stderr,
+    )
+    return 1 if failed and not parsed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
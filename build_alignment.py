@@ -0,0 +1,259 @@
+"""Score replays against a reference build order ("how closely did I follow it?").
+
+The reference is build-order text in the format ``/upload`` emits – ``[14 00:16]
+Pylon``, ``[15] 2 Zergling + Overlord`` (compact), supply or time optional.
+Both sides are expanded to one step per unit and aligned in order with an edit-
+distance DP: a matched step costs its timing error (or its supply error when the
+reference has no times), a reference step with no partner costs ``MISS_COST`` and
+a replay step the reference does not have costs ``EXTRA_COST``.
+
+All replays of a batch are aligned at once: the DP runs row by row over the
+reference with every replay as one row of a NumPy matrix, so scoring a season is
+a few hundred vector operations per chunk instead of a Python loop per cell.
+
+    python -m build_alignment reference.txt REPLAYS... --player Serral
+    python -m build_alignment reference.txt --index corpus.sqlite --matchup zvp
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+MISS_COST = 60    # a reference step that never happened
+EXTRA_COST = 15   # a step the reference does not have
+# a late step is still cheaper than "missed + extra", so it is reported as late
+MAX_MATCH_COST = MISS_COST + EXTRA_COST - 1
+SUPPLY_COST = 3   # per supply of error when the reference has no times
+TAIL_SEC = 30     # replay steps this long after the reference's last step are ignored
+TAIL_SUPPLY = 10
+CHUNK_REPLAYS = 256
+WORKERS = {'Probe', 'SCV', 'Drone'}
+
+_INF = np.int32(1 << 28)
+_DIAG, _UP, _LEFT = 0, 1, 2
+_QTY_RE = re.compile(r'^(\d+)\s+(.+)$')
+
+
+def parse_build_text(text: str) -> List[Dict[str, Any]]:
+    """Reference steps (``unit``, ``supply``, ``clock_sec``; None when absent), one per unit."""
+    steps = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        supply = clock = None
+        if line.startswith('['):
+            head, _, line = line[1:].partition(']')
+            for token in head.split():
+                if ':' in token:
+                    minutes, _, seconds = token.partition(':')
+                    clock = int(minutes) * 60 + int(seconds)
+                elif token.split('/')[0].isdigit():
+                    supply = int(token.split('/')[0])  # "15/14" oversupply notation
+        for part in line.split(' + '):
+            part = part.strip()
+            if not part:
+                continue
+            m = _QTY_RE.match(part)
+            qty, unit = (int(m.group(1)), m.group(2)) if m else (1, part)
+            steps.extend({'unit': unit, 'supply': supply, 'clock_sec': clock} for _ in range(qty))
+    return steps
+
+
+def timeline_steps(rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Expand timeline rows (``collapse_entries`` / ``ReplayIndex.timeline``) to one step per unit."""
+    return [
+        {'unit': row['unit'], 'supply': row.get('supply'), 'clock_sec': row['clock_sec']}
+        for row in rows for _ in range(row.get('count', 1))
+    ]
+
+
+class Reference:
+    """A parsed reference build, reusable across any number of ``align`` calls."""
+
+    def __init__(self, text: str):
+        self.steps = parse_build_text(text)
+        if not self.steps:
+            raise ValueError('Reference build order is empty')
+        self.units = {}
+        self.unit_ids = np.array([self.units.setdefault(s['unit'], len(self.units)) for s in self.steps],
+                                 dtype=np.int32)
+        self.clocks = np.array([-1 if s['clock_sec'] is None else s['clock_sec'] for s in self.steps],
+                               dtype=np.int32)
+        self.supplies = np.array([-1 if s['supply'] is None else s['supply'] for s in self.steps],
+                                 dtype=np.int32)
+        self.timed = bool((self.clocks >= 0).all())
+        self.has_workers = any(s['unit'] in WORKERS for s in self.steps)
+
+    def relevant(self, steps: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """The replay steps the reference can speak about (its horizon, workers only if listed)."""
+        if not self.has_workers:
+            steps = [s for s in steps if s['unit'] not in WORKERS]
+        if self.timed:
+            end = int(self.clocks.max()) + TAIL_SEC
+            return [s for s in steps if s['clock_sec'] <= end]
+        if (self.supplies >= 0).any():
+            end = int(self.supplies.max()) + TAIL_SUPPLY
+            return [s for s in steps if s['supply'] is None or s['supply'] <= end]
+        return steps[:2 * len(self.steps)]
+
+    def align(self, timelines: Sequence[Iterable[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """One report per timeline, in order (see ``_report``)."""
+        results: List[Dict[str, Any]] = []
+        for start in range(0, len(timelines), CHUNK_REPLAYS):
+            chunk = [self.relevant(timeline_steps(t)) for t in timelines[start:start + CHUNK_REPLAYS]]
+            results.extend(self._align_chunk(chunk))
+        return results
+
+    def _align_chunk(self, replays: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        n, r = len(self.steps), len(replays)
+        lengths = np.array([len(steps) for steps in replays], dtype=np.int64)
+        m = int(lengths.max()) if r else 0
+        # padded (replays, steps) matrices; padding never matches and is never read back
+        units = np.full((r, m), -1, dtype=np.int32)
+        clocks = np.zeros((r, m), dtype=np.int32)
+        supplies = np.full((r, m), -1, dtype=np.int32)
+        for row, steps in enumerate(replays):
+            units[row, :len(steps)] = [self.units.get(s['unit'], -1) for s in steps]
+            clocks[row, :len(steps)] = [s['clock_sec'] for s in steps]
+            supplies[row, :len(steps)] = [-1 if s['supply'] is None else s['supply'] for s in steps]
+
+        extra_ramp = np.arange(m + 1, dtype=np.int32) * EXTRA_COST
+        prev = np.broadcast_to(extra_ramp, (r, m + 1)).copy()
+        choice = np.empty((n + 1, r, m + 1), dtype=np.int8)
+        choice[0] = _LEFT
+        for i in range(n):
+            if self.timed:
+                match = np.abs(clocks - self.clocks[i])
+            elif self.supplies[i] >= 0:
+                match = np.where(supplies >= 0, np.abs(supplies - self.supplies[i]) * SUPPLY_COST, 0)
+            else:
+                match = np.zeros((r, m), dtype=np.int32)
+            match = np.where(units == self.unit_ids[i], np.minimum(match, MAX_MATCH_COST), _INF)
+            diag = prev[:, :-1] + match
+            up = prev + MISS_COST
+            best = up.copy()
+            best[:, 1:] = np.minimum(diag, up[:, 1:])
+            # D[j] = min(best[j], D[j-1] + EXTRA): a running minimum along the row
+            cur = np.minimum.accumulate(best - extra_ramp, axis=1) + extra_ramp
+            choice[i + 1] = np.where(cur < best, _LEFT, _UP)
+            choice[i + 1, :, 1:][(cur[:, 1:] == best[:, 1:]) & (diag == best[:, 1:])] = _DIAG
+            prev = cur
+
+        total = prev[np.arange(r), lengths]
+        return [self._report(replays[k], choice[:, k], int(lengths[k]), int(total[k])) for k in range(r)]
+
+    def _report(self, steps: List[Dict[str, Any]], choice: np.ndarray, length: int, cost: int) -> Dict[str, Any]:
+        pairs: List[Optional[int]] = [None] * len(self.steps)
+        extras = []
+        i, j = len(self.steps), length
+        while i or j:
+            move = choice[i, j] if i else _LEFT
+            if move == _DIAG:
+                pairs[i - 1] = j - 1
+                i, j = i - 1, j - 1
+            elif move == _UP:
+                i -= 1
+            else:
+                extras.append(steps[j - 1])
+                j -= 1
+        report_steps = []
+        deltas = []
+        for ref, j in zip(self.steps, pairs):
+            step = {'unit': ref['unit'], 'ref_supply': ref['supply'], 'ref_clock_sec': ref['clock_sec']}
+            if j is None:
+                step['status'] = 'missed'
+            else:
+                got = steps[j]
+                step.update(status='hit', supply=got['supply'], clock_sec=got['clock_sec'])
+                if ref['clock_sec'] is not None:
+                    step['time_delta'] = got['clock_sec'] - ref['clock_sec']
+                    deltas.append(abs(step['time_delta']))
+                if ref['supply'] is not None and got['supply'] is not None:
+                    step['supply_delta'] = got['supply'] - ref['supply']
+            report_steps.append(step)
+        matched = sum(p is not None for p in pairs)
+        return {
+            # 100 = every step on time with nothing extra, 0 = no better than not playing it
+            'score': round(max(0.0, 100.0 * (1 - cost / (len(self.steps) * MISS_COST))), 1),
+            'matched': matched,
+            'missed': len(self.steps) - matched,
+            'extra': len(extras),
+            'mean_abs_time_delta': round(sum(deltas) / len(deltas), 1) if deltas else None,
+            'steps': report_steps,
+            'extras': extras[::-1],
+        }
+
+
+# ---- command line -------------------------------------------------
+def _timeline_task(args):
+    from batch_parse import read_source, source_name
+    from app import parse_upload_options, timeline_for_bytes
+
+    source, player = args
+    try:
+        info, timeline = timeline_for_bytes(read_source(source), parse_upload_options({'player': player}))
+        return {'file': source_name(source), **info}, timeline
+    except Exception as e:
+        return {'file': source_name(source), 'error': f'Failed to parse replay: {e}'}, None
+
+
+def _silence_worker() -> None:
+    # the extraction loop prints debug lines; keep them out of the JSONL output
+    sys.stdout = open(os.devnull, 'w')
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m build_alignment',
+                                     description='Score replays against a reference build order.')
+    parser.add_argument('reference', help='build-order text file')
+    parser.add_argument('inputs', nargs='*', help='replay directories, .zip archives or .SC2Replay files')
+    parser.add_argument('--index', help='score the timelines stored in this replay_index SQLite file')
+    parser.add_argument('--player', help='player name or pid (default: first player)')
+    parser.add_argument('--matchup', help="with --index: only this matchup, from the player's side")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--steps', action='store_true', help='include the per-step report')
+    args = parser.parse_args(argv)
+    if not args.inputs and not args.index:
+        parser.error('give replays to parse or --index')
+
+    with open(args.reference, encoding='utf-8') as f:
+        reference = Reference(f.read())
+
+    metas, timelines = [], []
+    if args.index:
+        from replay_index import ReplayIndex
+
+        index = ReplayIndex(args.index)
+        for meta, rows in index.timelines(matchup=args.matchup, player=args.player):
+            metas.append(meta)
+            timelines.append(rows)
+        index.close()
+    if args.inputs:
+        import multiprocessing
+        from batch_parse import iter_sources
+
+        with multiprocessing.Pool(args.jobs, _silence_worker) as pool:
+            tasks = [(source, args.player) for source in iter_sources(args.inputs)]
+            for meta, timeline in pool.imap(_timeline_task, tasks):
+                if timeline is None:
+                    print(json.dumps(meta))
+                    continue
+                metas.append(meta)
+                timelines.append(timeline)
+
+    for meta, report in zip(metas, reference.align(timelines)):
+        if not args.steps:
+            report.pop('steps')
+            report.pop('extras')
+        print(json.dumps({**meta, **report}))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""Nearest-neighbour search over parsed builds ("which known build is this?").
+
+Each player's timeline becomes a fixed-length vector: how many of each unit /
+structure / upgrade were started in each ``BUCKET_SEC`` window of the first
+``HORIZON_SEC`` of the game, over the ``MAX_VOCAB`` most common canonical names
+(the same names ``tidy`` / ``upgrade_name_map`` give the text output).  Counts are
+log-scaled and L2-normalised, so a dot product is a cosine similarity and a batch
+of queries is one matrix product against the memory-mapped index:
+
+    python -m build_similarity build corpus.sqlite similar/
+    python -m build_similarity query similar/ replay.SC2Replay --player 1 -k 10
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+BUCKET_SEC = 60
+HORIZON_SEC = 10 * 60
+MAX_VOCAB = 128
+N_BUCKETS = HORIZON_SEC // BUCKET_SEC
+
+
+def timeline_vector(rows: Iterable[Dict[str, Any]], vocab: Dict[str, int]) -> np.ndarray:
+    """Normalised bucket-count vector for one timeline (rows with unit / clock_sec / count)."""
+    vec = np.zeros(len(vocab) * N_BUCKETS, dtype=np.float32)
+    for row in rows:
+        slot = vocab.get(row['unit'])
+        clock = row['clock_sec']
+        if slot is None or clock < 0 or clock >= HORIZON_SEC:
+            continue
+        vec[slot * N_BUCKETS + clock // BUCKET_SEC] += row.get('count', 1)
+    np.log1p(vec, out=vec)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+def build(index_path: str, out_dir: str) -> int:
+    """Vectorise every player timeline in a ``replay_index`` file; returns the count."""
+    os.makedirs(out_dir, exist_ok=True)
+    db = sqlite3.connect(index_path)
+    vocab_names = [name for (name,) in db.execute(
+        'SELECT u.name FROM rows x JOIN units u ON u.id = x.unit_id '
+        'WHERE x.clock_sec < ? GROUP BY x.unit_id ORDER BY COUNT(DISTINCT x.replay_id) DESC, u.name LIMIT ?',
+        (HORIZON_SEC, MAX_VOCAB),
+    )]
+    vocab = {name: i for i, name in enumerate(vocab_names)}
+    meta = [dict(zip(('sha256', 'file', 'pid', 'name', 'race', 'matchup'), row)) for row in db.execute(
+        'SELECT r.sha256, r.file, p.pid, p.name, p.race, p.matchup FROM players p '
+        'JOIN replays r ON r.id = p.replay_id ORDER BY p.replay_id, p.pid'
+    )]
+    vectors = np.lib.format.open_memmap(
+        os.path.join(out_dir, 'vectors.npy'), mode='w+', dtype=np.float32,
+        shape=(len(meta), len(vocab) * N_BUCKETS),
+    )
+    cursor = db.execute(
+        'SELECT x.replay_id, x.pid, u.name, x.clock_sec, x.count FROM rows x JOIN units u ON u.id = x.unit_id '
+        'WHERE x.clock_sec < ? ORDER BY x.replay_id, x.pid, x.seq',
+        (HORIZON_SEC,),
+    )
+    # players and rows come back in the same (replay, pid) order
+    player_keys = {(m['sha256'], m['pid']): i for i, m in enumerate(meta)}
+    replay_sha = dict(db.execute('SELECT id, sha256 FROM replays'))
+    current, rows = None, []
+    for replay_id, pid, unit, clock, count in cursor:
+        if (replay_id, pid) != current:
+            if current is not None:
+                vectors[player_keys[(replay_sha[current[0]], current[1])]] = timeline_vector(rows, vocab)
+            current, rows = (replay_id, pid), []
+        rows.append({'unit': unit, 'clock_sec': clock, 'count': count})
+    if current is not None:
+        vectors[player_keys[(replay_sha[current[0]], current[1])]] = timeline_vector(rows, vocab)
+    vectors.flush()
+    with open(os.path.join(out_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'vocab': vocab_names, 'bucket_sec': BUCKET_SEC, 'horizon_sec': HORIZON_SEC, 'builds': meta}, f)
+    db.close()
+    return len(meta)
+
+
+class SimilarityIndex:
+    def __init__(self, index_dir: str):
+        with open(os.path.join(index_dir, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        self.vocab = {name: i for i, name in enumerate(meta['vocab'])}
+        self.builds: List[Dict[str, Any]] = meta['builds']
+        self.vectors = np.load(os.path.join(index_dir, 'vectors.npy'), mmap_mode='r')
+        self._matchups = np.array([b.get('matchup') or '' for b in self.builds])
+        self._shas = np.array([b['sha256'] for b in self.builds])
+
+    def query(self, timelines: Sequence[Iterable[Dict[str, Any]]], k: int = 10,
+              matchup: Optional[str] = None, exclude: Optional[str] = None) -> List[List[Dict[str, Any]]]:
+        """The ``k`` most similar indexed builds for each timeline, best first.
+
+        ``exclude`` drops builds from the replay with that SHA-256 (the query itself).
+        """
+        if not len(self.builds):
+            return [[] for _ in timelines]
+        queries = np.stack([timeline_vector(t, self.vocab) for t in timelines])
+        # float32 on disk so BLAS reads the mapped pages directly (~0.1s per 100k builds)
+        scores = np.ascontiguousarray((self.vectors @ queries.T).T)   # (queries, builds)
+        if matchup:
+            scores[:, self._matchups != matchup.lower()] = -np.inf
+        if exclude:
+            scores[:, self._shas == exclude] = -np.inf
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for q, candidates in enumerate(top):
+            ranked = candidates[np.argsort(-scores[q, candidates])]
+            results.append([
+                dict(self.builds[i], score=round(float(scores[q, i]), 4))
+                for i in ranked if np.isfinite(scores[q, i])
+            ])
+        return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m build_similarity', description='Build similarity search.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('build', help='vectorise a replay_index SQLite file')
+    p.add_argument('index')
+    p.add_argument('out_dir')
+    p = sub.add_parser('query', help='most similar builds to one player of a replay')
+    p.add_argument('index_dir')
+    p.add_argument('replay')
+    p.add_argument('--player', default=None, help='pid or name (default: first player)')
+    p.add_argument('-k', type=int, default=10)
+    p.add_argument('--matchup')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        print(f'✅ {build(args.index, args.out_dir)} builds indexed in {args.out_dir}', file=sys.stderr)
+        return 0
+
+    from app import timeline_for_bytes, parse_upload_options
+    from replay_cache import replay_hash
+
+    with open(args.replay, 'rb') as f:
+        data = f.read()
+    player, timeline = timeline_for_bytes(data, parse_upload_options({'player': args.player}))
+    print(f"🔍 {player['name']} ({player['race']})", file=sys.stderr)
+    matches = SimilarityIndex(args.index_dir).query([timeline], args.k, args.matchup, exclude=replay_hash(data))[0]
+    for match in matches:
+        print(json.dumps(match))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""Columnar, memory-mapped aggregate statistics over a parsed replay corpus.
+
+``compact`` turns the rows of a ``replay_index`` SQLite file into one ``.npy``
+file per column (unit id, clock, supply, player, matchup, ...) plus a small
+``names.json`` vocabulary.  ``BuildStats`` maps those files read-only and answers
+group-by questions with vectorised NumPy, never building per-row Python objects:
+
+    python -m build_stats compact corpus.sqlite stats/
+    python -m build_stats timings stats/ --matchup zvp
+    python -m build_stats supply stats/ --unit Overlord --matchup zvp
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# column name -> dtype; rows are stored in (replay, player, timeline) order
+COLUMNS = {
+    'unit': np.int16,
+    'clock_sec': np.int32,
+    'supply': np.int16,
+    'count': np.int16,
+    'is_upgrade': np.bool_,
+    'replay': np.int32,
+    'player': np.int32,   # replay * 16 + pid – one value per player per game
+    'matchup': np.int8,   # index into names.json "matchups", from the player's side
+    'first': np.bool_,    # the player's earliest row of this unit
+}
+CHUNK_ROWS = 100_000
+CLOCK_BITS = 20  # clocks are packed below the group id when sorting (games < 12 days)
+CLOCK_MASK = (1 << CLOCK_BITS) - 1
+
+
+def compact(index_path: str, out_dir: str) -> int:
+    """Write the columns for every timeline row in ``index_path``; returns the row count."""
+    os.makedirs(out_dir, exist_ok=True)
+    db = sqlite3.connect(index_path)
+    unit_rows = db.execute('SELECT id, name FROM units ORDER BY id').fetchall()
+    units = [name for _, name in unit_rows]
+    unit_index = {uid: i for i, (uid, _) in enumerate(unit_rows)}
+    matchups = sorted({m or '' for (m,) in db.execute('SELECT DISTINCT matchup FROM players')})
+    matchup_index = {m: i for i, m in enumerate(matchups)}
+    total = db.execute('SELECT COUNT(*) FROM rows').fetchone()[0]
+
+    columns = {
+        name: np.lib.format.open_memmap(os.path.join(out_dir, f'{name}.npy'), mode='w+', dtype=dtype, shape=(total,))
+        for name, dtype in COLUMNS.items()
+    }
+    cursor = db.execute(
+        'SELECT x.unit_id, x.clock_sec, COALESCE(x.supply, -1), x.count, x.is_upgrade, x.replay_id, x.pid, '
+        "COALESCE(p.matchup, '') "
+        'FROM rows x JOIN players p ON p.replay_id = x.replay_id AND p.pid = x.pid '
+        'ORDER BY x.replay_id, x.pid, x.seq'
+    )
+    pos = 0
+    while True:
+        chunk = cursor.fetchmany(CHUNK_ROWS)
+        if not chunk:
+            break
+        unit_ids, clocks, supplies, counts, upgrades, replays, pids, mus = zip(*chunk)
+        end = pos + len(chunk)
+        columns['unit'][pos:end] = [unit_index[u] for u in unit_ids]
+        columns['clock_sec'][pos:end] = clocks
+        columns['supply'][pos:end] = supplies
+        columns['count'][pos:end] = counts
+        columns['is_upgrade'][pos:end] = upgrades
+        columns['replay'][pos:end] = replays
+        columns['player'][pos:end] = np.asarray(replays, dtype=np.int32) * 16 + np.asarray(pids, dtype=np.int32)
+        columns['matchup'][pos:end] = [matchup_index[m] for m in mus]
+        pos = end
+    # rows are in timeline order within a player, so the first index of each
+    # (player, unit) key is that player's earliest one – computed once here so
+    # queries are a plain mask instead of a sort
+    key = columns['player'].astype(np.int64) * max(len(units), 1) + columns['unit']
+    _, first = np.unique(key, return_index=True)
+    columns['first'][:] = False
+    columns['first'][first] = True
+    del key
+    for column in columns.values():
+        column.flush()
+    with open(os.path.join(out_dir, 'names.json'), 'w', encoding='utf-8') as f:
+        json.dump({'units': units, 'matchups': matchups, 'rows': total}, f)
+    db.close()
+    return total
+
+
+class BuildStats:
+    def __init__(self, stats_dir: str):
+        with open(os.path.join(stats_dir, 'names.json'), encoding='utf-8') as f:
+            names = json.load(f)
+        self.units: List[str] = names['units']
+        self.matchups: List[str] = names['matchups']
+        self._unit_ids = {name: i for i, name in enumerate(self.units)}
+        self.cols = {name: np.load(os.path.join(stats_dir, f'{name}.npy'), mmap_mode='r') for name in COLUMNS}
+
+    def _first_rows(self, unit: Optional[str] = None, matchup: Optional[str] = None) -> np.ndarray:
+        """Row indices of each player's *first* row per unit, optionally filtered."""
+        mask = np.array(self.cols['first'])
+        if unit is not None:
+            if unit not in self._unit_ids:
+                return np.empty(0, dtype=np.int64)
+            mask &= self.cols['unit'] == self._unit_ids[unit]
+        if matchup is not None:
+            if matchup.lower() not in self.matchups:
+                return np.empty(0, dtype=np.int64)
+            mask &= self.cols['matchup'] == self.matchups.index(matchup.lower())
+        return np.flatnonzero(mask)
+
+    def timing_quantiles(self, matchup: Optional[str] = None, unit: Optional[str] = None,
+                         quantiles=(0.25, 0.5, 0.75), min_games: int = 1) -> List[Dict]:
+        """Per (matchup, unit): how many players built it and quantiles of the first start."""
+        rows = self._first_rows(unit, matchup)
+        if not len(rows):
+            return []
+        group = self.cols['matchup'][rows].astype(np.int64) * len(self.units) + self.cols['unit'][rows]
+        clock = np.clip(self.cols['clock_sec'][rows], 0, CLOCK_MASK)
+        # one value sort on (group, clock) packed into an int64 beats an argsort + gathers
+        packed = np.sort((group << CLOCK_BITS) | clock)
+        group, clock = packed >> CLOCK_BITS, packed & CLOCK_MASK
+        starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+        sizes = np.diff(np.r_[starts, len(group)])
+        # linear-interpolated quantiles inside each sorted group, all groups at once
+        result = {}
+        for q in quantiles:
+            pos = starts + (sizes - 1) * q
+            lo = np.floor(pos).astype(np.int64)
+            hi = np.ceil(pos).astype(np.int64)
+            result[q] = clock[lo] + (clock[hi] - clock[lo]) * (pos - lo)
+        out = []
+        for i, start in enumerate(starts):
+            if sizes[i] < min_games:
+                continue
+            g = int(group[start])
+            out.append({
+                'matchup': self.matchups[g // len(self.units)],
+                'unit': self.units[g % len(self.units)],
+                'games': int(sizes[i]),
+                **{f'p{int(q * 100)}': round(float(result[q][i]), 1) for q in quantiles},
+            })
+        return out
+
+    def first_supply_distribution(self, unit: str, matchup: Optional[str] = None) -> Dict[int, int]:
+        """Histogram of the supply at which each player started their first ``unit``."""
+        supply = self.cols['supply'][self._first_rows(unit, matchup)]
+        supply = supply[supply >= 0]
+        if not len(supply):
+            return {}
+        counts = np.bincount(supply)
+        return {int(s): int(counts[s]) for s in np.flatnonzero(counts)}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m build_stats', description='Aggregate build statistics.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('compact', help='write columnar arrays from a replay_index SQLite file')
+    p.add_argument('index')
+    p.add_argument('out_dir')
+    p = sub.add_parser('timings', help='quantiles of first start time per matchup and unit')
+    p.add_argument('stats_dir')
+    p.add_argument('--matchup')
+    p.add_argument('--unit')
+    p.add_argument('--min-games', type=int, default=1)
+    p = sub.add_parser('supply', help='supply distribution of the first unit of a type')
+    p.add_argument('stats_dir')
+    p.add_argument('--unit', required=True)
+    p.add_argument('--matchup')
+    args = parser.parse_args(argv)
+
+    if args.command == 'compact':
+        print(f'✅ {compact(args.index, args.out_dir)} rows written to {args.out_dir}', file=sys.stderr)
+    elif args.command == 'timings':
+        for row in BuildStats(args.stats_dir).timing_quantiles(args.matchup, args.unit, min_games=args.min_games):
+            print(json.dumps(row))
+    else:
+        print(json.dumps(BuildStats(args.stats_dir).first_supply_distribution(args.unit, args.matchup)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
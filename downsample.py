@@ -0,0 +1,62 @@
+"""Shape-preserving downsampling of chart series (Largest-Triangle-Three-Buckets).
+
+LTTB keeps the first and last point and, for every bucket in between, the point
+forming the largest triangle with the previously kept point and the mean of the
+next bucket – peaks and drops (a supply block, a lost mineral line) survive where
+plain striding would skip them.  The bucket walk is inherently sequential, so the
+loop runs once per *output* point and every series sharing the same x axis is
+handled in the same NumPy operation.
+"""
+
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+
+def lttb_indices(x: np.ndarray, ys: np.ndarray, n_out: int) -> np.ndarray:
+    """``(series, n_out)`` indices into ``x`` chosen by LTTB for each row of ``ys``.
+
+    ``x`` is ``(n,)`` ascending, ``ys`` is ``(series, n)``.  When ``n_out`` does
+    not reduce the series every index is returned.
+    """
+    n = len(x)
+    series = ys.shape[0]
+    if n_out >= n or n_out < 3:
+        return np.broadcast_to(np.arange(n), (series, n))
+    x = x.astype(np.float64)
+    ys = ys.astype(np.float64)
+    rows = np.arange(series)
+    # n - 2 inner points split into n_out - 2 buckets
+    edges = (np.arange(n_out - 1) * (n - 2) / (n_out - 2) + 1).astype(np.int64)
+    edges[-1] = n - 1
+    picked = np.empty((series, n_out), dtype=np.int64)
+    picked[:, 0] = 0
+    picked[:, -1] = n - 1
+    prev = np.zeros(series, dtype=np.int64)
+    for b in range(n_out - 2):
+        lo, hi = edges[b], edges[b + 1]
+        nlo, nhi = (edges[b + 1], edges[b + 2]) if b + 2 < len(edges) else (n - 1, n)
+        avg_x = x[nlo:nhi].mean()
+        avg_y = ys[:, nlo:nhi].mean(axis=1)
+        ax, ay = x[prev], ys[rows, prev]
+        # twice the triangle area (prev, candidate, next-bucket mean), for all series at once
+        area = np.abs(
+            (ax - avg_x)[:, None] * (ys[:, lo:hi] - ay[:, None])
+            - (ax[:, None] - x[None, lo:hi]) * (avg_y - ay)[:, None]
+        )
+        prev = lo + area.argmax(axis=1)
+        picked[:, b + 1] = prev
+    return picked
+
+
+def downsample(x: Sequence[float], series: Dict[str, Sequence[float]], n_out: int) -> Dict[str, List[List[float]]]:
+    """``{name: [[x, y], ...]}`` with at most ``n_out`` points per named series."""
+    if not len(x):
+        return {name: [] for name in series}
+    xs = np.asarray(x)
+    ys = np.array([series[name] for name in series])
+    picked = lttb_indices(xs, ys, n_out)
+    return {
+        name: np.stack([xs[picked[i]], ys[i, picked[i]]], axis=1).tolist()
+        for i, name in enumerate(series)
+    }
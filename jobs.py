@@ -0,0 +1,91 @@
+"""Asynchronous parse jobs held in a TTL store.
+
+A job covers one or more replays parsed with the same options.  Clients create it
+with ``POST /jobs`` and poll ``GET /jobs/<id>``; finished jobs are kept for
+``ttl`` seconds after they were last touched, then dropped.
+"""
+
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class Job:
+    def __init__(self, names: List[str]):
+        self.id = uuid.uuid4().hex
+        self.created = time.time()
+        self.touched = self.created
+        self.finished: Optional[float] = None
+        self.items: List[Dict[str, Any]] = [
+            {'file': name, 'status': QUEUED} for name in names
+        ]
+
+    @property
+    def done(self) -> int:
+        return sum(1 for item in self.items if item['status'] in (DONE, FAILED))
+
+    @property
+    def status(self) -> str:
+        if self.done == len(self.items):
+            return FAILED if all(item['status'] == FAILED for item in self.items) else DONE
+        if any(item['status'] != QUEUED for item in self.items):
+            return RUNNING
+        return QUEUED
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The job as JSON; call it through ``JobStore.to_dict`` while parses may update it."""
+        return {
+            'id': self.id,
+            'status': self.status,
+            'progress': {'done': self.done, 'total': len(self.items)},
+            'created': self.created,
+            'finished': self.finished,
+            'results': [dict(item) for item in self.items],
+        }
+
+
+class JobStore:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def create(self, names: List[str]) -> Job:
+        job = Job(names)
+        with self._lock:
+            self._purge()
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._purge()
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.touched = time.time()
+            return job
+
+    def update(self, job: Job, index: int, **fields) -> None:
+        """Merge ``fields`` into one replay's result and stamp the job when complete."""
+        with self._lock:
+            job.items[index].update(fields)
+            job.touched = time.time()
+            if job.finished is None and job.done == len(job.items):
+                job.finished = job.touched
+
+    def to_dict(self, job: Job) -> Dict[str, Any]:
+        """A consistent snapshot of ``job``: results and progress from the same moment."""
+        with self._lock:
+            return job.to_dict()
+
+    def active(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.finished is None)
+
+    def _purge(self) -> None:
+        cutoff = time.time() - self.ttl
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.touched < cutoff]:
+            del self._jobs[job_id]
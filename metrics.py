@@ -0,0 +1,58 @@
+"""Tiny thread-safe metrics registry rendered in the Prometheus text format."""
+
+import threading
+from collections import defaultdict
+from typing import Dict, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = defaultdict(dict)
+        self._gauges: Dict[str, Dict[LabelKey, float]] = defaultdict(dict)
+        self._summaries: Dict[str, Dict[LabelKey, list]] = defaultdict(dict)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges[name][_labels(labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Record a sample for a ``_sum`` / ``_count`` summary."""
+        key = _labels(labels)
+        with self._lock:
+            series = self._summaries[name].setdefault(key, [0.0, 0])
+            series[0] += value
+            series[1] += 1
+
+    def render(self) -> str:
+        lines = []
+
+        def fmt(name: str, key: LabelKey, value: float) -> str:
+            label_str = ','.join(f'{k}="{v}"' for k, v in key)
+            return f'{name}{{{label_str}}} {value:g}' if label_str else f'{name} {value:g}'
+
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f'# TYPE {name} counter')
+                lines.extend(fmt(name, k, v) for k, v in sorted(series.items()))
+            for name, series in sorted(self._gauges.items()):
+                lines.append(f'# TYPE {name} gauge')
+                lines.extend(fmt(name, k, v) for k, v in sorted(series.items()))
+            for name, series in sorted(self._summaries.items()):
+                lines.append(f'# TYPE {name} summary')
+                for k, (total, count) in sorted(series.items()):
+                    lines.append(fmt(f'{name}_sum', k, total))
+                    lines.append(fmt(f'{name}_count', k, count))
+        return '\n'.join(lines) + '\n'
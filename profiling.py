@@ -0,0 +1,86 @@
+"""Opt-in cProfile + tracemalloc capture of a single parse.
+
+``profile_call`` runs a callable under cProfile with tracemalloc tracing and
+writes two files named after the replay: ``<name>-<time>.pstats`` (load it with
+``python -m pstats`` or snakeviz) and ``<name>-<time>.txt`` (the top functions
+and the allocation sites that grew the most).  Only one profiled call runs at a
+time, because tracemalloc is process-wide.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Tuple
+
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 20
+TRACE_FRAMES = 10
+
+_lock = threading.Lock()
+
+
+class ProfileBusy(RuntimeError):
+    pass
+
+
+def _func_label(func: Tuple[str, int, str]) -> str:
+    filename, line, name = func
+    return f'{os.path.basename(filename)}:{line}:{name}' if line else name
+
+
+def profile_call(fn: Callable[[], Any], out_dir: str, name: str) -> Tuple[Any, Dict[str, Any]]:
+    """``(fn(), summary)``; raises ``ProfileBusy`` while another profile is running."""
+    if not _lock.acquire(blocking=False):
+        raise ProfileBusy('Another profiled request is running')
+    try:
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start(TRACE_FRAMES)
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        profiler = cProfile.Profile()
+        wall, cpu = time.perf_counter(), time.process_time()
+        profiler.enable()
+        try:
+            result = fn()
+        finally:
+            profiler.disable()
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            _, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            if not tracing:
+                tracemalloc.stop()
+
+        os.makedirs(out_dir, exist_ok=True)
+        base = os.path.join(out_dir, f'{name}-{time.strftime("%Y%m%dT%H%M%S")}')
+        profiler.dump_stats(base + '.pstats')
+        stats = pstats.Stats(profiler)
+        report = io.StringIO()
+        report.write(f'wall {wall:.3f}s  cpu {cpu:.3f}s  peak traced memory {peak / 1024:.0f} KB\n\n')
+        stats.stream = report
+        stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        report.write('\nTop allocation growth\n')
+        for diff in after.compare_to(before, 'lineno')[:TOP_ALLOCATIONS]:
+            report.write(f'{diff}\n')
+        with open(base + '.txt', 'w', encoding='utf-8') as f:
+            f.write(report.getvalue())
+
+        by_self_time = sorted(stats.stats.items(), key=lambda item: -item[1][2])
+        summary = {
+            'wall_ms': round(wall * 1000),
+            'cpu_ms': round(cpu * 1000),
+            'peak_kb': round(peak / 1024),
+            'top': ','.join(_func_label(func) for func, _ in by_self_time[:3]),
+            'dump': os.path.basename(base),
+        }
+        return result, summary
+    finally:
+        _lock.release()
+
+
+def summary_header(summary: Dict[str, Any]) -> str:
+    return '; '.join(f'{key}={value}' for key, value in summary.items())
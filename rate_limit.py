@@ -0,0 +1,77 @@
+"""Per-client token buckets for the parse routes.
+
+Admission control (``admission.py``) protects the server as a whole; this keeps
+one client from taking all of it.  Every (route, client) pair has a bucket that
+refills at ``per_minute`` weight units a minute up to ``burst``.  A parse takes
+its replay weight (``admission.replay_weight``); when the bucket cannot cover it
+the request is refused with the seconds until it could be.  Buckets are kept in
+an LRU bounded by ``max_clients`` – an idle bucket is full again anyway.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+
+class Limit(NamedTuple):
+    per_minute: float
+    burst: float
+
+
+class RateLimited(Exception):
+    def __init__(self, route: str, retry_after: int):
+        super().__init__(f'rate limit for {route} exceeded, retry in {retry_after}s')
+        self.route = route
+        self.retry_after = retry_after
+
+
+def parse_limits(spec: str) -> Dict[str, Optional[Limit]]:
+    """``"upload=60:20,players=120"`` -> per-route limits (``route=0`` removes one).
+
+    Each entry is ``route=PER_MINUTE[:BURST]``; the burst defaults to a minute's worth.
+    """
+    limits: Dict[str, Optional[Limit]] = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        route, _, value = item.partition('=')
+        rate, _, burst = value.partition(':')
+        try:
+            per_minute = float(rate)
+            limits[route.strip()] = Limit(per_minute, float(burst) if burst else per_minute) if per_minute > 0 else None
+        except ValueError:
+            raise ValueError(f'Bad rate limit {item!r}, expected route=PER_MINUTE[:BURST]') from None
+    return limits
+
+
+class RateLimiter:
+    def __init__(self, limits: Dict[str, Optional[Limit]], max_clients: int = 10_000):
+        self.limits = {route: limit for route, limit in limits.items() if limit is not None}
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[tuple, list]" = OrderedDict()  # (route, client) -> [tokens, updated]
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, route: str, client: str, cost: float) -> None:
+        """Charge ``cost`` to the client's bucket for ``route`` or raise ``RateLimited``."""
+        limit = self.limits.get(route)
+        if limit is None:
+            return
+        # a replay heavier than the whole burst still goes through from a full bucket
+        cost = min(cost, limit.burst)
+        rate = limit.per_minute / 60
+        now = time.monotonic()
+        key = (route, client)
+        with self._lock:
+            bucket = self._buckets.pop(key, None) or [limit.burst, now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            tokens = min(limit.burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens < cost:
+                bucket[0] = tokens
+                raise RateLimited(route, max(1, math.ceil((cost - tokens) / rate)))
+            bucket[0] = tokens - cost
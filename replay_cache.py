@@ -0,0 +1,97 @@
+"""In-memory caches for the replay parser service.
+
+* ``ReplayStore`` keeps the raw bytes of recently uploaded replays keyed by their
+  SHA-256, bounded by total size, so a client that already sent a file (e.g. to
+  ``/players``) never has to send it again.
+* ``ResultCache`` keeps finished build orders keyed by replay hash + options.
+
+Both are plain LRUs guarded by a lock – waitress serves requests from a thread pool.
+"""
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def replay_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def normalise_hash(value: Optional[str]) -> Optional[str]:
+    """Return a lower-case hex digest, or None when ``value`` is not a SHA-256."""
+    value = (value or '').strip().lower()
+    return value if SHA256_RE.match(value) else None
+
+
+class ReplayStore:
+    """LRU of replay bytes bounded by total size in bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def put(self, sha: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if sha in self._items:
+                self._items.move_to_end(sha)
+                return
+            self._items[sha] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, old = self._items.popitem(last=False)
+                self._size -= len(old)
+
+    def get(self, sha: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._items.get(sha)
+            if data is not None:
+                self._items.move_to_end(sha)
+            return data
+
+    def __contains__(self, sha: str) -> bool:
+        with self._lock:
+            return sha in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class ResultCache:
+    """LRU of parse results bounded by entry count."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._items: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+def options_key(options: Dict[str, Any]) -> tuple:
+    """Hashable, order-independent form of the parse options."""
+    return tuple(sorted((k, v) for k, v in options.items()))
@@ -0,0 +1,264 @@
+"""Local SQLite index of parsed replays for matchup / player / timing queries.
+
+Filled by ``python -m batch_parse REPLAYS -o builds.jsonl --index corpus.sqlite``,
+which stores every player's structured timeline next to the replay's players and
+matchup.  Queries then hit indexes instead of re-parsing files:
+
+    python -m replay_index corpus.sqlite --unit "Spawning Pool" --matchup ZvP --before 1:00
+    python -m replay_index corpus.sqlite --player Serral
+
+Matchups are stored from each player's point of view ("zvp" is the Zerg player
+of a ZvP), so a timing query only looks at the rows of the race that builds it.
+"""
+
+import argparse
+import json
+import sqlite3
+import sys
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from timeline_codec import decode_timeline, encode_timeline
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS replays (
+    id          INTEGER PRIMARY KEY,
+    sha256      TEXT NOT NULL UNIQUE,
+    file        TEXT,
+    matchup     TEXT,
+    length_sec  INTEGER,
+    played_at   TEXT
+);
+CREATE TABLE IF NOT EXISTS players (
+    replay_id   INTEGER NOT NULL REFERENCES replays(id),
+    pid         INTEGER NOT NULL,
+    name        TEXT,
+    race        TEXT,
+    matchup     TEXT,
+    PRIMARY KEY (replay_id, pid)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS units (
+    id          INTEGER PRIMARY KEY,
+    name        TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS rows (
+    replay_id   INTEGER NOT NULL,
+    pid         INTEGER NOT NULL,
+    seq         INTEGER NOT NULL,
+    unit_id     INTEGER NOT NULL REFERENCES units(id),
+    is_upgrade  INTEGER NOT NULL,
+    supply      INTEGER,
+    clock_sec   INTEGER NOT NULL,
+    count       INTEGER NOT NULL,
+    PRIMARY KEY (replay_id, pid, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS timelines (
+    replay_id   INTEGER NOT NULL,
+    pid         INTEGER NOT NULL,
+    data        BLOB NOT NULL,   -- timeline_codec encoding of the player's rows
+    PRIMARY KEY (replay_id, pid)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rows_unit_clock ON rows(unit_id, clock_sec);
+CREATE INDEX IF NOT EXISTS players_name ON players(name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS players_matchup ON players(matchup);
+"""
+
+
+def parse_clock(value) -> int:
+    """``'1:05'`` / ``'65'`` / ``65`` → seconds."""
+    if isinstance(value, int):
+        return value
+    minutes, _, seconds = str(value).rpartition(':')
+    return int(minutes or 0) * 60 + int(seconds)
+
+
+def player_matchup(race: Optional[str], opponents: Iterable[Optional[str]]) -> Optional[str]:
+    opponents = [r for r in opponents if r]
+    if not race or not opponents:
+        return None
+    return f"{race[0].lower()}v{''.join(r[0].lower() for r in opponents)}"
+
+
+class ReplayIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+        self._unit_ids: Dict[str, int] = {
+            row['name']: row['id'] for row in self.db.execute('SELECT id, name FROM units')
+        }
+
+    def close(self) -> None:
+        self.db.close()
+
+    # ---- ingestion ------------------------------------------------
+    def _unit_id(self, name: str) -> int:
+        unit_id = self._unit_ids.get(name)
+        if unit_id is None:
+            unit_id = self.db.execute('INSERT INTO units(name) VALUES (?)', (name,)).lastrowid
+            self._unit_ids[name] = unit_id
+        return unit_id
+
+    def hashes(self) -> set:
+        return {row[0] for row in self.db.execute('SELECT sha256 FROM replays')}
+
+    def add(self, record: Dict[str, Any]) -> bool:
+        """Store one ``build_orders_for_all_players`` record (with timelines).
+
+        Timelines may be row lists or ``timeline_codec`` bytes.  Returns False
+        when the replay is already indexed.
+        """
+        with self.db:
+            cur = self.db.execute(
+                'INSERT OR IGNORE INTO replays(sha256, file, matchup, length_sec, played_at) VALUES (?, ?, ?, ?, ?)',
+                (record['sha256'], record.get('file'), record.get('matchup'),
+                 record.get('length'), record.get('played_at')),
+            )
+            if not cur.rowcount:
+                return False
+            replay_id = cur.lastrowid
+            players = record.get('players', [])
+            for player in players:
+                timeline = player.get('timeline', [])
+                if isinstance(timeline, (bytes, bytearray, memoryview)):
+                    blob, timeline = bytes(timeline), decode_timeline(timeline)
+                else:
+                    blob = encode_timeline(timeline)
+                opponents = [p['race'] for p in players if p['pid'] != player['pid']]
+                self.db.execute(
+                    'INSERT INTO players(replay_id, pid, name, race, matchup) VALUES (?, ?, ?, ?, ?)',
+                    (replay_id, player['pid'], player['name'], player['race'],
+                     player_matchup(player['race'], opponents)),
+                )
+                self.db.executemany(
+                    'INSERT INTO rows(replay_id, pid, seq, unit_id, is_upgrade, supply, clock_sec, count) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    [
+                        (replay_id, player['pid'], seq, self._unit_id(row['unit']),
+                         int(row.get('type') == 'upgrade'), row.get('supply'), row['clock_sec'],
+                         row.get('count', 1))
+                        for seq, row in enumerate(timeline)
+                    ],
+                )
+                self.db.execute('INSERT INTO timelines(replay_id, pid, data) VALUES (?, ?, ?)',
+                                (replay_id, player['pid'], blob))
+        return True
+
+    # ---- queries --------------------------------------------------
+    def unit_timings(self, unit: str, matchup: Optional[str] = None, before: Optional[int] = None,
+                     after: Optional[int] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Games where ``unit`` was first started within ``[after, before)`` seconds."""
+        unit_id = self._unit_ids.get(unit)
+        if unit_id is None:
+            return []
+        sql = [
+            'SELECT r.sha256, r.file, p.pid, p.name, p.race, p.matchup, MIN(x.clock_sec) AS clock_sec, x.supply',
+            'FROM rows x',
+            'JOIN players p ON p.replay_id = x.replay_id AND p.pid = x.pid',
+            'JOIN replays r ON r.id = x.replay_id',
+            'WHERE x.unit_id = ?',
+        ]
+        params: List[Any] = [unit_id]
+        if matchup:
+            sql.append('AND p.matchup = ?')
+            params.append(matchup.lower())
+        if before is not None:
+            # "first one before T" == "any before T": a range scan on rows_unit_clock
+            sql.append('AND x.clock_sec < ?')
+            params.append(before)
+        sql.append('GROUP BY x.replay_id, x.pid')
+        if after is not None:
+            sql.append('HAVING MIN(x.clock_sec) >= ?')
+            params.append(after)
+        sql.append('ORDER BY clock_sec LIMIT ?')
+        params.append(limit)
+        return [dict(row) for row in self.db.execute('\n'.join(sql), params)]
+
+    def games_by_player(self, name: str, matchup: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        sql = (
+            'SELECT r.sha256, r.file, r.played_at, r.length_sec, p.pid, p.name, p.race, p.matchup '
+            'FROM players p JOIN replays r ON r.id = p.replay_id '
+            'WHERE p.name = ? COLLATE NOCASE'
+        )
+        params: List[Any] = [name]
+        if matchup:
+            sql += ' AND p.matchup = ?'
+            params.append(matchup.lower())
+        sql += ' ORDER BY r.played_at DESC LIMIT ?'
+        params.append(limit)
+        return [dict(row) for row in self.db.execute(sql, params)]
+
+    def timeline(self, sha256: str, pid: int) -> List[Dict[str, Any]]:
+        return [dict(row) for row in self.db.execute(
+            'SELECT u.name AS unit, x.is_upgrade, x.supply, x.clock_sec, x.count '
+            'FROM rows x JOIN replays r ON r.id = x.replay_id JOIN units u ON u.id = x.unit_id '
+            'WHERE r.sha256 = ? AND x.pid = ? ORDER BY x.seq',
+            (sha256, pid),
+        )]
+
+    def timelines(self, matchup: Optional[str] = None,
+                  player: Optional[str] = None) -> Iterator[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        """``(player info, timeline)`` for every indexed player.
+
+        Timelines come from the encoded ``timelines`` table (one blob per player);
+        replays indexed before it existed fall back to their ``rows``.
+        """
+        sql = (
+            'SELECT r.sha256, r.file, p.pid, p.name, p.race, p.matchup, t.data '
+            'FROM players p JOIN replays r ON r.id = p.replay_id '
+            'LEFT JOIN timelines t ON t.replay_id = p.replay_id AND t.pid = p.pid '
+            'WHERE 1 = 1'
+        )
+        params: List[Any] = []
+        if matchup:
+            sql += ' AND p.matchup = ?'
+            params.append(matchup.lower())
+        if player:
+            sql += ' AND p.name = ? COLLATE NOCASE'
+            params.append(player)
+        sql += ' ORDER BY p.replay_id, p.pid'
+        for row in self.db.execute(sql, params).fetchall():
+            info = {k: row[k] for k in ('sha256', 'file', 'pid', 'name', 'race', 'matchup')}
+            if row['data'] is not None:
+                yield info, decode_timeline(row['data'])
+            else:
+                yield info, self.timeline(row['sha256'], row['pid'])
+
+    def stats(self) -> Dict[str, int]:
+        count = lambda table: self.db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        return {table: count(table) for table in ('replays', 'players', 'rows', 'units', 'timelines')}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m replay_index', description='Query a local replay index.')
+    parser.add_argument('db', help='SQLite file written by batch_parse --index')
+    parser.add_argument('--unit', help='unit / structure / upgrade name, e.g. "Spawning Pool"')
+    parser.add_argument('--player', help='player name (case-insensitive)')
+    parser.add_argument('--matchup', help='matchup from the player\'s side, e.g. ZvP')
+    parser.add_argument('--before', help='first started before mm:ss')
+    parser.add_argument('--after', help='first started at or after mm:ss')
+    parser.add_argument('--limit', type=int, default=100)
+    args = parser.parse_args(argv)
+
+    index = ReplayIndex(args.db)
+    if args.unit:
+        rows = index.unit_timings(
+            args.unit, args.matchup,
+            parse_clock(args.before) if args.before else None,
+            parse_clock(args.after) if args.after else None,
+            args.limit,
+        )
+    elif args.player:
+        rows = index.games_by_player(args.player, args.matchup, args.limit)
+    else:
+        rows = [index.stats()]
+    for row in rows:
+        print(json.dumps(row))
+    index.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
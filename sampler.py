@@ -0,0 +1,133 @@
+"""Always-on, low-overhead sampling profiler for parse threads.
+
+A daemon thread wakes ``hz`` times a second, reads ``sys._current_frames()`` and
+counts the stack of every thread currently inside ``track()`` – i.e. parsing –
+so idle server threads never show up.  Worker processes run a sampler of their
+own and hand back ``drain()``; the server folds it in with ``merge()``.  Stacks
+are aggregated across requests and rendered in the collapsed format flamegraph tools read
+(``flamegraph.pl``, speedscope, inferno):
+
+    app.py:upload;app.py:cached_build_order;...;readers.py:__call__ 42
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+MAX_DEPTH = 64
+MAX_STACKS = 20_000
+OVERFLOW = ('[other stacks]',)
+
+
+class StackSampler:
+    def __init__(self, hz: float):
+        self.interval = 1.0 / hz if hz > 0 else 0.0
+        self.samples = 0
+        self.overhead = 0.0  # seconds spent sampling
+        self.started_at = time.monotonic()
+        self._stacks: Counter = Counter()
+        self._labels: Dict[object, str] = {}
+        self._active: Dict[int, int] = {}  # thread id -> nesting depth of track()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self) -> 'StackSampler':
+        if self.interval and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._stop.clear()
+
+    @contextmanager
+    def track(self):
+        """Sample the calling thread while inside this block."""
+        ident = threading.get_ident()
+        with self._lock:
+            self._active[ident] = self._active.get(ident, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                if self._active[ident] == 1:
+                    del self._active[ident]
+                else:
+                    self._active[ident] -= 1
+
+    @contextmanager
+    def idle(self):
+        """Stop sampling the calling thread inside a ``track()`` block (while it waits on a worker)."""
+        ident = threading.get_ident()
+        with self._lock:
+            depth = self._active.pop(ident, None)
+        try:
+            yield
+        finally:
+            if depth is not None:
+                with self._lock:
+                    self._active[ident] = depth
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f'{os.path.basename(code.co_filename)}:{code.co_name}'
+        return label
+
+    def _stack(self, frame) -> Tuple[str, ...]:
+        labels = []
+        while frame is not None and len(labels) < MAX_DEPTH:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        labels.reverse()
+        return tuple(labels)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            started = time.perf_counter()
+            with self._lock:
+                active = list(self._active)
+            if active:
+                frames = sys._current_frames()
+                stacks = [self._stack(frames[ident]) for ident in active if ident in frames]
+                self.merge(Counter(stacks))
+                del frames
+            self.overhead += time.perf_counter() - started
+
+    def merge(self, stacks: Dict[Tuple[str, ...], int]) -> None:
+        """Add sampled stack counts, e.g. another process's ``drain()``."""
+        with self._lock:
+            for stack, count in stacks.items():
+                if stack not in self._stacks and len(self._stacks) >= MAX_STACKS:
+                    stack = OVERFLOW
+                self._stacks[stack] += count
+                self.samples += count
+
+    def drain(self) -> Dict[Tuple[str, ...], int]:
+        """The stack counts so far, leaving the sampler empty."""
+        with self._lock:
+            stacks, self._stacks = self._stacks, Counter()
+        return dict(stacks)
+
+    def collapsed(self, reset: bool = False) -> str:
+        with self._lock:
+            stacks = self._stacks
+            if reset:
+                self._stacks = Counter()
+            else:
+                stacks = Counter(stacks)  # the sampler thread keeps merging into the live one
+        return ''.join(f"{';'.join(stack)} {count}\n" for stack, count in stacks.most_common())
+
+    def overhead_ratio(self) -> float:
+        """Share of wall time the sampler thread itself used since it started."""
+        elapsed = time.monotonic() - self.started_at
+        return self.overhead / elapsed if elapsed else 0.0
@@ -0,0 +1,214 @@
+"""Local performance benchmark for the replay parser.
+
+    python scripts/benchmark.py [REPLAY_DIR] [--repeat N]
+
+Sections:
+  parse      load + extract time per replay and player (same code as /upload)
+  timelines  size and encode / decode time of the extracted rows as JSON,
+             pickle and the binary timeline_codec format
+  memory     peak RSS and time spent in GC pauses per /upload parse, with the
+             parse-path GC tuning (GC_TUNING, the default) and without it; each
+             in a fresh warmed-up interpreter
+  startup    `python -X importtime -c "import app"` in a fresh interpreter (the
+             slowest imports) and the first vs. a warm request with and without
+             warm_up(); --max-import-ms fails the run when the import is slower
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import pickle
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def best_of(repeat, fn):
+    """Fastest of ``repeat`` runs of ``fn()`` in seconds (least disturbed by noise)."""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def replay_files(directory):
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith('.sc2replay')
+    )
+
+
+def bench_parse(files, repeat):
+    from app import load_replay_bytes, player_summary, extract_entries, parse_upload_options
+
+    print('## parse')
+    timelines = []
+    for path in files:
+        with open(path, 'rb') as f:
+            data = f.read()
+        with contextlib.redirect_stdout(io.StringIO()):  # the extraction loop is chatty
+            load = best_of(repeat, lambda: load_replay_bytes(data))
+            replay = load_replay_bytes(data)
+            players, _ = player_summary(replay)
+            extract = []
+            for player in players:
+                options = parse_upload_options({'player': str(player['pid'])})
+                extract.append(best_of(repeat, lambda: extract_entries(replay, options)))
+                timelines.append(extract_entries(replay, options)[0])
+        print(f'{os.path.basename(path):32} {len(data) / 1024:7.0f} KB  load {load * 1e3:7.1f} ms  '
+              f'extract {statistics.mean(extract) * 1e3:6.1f} ms/player')
+    return timelines
+
+
+def bench_timelines(timelines, repeat):
+    from timeline_codec import encode_timeline, decode_timeline
+
+    print('## timelines')
+    formats = [
+        ('json', lambda rows: json.dumps(rows).encode('utf-8'), json.loads),
+        ('pickle', lambda rows: pickle.dumps(rows, pickle.HIGHEST_PROTOCOL), pickle.loads),
+        ('codec', encode_timeline, decode_timeline),
+    ]
+    rows = sum(len(t) for t in timelines)
+    for name, encode, decode in formats:
+        blobs = [encode(t) for t in timelines]
+        size = sum(len(b) for b in blobs)
+        enc = best_of(repeat, lambda: [encode(t) for t in timelines])
+        dec = best_of(repeat, lambda: [decode(b) for b in blobs])
+        print(f'{name:8} {size:9d} B ({size / rows:5.1f} B/row)  encode {enc * 1e3:6.2f} ms  '
+              f'decode {dec * 1e3:6.2f} ms  ({len(timelines)} timelines, {rows} rows)')
+
+
+MEMORY_RUN = """
+import gc, io, json, sys, time, contextlib
+sys.path.insert(0, {root!r})
+import app, workers
+with contextlib.redirect_stdout(io.StringIO()):
+    app.warm_up()
+pauses = []
+def timer(phase, info, started=[0.0]):
+    if phase == 'start':
+        started[0] = time.perf_counter()
+    else:
+        pauses.append(time.perf_counter() - started[0])
+gc.callbacks.append(timer)
+for path in {files!r}:
+    with open(path, 'rb') as f:
+        data = f.read()
+    del pauses[:]
+    workers.reset_peak_rss()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for player in ('1', '2'):
+            app.build_order_for_bytes(data, app.parse_upload_options({{'player': player}}))
+    wall = time.perf_counter() - started
+    print('MEMORY', json.dumps([path, workers.peak_rss(), wall, sum(pauses), max(pauses, default=0), len(pauses)]))
+"""
+
+
+def bench_memory(files):
+    """Peak RSS and GC pauses of two /upload parses per replay, before / after the GC tuning."""
+    print('## memory')
+    results = {}
+    for tuning in ('0', '1'):
+        env = dict(os.environ, GC_TUNING=tuning, ISOLATE_PARSES='0')
+        proc = subprocess.run([sys.executable, '-c', MEMORY_RUN.format(root=ROOT, files=files)],
+                              env=env, capture_output=True, text=True, check=True)
+        for line in proc.stdout.splitlines():
+            if line.startswith('MEMORY '):
+                path, *row = json.loads(line[len('MEMORY '):])
+                results[path, tuning] = row
+    for path in files:
+        for tuning, label in (('0', 'before'), ('1', 'after')):
+            peak, wall, paused, longest, count = results[path, tuning]
+            peak_mb = f'{peak / 2 ** 20:6.1f} MB' if peak else '     n/a'
+            print(f'{os.path.basename(path):32} {label:6}  peak RSS {peak_mb}  GC {paused * 1e3:6.1f} ms '
+                  f'in {count:3d} pauses (max {longest * 1e3:5.1f} ms)  parse {wall * 1e3:6.0f} ms')
+
+
+def import_times():
+    """``[(module, self_us, cumulative_us)]`` for ``import app`` in a fresh interpreter."""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        rows.append((module.rstrip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+FIRST_REQUEST = """
+import io, sys, time, contextlib
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+import app
+imported = time.perf_counter() - started
+if {warm}:
+    app.warm_up()
+data = open({replay!r}, 'rb').read()
+client = app.app.test_client()
+times = []
+for i in range(2):
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        client.post('/upload', data={{'replay': (io.BytesIO(data), 'r.SC2Replay'), 'player': str(i)}})
+    times.append(time.perf_counter() - started)
+print(imported, *times)
+"""
+
+
+def bench_startup(replay, max_import_ms):
+    print('## startup')
+    rows = import_times()
+    depth = lambda module: (len(module) - len(module.lstrip()) - 1) // 2
+    end = max(i for i, (module, _, _) in enumerate(rows) if module.strip() == 'app')
+    start = max((i for i in range(end) if depth(rows[i][0]) == 0), default=-1) + 1
+    total_ms = rows[end][2] / 1000
+    # the modules app imports directly (children are listed before their parent)
+    top = sorted((r for r in rows[start:end] if depth(r[0]) == 1), key=lambda r: -r[2])[:8]
+    print(f'import app           {total_ms:7.1f} ms')
+    for module, _, cumulative in top:
+        print(f'  {module.strip():18} {cumulative / 1000:7.1f} ms')
+    for warm in (False, True):
+        proc = subprocess.run([sys.executable, '-c', FIRST_REQUEST.format(root=ROOT, warm=warm, replay=replay)],
+                              capture_output=True, text=True, check=True)
+        imported, first, second = map(float, proc.stdout.split()[-3:])
+        print(f"{'warm_up()' if warm else 'cold':10} first request {first * 1e3:6.1f} ms  "
+              f'next {second * 1e3:6.1f} ms')
+    if max_import_ms and total_ms > max_import_ms:
+        print(f'❌ import app took {total_ms:.0f} ms (limit {max_import_ms} ms)', file=sys.stderr)
+        return False
+    return True
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('replays', nargs='?', default=os.path.join(ROOT, 'replay'))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-import-ms', type=float, default=0, help='fail if `import app` is slower')
+    args = parser.parse_args(argv)
+
+    files = replay_files(args.replays)
+    if not files:
+        print(f'No .SC2Replay files in {args.replays}', file=sys.stderr)
+        return 1
+    timelines = bench_parse(files, args.repeat)
+    bench_timelines(timelines, args.repeat * 10)
+    bench_memory(files)
+    return 0 if bench_startup(min(files, key=os.path.getsize), args.max_import_ms) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
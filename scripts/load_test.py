@@ -0,0 +1,306 @@
+"""Load test for the parser service (stdlib only).
+
+    python scripts/load_test.py [REPLAY_DIR] --threads 4,16 --concurrency 1,4,8 [--duration 30]
+    python scripts/load_test.py --rate 2,5 --threads 16          # open loop, sessions/s
+    python scripts/load_test.py --url http://host:5000 --concurrency 8   # an already running server
+
+For every configuration (waitress threads x concurrency or arrival rate) a fresh
+``python app.py`` is started on a free port, waited for on /ready and then sent
+sessions picked from the replays in REPLAY_DIR (default ``replay/``): a
+``/players`` call followed by an ``/upload`` for one of the players it returned,
+with the display / filter options toggled at random.  Rate limits are turned off
+for the run; ``--cold`` also disables the result and timeline caches so every
+upload parses.  ``--env KEY=VALUE`` passes more settings (``PARSE_CONCURRENCY``,
+``PARSE_WORKERS``, ``ISOLATE_PARSES``, ...) to the server.
+
+``--concurrency N`` keeps N sessions in flight (closed loop).  ``--rate R`` starts
+R sessions a second at Poisson arrival times however slow the server is (open
+loop); latency is then measured from the scheduled start, so queueing in front
+of the server is counted too.  Prints throughput, p50 / p95 / p99 latency and
+the error rate (any non-2xx, with 429 / 503 shed load counted apart) per route.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OPTION_FLAGS = ('exclude_workers', 'exclude_units', 'exclude_supply', 'exclude_time', 'compact')
+SHED_STATUSES = (429, 503)
+READY_TIMEOUT = 60
+MAX_OPEN_LOOP_THREADS = 256
+
+
+def replay_files(directory: str) -> List[str]:
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith('.sc2replay')
+    )
+
+
+def multipart(fields: Dict[str, str], name: str, data: bytes) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    parts = []
+    for key, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="replay"; filename="{name}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: Dict[str, List[Tuple[float, int]]] = {}  # route -> [(seconds, status)]
+
+    def add(self, route: str, seconds: float, status: int) -> None:
+        with self._lock:
+            self.samples.setdefault(route, []).append((seconds, status))
+
+
+class Client:
+    """One keep-alive connection, used by a single thread at a time."""
+
+    def __init__(self, url: str):
+        parsed = urllib.parse.urlsplit(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.conn: Optional[http.client.HTTPConnection] = None
+
+    def post(self, path: str, body: bytes, content_type: str) -> Tuple[int, bytes]:
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=120)
+            try:
+                self.conn.request('POST', path, body, {'Content-Type': content_type})
+                response = self.conn.getresponse()
+                return response.status, response.read()
+            except (ConnectionError, http.client.HTTPException):
+                # the server closed an idle keep-alive connection; retry once on a new one
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+        raise AssertionError('unreachable')
+
+
+def run_session(client: Client, replays: List[Tuple[str, bytes]], rng: random.Random,
+                recorder: Recorder, started: Optional[float] = None) -> None:
+    """``/players`` then ``/upload`` for one random replay, player and option mix."""
+    name, data = rng.choice(replays)
+    started = time.perf_counter() if started is None else started
+    try:
+        status, payload = client.post('/players', *multipart({}, name, data))
+    except OSError:
+        status, payload = 0, b''
+    recorder.add('/players', time.perf_counter() - started, status)
+    try:
+        players = [p['pid'] for p in json.loads(payload)['players']] if status == 200 else []
+    except (ValueError, KeyError):
+        players = []
+
+    fields = {flag: '1' for flag in OPTION_FLAGS if rng.random() < 0.25}
+    fields['player'] = str(rng.choice(players)) if players else '1'
+    if rng.random() < 0.1:
+        fields['stop_time'] = str(rng.randint(3, 8))
+    started = time.perf_counter()
+    try:
+        status, _ = client.post('/upload', *multipart(fields, name, data))
+    except OSError:
+        status = 0
+    recorder.add('/upload', time.perf_counter() - started, status)
+
+
+def closed_loop(url: str, replays, concurrency: int, duration: float, seed: int) -> Tuple[Recorder, float]:
+    recorder = Recorder()
+    stop_at = time.perf_counter() + duration
+
+    def worker(index: int) -> None:
+        client, rng = Client(url), random.Random(seed + index)
+        while time.perf_counter() < stop_at:
+            run_session(client, replays, rng, recorder)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - started
+
+
+def open_loop(url: str, replays, rate: float, duration: float, seed: int) -> Tuple[Recorder, float]:
+    recorder = Recorder()
+    rng = random.Random(seed)
+    local = threading.local()
+
+    def session(scheduled: float, session_seed: int) -> None:
+        if not hasattr(local, 'client'):
+            local.client = Client(url)
+        run_session(local.client, replays, random.Random(session_seed), recorder, scheduled)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(MAX_OPEN_LOOP_THREADS) as pool:
+        next_at = started
+        while True:
+            next_at += rng.expovariate(rate)
+            if next_at - started >= duration:
+                break
+            time.sleep(max(0.0, next_at - time.perf_counter()))
+            pool.submit(session, next_at, rng.getrandbits(32))
+    return recorder, time.perf_counter() - started
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return float('nan')
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def report(label: str, recorder: Recorder, elapsed: float) -> List[Dict[str, object]]:
+    rows = []
+    routes = dict(recorder.samples)
+    routes['all'] = [s for samples in recorder.samples.values() for s in samples]
+    print(f'## {label}  ({elapsed:.1f}s)')
+    print(f'{"route":10} {"requests":>8} {"req/s":>7} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} '
+          f'{"errors":>7} {"shed":>6}')
+    for route, samples in routes.items():
+        latencies = sorted(seconds for seconds, _ in samples)
+        errors = sum(1 for _, status in samples if not 200 <= status < 300)
+        shed = sum(1 for _, status in samples if status in SHED_STATUSES)
+        row = {
+            'config': label, 'route': route, 'requests': len(samples),
+            'throughput': len(samples) / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(latencies, 50) * 1e3, 'p95_ms': percentile(latencies, 95) * 1e3,
+            'p99_ms': percentile(latencies, 99) * 1e3,
+            'error_rate': errors / len(samples) if samples else 0.0,
+            'shed_rate': shed / len(samples) if samples else 0.0,
+        }
+        rows.append(row)
+        print(f'{route:10} {row["requests"]:8d} {row["throughput"]:7.2f} {row["p50_ms"]:8.0f} '
+              f'{row["p95_ms"]:8.0f} {row["p99_ms"]:8.0f} {row["error_rate"]:7.1%} {row["shed_rate"]:6.1%}')
+    return rows
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(threads: int, cold: bool, extra_env: Dict[str, str]) -> Tuple[subprocess.Popen, str]:
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), WAITRESS_THREADS=str(threads), RATE_LIMITS='off')
+    if cold:
+        env.update(RESULT_CACHE_SIZE='0', TIMELINE_CACHE_SIZE='0')
+    env.update(extra_env)
+    # the extraction loop is chatty; keep the server's output out of the report
+    # own session, so stop_server() reaches the parse workers as well
+    proc = subprocess.Popen([sys.executable, 'app.py'], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+    deadline = time.monotonic() + READY_TIMEOUT
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'app.py exited with status {proc.returncode}')
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/ready')
+            if conn.getresponse().status == 200:
+                return proc, f'http://127.0.0.1:{port}'
+        except OSError:
+            pass
+        time.sleep(0.2)
+    stop_server(proc)
+    raise RuntimeError(f'app.py was not ready within {READY_TIMEOUT}s')
+
+
+def stop_server(proc: subprocess.Popen) -> None:
+    """SIGTERM the server's whole process group; SIGKILL what is left after a while."""
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=READY_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        pass
+    except ProcessLookupError:
+        return
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)  # workers that outlived the server
+    except ProcessLookupError:
+        pass
+    proc.wait()
+
+
+def int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(',') if v]
+
+
+def float_list(value: str) -> List[float]:
+    return [float(v) for v in value.split(',') if v]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('replays', nargs='?', default=os.path.join(ROOT, 'replay'))
+    parser.add_argument('--threads', type=int_list, default=[16], help='WAITRESS_THREADS values to compare')
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument('--concurrency', type=int_list, help='sessions in flight (closed loop), e.g. 1,4,8')
+    load.add_argument('--rate', type=float_list, help='sessions started per second (open loop), e.g. 2,5')
+    parser.add_argument('--duration', type=float, default=30, help='seconds per configuration')
+    parser.add_argument('--cold', action='store_true', help='disable the result caches so every upload parses')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help='extra server setting')
+    parser.add_argument('--url', help='test this running server instead of starting app.py (ignores --threads)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='also write the result rows to this file')
+    args = parser.parse_args(argv)
+
+    files = replay_files(args.replays)
+    if not files:
+        print(f'No .SC2Replay files in {args.replays}', file=sys.stderr)
+        return 1
+    replays = []
+    for path in files:
+        with open(path, 'rb') as f:
+            replays.append((os.path.basename(path), f.read()))
+    extra_env = dict(item.split('=', 1) for item in args.env)
+    loads = [('rate', r) for r in args.rate] if args.rate else [('concurrency', c) for c in args.concurrency or [4]]
+
+    rows = []
+    for threads in [None] if args.url else args.threads:
+        for kind, value in loads:
+            proc = None
+            url = args.url
+            if url is None:
+                proc, url = start_server(threads, args.cold, extra_env)
+            try:
+                if kind == 'rate':
+                    recorder, elapsed = open_loop(url, replays, value, args.duration, args.seed)
+                else:
+                    recorder, elapsed = closed_loop(url, replays, value, args.duration, args.seed)
+            finally:
+                if proc is not None:
+                    stop_server(proc)
+            label = f'{kind}={value:g}' + (f' threads={threads}' if threads else '')
+            rows.extend(report(label, recorder, elapsed))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -227,6 +227,12 @@ import {
 } from "../settings.js";
 import { checkForJoinRequestNotifications } from "../utils/notificationHelpers.js";
 import { logAnalyticsEvent } from "../analyticsHelper.js";
+import {
+  isSupportedTimeline,
+  renderTimeline,
+  replayOptionsFromForm,
+  selectTimelinePlayer,
+} from "../replayTimeline.js";
 
 function updateSupplyColumnVisibility() {
   const table = document.getElementById("buildOrderTable");
@@ -785,10 +791,55 @@ export async function initializeIndexPage() {
     if (loader) loader.style.display = "none";
   }
 
+  // SHA-256 of the replay, so the parser can answer without the file bytes
+  async function replaySha256(file) {
+    if (!window.crypto?.subtle) return null;
+    const digest = await crypto.subtle.digest("SHA-256", await file.arrayBuffer());
+    return Array.from(new Uint8Array(digest))
+      .map((b) => b.toString(16).padStart(2, "0"))
+      .join("");
+  }
+
+  // Every player's unfiltered timeline (format=json) by replay hash, or by
+  // File when the browser cannot hash
+  const replayTimelines = new Map();
+
+  async function fetchReplayTimelines(file, sha) {
+    try {
+      let res = null;
+      if (sha) {
+        const hashData = new FormData();
+        hashData.append("sha256", sha);
+        hashData.append("format", "json");
+        res = await fetch("https://z-build-order.onrender.com/upload/hash", {
+          method: "POST",
+          body: hashData,
+        });
+      }
+      if (!res || res.status === 404) {
+        const uploadData = new FormData();
+        uploadData.append("format", "json");
+        uploadData.append("replay", file);
+        res = await fetch("https://z-build-order.onrender.com/upload", {
+          method: "POST",
+          body: uploadData,
+        });
+      }
+      if (!res.ok) return null;
+      const doc = await res.json();
+      if (!isSupportedTimeline(doc)) return null;
+      // a budget-truncated parse may well complete next time
+      if (!res.headers.get("X-Parse-Truncated")) replayTimelines.set(sha || file, doc);
+      return doc;
+    } catch (err) {
+      console.warn("Timeline request failed, falling back to text", err);
+      return null;
+    }
+  }
+
   // Handle the actual replay upload and parsing
   async function handleReplayUpload(file) {
     const formData = new FormData();
-    formData.append("replay", file);
     if (selectedPlayerPid !== null) {
       formData.append("player", selectedPlayerPid);
     }
@@ -821,11 +872,40 @@ export async function initializeIndexPage() {
     }
 
     try {
-      const res = await fetch("https://z-build-order.onrender.com/upload", {
-        method: "POST",
-        body: formData,
-      });
-      const text = await res.text();
+      const sha = await replaySha256(file).catch(() => null);
+      // Option changes on a replay we already have a timeline for are
+      // rendered locally, without another request
+      let text = null;
+      const doc = replayTimelines.get(sha || file) || (await fetchReplayTimelines(file, sha));
+      const player = doc ? selectTimelinePlayer(doc, selectedPlayerPid) : null;
+      if (player) {
+        text = renderTimeline(player.timeline, replayOptionsFromForm(formData));
+        if (player.truncated_at) {
+          text += `\n# truncated at ${player.truncated_at} (parse time budget exceeded)`;
+        }
+      }
+
+      if (text === null) {
+        // Hash first: the server usually still holds the file from /players
+        let res = null;
+        if (sha) {
+          const hashData = new FormData();
+          formData.forEach((value, key) => hashData.append(key, value));
+          hashData.append("sha256", sha);
+          res = await fetch("https://z-build-order.onrender.com/upload/hash", {
+            method: "POST",
+            body: hashData,
+          });
+        }
+        if (!res || res.status === 404) {
+          formData.append("replay", file);
+          res = await fetch("https://z-build-order.onrender.com/upload", {
+            method: "POST",
+            body: formData,
+          });
+        }
+        text = await res.text();
+      }
 
       const buildInput = document.getElementById("buildOrderInput");
       if (buildInput) buildInput.value = text;
@@ -0,0 +1,148 @@
+// Client-side rendering of the parser's `format=json` replay timelines.
+//
+// The server sends every player's timeline extracted once without any filter
+// options; these functions apply the options and produce exactly the text the
+// server's `/upload` returns (see "Rendering a timeline" in README.md), so
+// toggling an option never needs another request.
+
+const TIMELINE_FORMAT_VERSION = 1;
+
+// Same rules as the server's parse_upload_options()
+export function replayOptionsFromForm(formData) {
+  const flag = (name) =>
+    ["1", "true", "yes", "on"].includes(String(formData.get(name) ?? "").toLowerCase());
+  const digits = (name) => {
+    const value = formData.get(name);
+    return value && /^\d+$/.test(value) ? parseInt(value, 10) : null;
+  };
+  const compact = flag("compact");
+  const stopTime = digits("stop_time");
+  return {
+    player: formData.get("player") || null,
+    excludeWorkers: flag("exclude_workers"),
+    excludeUnits: flag("exclude_units"),
+    excludeSupply: flag("exclude_supply"),
+    excludeTime: flag("exclude_time") || compact,
+    compact,
+    stopLimit: digits("stop_supply"),
+    timeLimit: stopTime === null ? null : stopTime * 60,
+  };
+}
+
+export function isSupportedTimeline(doc) {
+  return Boolean(doc && doc.version === TIMELINE_FORMAT_VERSION && Array.isArray(doc.players));
+}
+
+// The player matching `requested` (pid or name), else the first one
+export function selectTimelinePlayer(doc, requested) {
+  const players = doc.players || [];
+  const wanted = requested == null ? null : String(requested);
+  return (
+    players.find((p) => wanted && (String(p.pid) === wanted || p.name === wanted)) ||
+    players[0] ||
+    null
+  );
+}
+
+function filterRows(rows, options) {
+  return rows.filter((row) => {
+    const flags = row.flags || [];
+    if (options.timeLimit !== null && row.event_sec > options.timeLimit) return false;
+    if (options.stopLimit !== null && row.peak_supply > options.stopLimit) return false;
+    if (options.excludeUnits && flags.includes("unit")) return false;
+    if (options.excludeWorkers && flags.includes("worker")) return false;
+    return true;
+  });
+}
+
+function compareStrings(a, b) {
+  return a < b ? -1 : a > b ? 1 : 0;
+}
+
+// Sort by (clock, supply, unit), merge neighbouring rows with the same unit
+// and supply into one with a count, then sort by clock (stable).
+function collapseRows(rows) {
+  const sorted = rows
+    .map((row) => ({ ...row, upgrade: (row.flags || []).includes("upgrade") }))
+    .sort(
+      (a, b) =>
+        a.clock_sec - b.clock_sec || a.supply - b.supply || compareStrings(a.unit, b.unit)
+    );
+  const merged = [];
+  for (const row of sorted) {
+    const last = merged[merged.length - 1];
+    if (last && last.unit === row.unit && last.supply === row.supply) {
+      last.count += 1;
+    } else {
+      merged.push({ ...row, count: 1 });
+    }
+  }
+  return merged.sort((a, b) => a.clock_sec - b.clock_sec);
+}
+
+// mm:ss like Python's divmod (floored, so early worker rows can read "-1:55")
+function clock(seconds) {
+  const minutes = Math.floor(seconds / 60);
+  const rest = seconds - minutes * 60;
+  return `${String(minutes).padStart(2, "0")}:${String(rest).padStart(2, "0")}`;
+}
+
+function prefix(parts) {
+  return parts.length ? `[${parts.join(" ")}] ` : "";
+}
+
+function quantity(row) {
+  return row.count > 1 ? `${row.count} ${row.unit}` : row.unit;
+}
+
+function upgradeLine(row, options) {
+  const parts = [];
+  if (!options.excludeSupply) parts.push(String(row.supply));
+  if (!options.excludeTime) parts.push(clock(row.clock_sec));
+  return prefix(parts) + row.unit;
+}
+
+// Build-order text for one player's timeline rows, identical to /upload's
+export function renderTimeline(rows, options) {
+  const entries = collapseRows(filterRows(rows, options));
+  const lines = [];
+  if (options.compact) {
+    let i = 0;
+    while (i < entries.length) {
+      const first = entries[i];
+      if (first.upgrade) {
+        lines.push(upgradeLine(first, options));
+        i += 1;
+        continue;
+      }
+      const units = [];
+      while (
+        i < entries.length &&
+        entries[i].supply === first.supply &&
+        entries[i].clock_sec === first.clock_sec
+      ) {
+        units.push(quantity(entries[i]));
+        i += 1;
+      }
+      lines.push(prefix(options.excludeSupply ? [] : [String(first.supply)]) + units.join(" + "));
+    }
+  } else {
+    for (const row of entries) {
+      if (row.upgrade) {
+        lines.push(upgradeLine(row, options));
+        continue;
+      }
+      const parts = [];
+      if (!options.excludeSupply) parts.push(String(row.supply));
+      if (!options.excludeTime) parts.push(clock(row.clock_sec));
+      lines.push(prefix(parts) + quantity(row));
+    }
+  }
+
+  // 15/14 overlord: a [15] before the first [14] ... Overlord line becomes [15/14]
+  const overlord = lines.findIndex((line) => /\[14\]\s+.*Overlord/.test(line));
+  for (let j = 0; j < overlord; j++) {
+    if (lines[j].startsWith("[15]")) lines[j] = lines[j].replace("[15]", "[15/14]");
+  }
+  return lines.join("\n");
+}
@@ -0,0 +1,136 @@
+"""Compact, versioned binary encoding of extracted timeline rows.
+
+A timeline is the list of row dicts ``extract_entries`` / ``collapse_entries``
+produce (``unit``, ``kind``, ``clock_sec``, ``supply``, ``made``, optional
+``count`` / ``source`` / upgrade ``type`` + ``label``).  As JSON or pickle every
+row repeats its keys and unit name; here the names are interned once and each
+row is a fixed 16-byte record:
+
+    header   magic "ZBTL", version u8, pad, name count u16, row count u32, names size u32
+    names    UTF-8 unit names joined by NUL
+    rows     unit id u16, kind u8, flags u8, clock_sec i32, supply i16, made i16, count u16, pad
+
+``TimelineView`` reads rows straight out of a ``bytes`` / ``memoryview`` /
+``mmap`` without copying the buffer; ``decode_timeline`` materialises the dicts
+(``decode_timeline(encode_timeline(rows)) == rows``).
+"""
+
+import struct
+from typing import Any, Dict, Iterator, List, Sequence, Union
+
+MAGIC = b'ZBTL'
+VERSION = 1
+HEADER = struct.Struct('<4sBxHII')
+ROW = struct.Struct('<HBBihhHxx')
+
+KINDS = ('start', 'finish')
+SOURCES = ('morph', 'warp-in')
+FLAG_UPGRADE = 1
+FLAG_COUNT = 2         # row carries a 'count' (collapsed timelines)
+FLAG_NO_SUPPLY = 4
+FLAG_SOURCE = 8        # 'source' is SOURCES[flags >> 4 & 1]
+FLAG_SOURCE_SHIFT = 4
+NO_SUPPLY = -1
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class TimelineFormatError(ValueError):
+    pass
+
+
+def encode_timeline(rows: Sequence[Dict[str, Any]]) -> bytes:
+    names: Dict[str, int] = {}
+    packed = bytearray(ROW.size * len(rows))
+    for i, row in enumerate(rows):
+        unit_id = names.setdefault(row['unit'], len(names))
+        flags = 0
+        if row.get('type') == 'upgrade':
+            flags |= FLAG_UPGRADE
+        if 'count' in row:
+            flags |= FLAG_COUNT
+        supply = row.get('supply')
+        if supply is None:
+            flags |= FLAG_NO_SUPPLY
+            supply = NO_SUPPLY
+        if 'source' in row:
+            flags |= FLAG_SOURCE | (SOURCES.index(row['source']) << FLAG_SOURCE_SHIFT)
+        ROW.pack_into(
+            packed, i * ROW.size, unit_id, KINDS.index(row.get('kind', 'start')), flags,
+            row['clock_sec'], supply, row.get('made') or 0, row.get('count', 1),
+        )
+    name_blob = '\0'.join(names).encode('utf-8')
+    return HEADER.pack(MAGIC, VERSION, len(names), len(rows), len(name_blob)) + name_blob + bytes(packed)
+
+
+def _row_dict(names: List[str], unit_id: int, kind: int, flags: int, clock: int, supply: int,
+              made: int, count: int) -> Dict[str, Any]:
+    unit = names[unit_id]
+    row = {
+        'clock_sec': clock,
+        'supply': None if flags & FLAG_NO_SUPPLY else supply,
+        'made': made,
+        'unit': unit,
+        'kind': KINDS[kind],
+    }
+    if flags & FLAG_UPGRADE:
+        row['type'] = 'upgrade'
+        row['label'] = unit
+    if flags & FLAG_SOURCE:
+        row['source'] = SOURCES[(flags >> FLAG_SOURCE_SHIFT) & 1]
+    if flags & FLAG_COUNT:
+        row['count'] = count
+    return row
+
+
+class TimelineView:
+    """Read-only rows of an encoded timeline, decoded one at a time on access."""
+
+    def __init__(self, buffer: Buffer):
+        view = memoryview(buffer)
+        if len(view) < HEADER.size:
+            raise TimelineFormatError('Timeline buffer is truncated')
+        magic, version, n_names, n_rows, names_size = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise TimelineFormatError('Not an encoded timeline')
+        if version != VERSION:
+            raise TimelineFormatError(f'Unsupported timeline version {version}')
+        start = HEADER.size + names_size
+        if len(view) < start + n_rows * ROW.size:
+            raise TimelineFormatError('Timeline buffer is truncated')
+        self.names: List[str] = str(view[HEADER.size:start], 'utf-8').split('\0') if n_names else []
+        self._rows = view[start:start + n_rows * ROW.size]
+
+    def __len__(self) -> int:
+        return len(self._rows) // ROW.size
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return _row_dict(self.names, *ROW.unpack_from(self._rows, i * ROW.size))
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        names = self.names
+        for fields in ROW.iter_unpack(self._rows):
+            yield _row_dict(names, *fields)
+
+    def clocks(self) -> List[int]:
+        """Just the ``clock_sec`` column, without building row dicts."""
+        return [fields[3] for fields in ROW.iter_unpack(self._rows)]
+
+
+def decode_timeline(buffer: Buffer) -> List[Dict[str, Any]]:
+    view = TimelineView(buffer)
+    names = view.names
+    rows = []
+    append = rows.append
+    # plain rows (no flags) are the vast majority; build those inline
+    for unit_id, kind, flags, clock, supply, made, count in ROW.iter_unpack(view._rows):
+        if flags:
+            append(_row_dict(names, unit_id, kind, flags, clock, supply, made, count))
+        else:
+            append({'clock_sec': clock, 'supply': supply, 'made': made, 'unit': names[unit_id],
+                    'kind': KINDS[kind]})
+    return rows
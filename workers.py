@@ -0,0 +1,448 @@
+"""Process pool for parses that should not run on a waitress thread.
+
+Background jobs and batch uploads hand their replays to this pool so the web tier
+stays responsive and several replays can be parsed on separate cores.  The pool
+is created lazily on first use; ``PARSE_WORKERS`` sets its size.
+
+Every task runs under per-parse resource limits: ``PARSE_MEMORY_MB`` of address
+space on top of what the worker had when it started (``RLIMIT_AS``) and
+``PARSE_CPU_SECONDS`` of CPU time (``RLIMIT_CPU``); 0 disables either.  A parse
+that hits a limit fails with ``ResourceLimitExceeded`` and the pool is recycled:
+the old workers finish what they already hold and exit, new tasks go to fresh
+workers.  A worker that dies outright (SIGKILL, OOM killer) breaks its pool.
+The task that was running in that worker is retried once on a new pool, so only
+a replay that kills a worker twice fails; tasks that were merely queued behind
+it, or running in the workers torn down with it, are resubmitted without using
+up that retry.
+"""
+
+import faulthandler
+import gc
+import itertools
+import os
+import signal
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from contextlib import nullcontext
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import resource
+except ImportError:  # not on Windows; parses then run without limits
+    resource = None
+
+PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', str(min(4, os.cpu_count() or 1))))
+PARSE_MEMORY_MB = int(os.environ.get('PARSE_MEMORY_MB', '512'))
+PARSE_CPU_SECONDS = int(os.environ.get('PARSE_CPU_SECONDS', '30'))
+CPU_GRACE_SECONDS = 5  # after the soft limit, a worker that does not unwind exits
+# wall-clock backstop for a worker stuck in C code, where no Python signal handler runs
+WATCHDOG_SECONDS = PARSE_CPU_SECONDS * 2 + CPU_GRACE_SECONDS
+MEMORY_HIT_RATIO = 0.95  # peak address space this close to the cap counts as a hit
+SAMPLER_HZ = float(os.environ.get('SAMPLER_HZ', '50'))  # as in app.py, per worker
+PARENT_POLL_SECONDS = 1.0  # how soon a worker notices the server is gone
+MAX_REQUEUES = 3  # resubmissions of a task that only shared a pool with crashing replays
+
+_pool = None
+_pool_lock = threading.Lock()
+_started = None  # workers put (token, pid) here as they pick up a task
+_started_on: Dict[int, int] = {}  # token -> pid, for tasks not settled yet
+_started_lock = threading.Lock()
+_tokens = itertools.count()
+_pending = 0  # submitted tasks whose futures are not done yet
+_pending_lock = threading.Lock()
+_usage_listener: Optional[Callable[[Dict[str, Any]], None]] = None
+
+
+class ResourceLimitExceeded(Exception):
+    """A parse ran into its memory or CPU cap, or killed its worker."""
+
+    STATUS = {'memory': 413, 'cpu': 422, 'crash': 422}
+
+    def __init__(self, kind: str, detail: str):
+        super().__init__(kind, detail)
+        self.kind = kind
+        self.detail = detail
+
+    @property
+    def status(self) -> int:
+        return self.STATUS[self.kind]
+
+    def __str__(self) -> str:
+        return self.detail
+
+
+class _CpuLimit(BaseException):
+    # BaseException, so the parser's ``except Exception`` blocks don't swallow it
+    pass
+
+
+def get_pool():
+    global _pool, _started
+    with _pool_lock:
+        if _pool is None:
+            # multiprocessing is only imported once a batch or job needs it
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            if _started is None:
+                _started = multiprocessing.SimpleQueue()
+            _pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, initializer=_init_worker,
+                                        initargs=(_started,))
+        return _pool
+
+
+def _retire(pool) -> None:
+    """Stop sending work to ``pool``; its workers exit once their queue is drained."""
+    global _pool
+    with _pool_lock:
+        if _pool is not pool:
+            return  # already replaced
+        _pool = None
+    pool.shutdown(wait=False)
+    print("♻️ Recycled the parse worker pool")
+
+
+def shutdown() -> None:
+    """Stop the pool for good (server exit): drop queued tasks and stop the workers."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is None:
+        return
+    import multiprocessing
+
+    pool.shutdown(wait=False, cancel_futures=True)
+    for child in multiprocessing.active_children():
+        child.terminate()
+
+
+def set_usage_listener(listener: Optional[Callable[[Dict[str, Any]], None]]) -> None:
+    """``listener(usage)`` is called in this process after every task.
+
+    ``usage`` has ``task``, ``peak_rss_mb`` (the worker's resident high-water
+    mark during the task), ``cpu_seconds``, ``limit`` (``None``, ``'memory'``,
+    ``'cpu'`` or ``'crash'``) and, for a task that finished, ``stacks``: the
+    worker's sampled stacks (see ``sampler.StackSampler.drain``).
+    """
+    global _usage_listener
+    _usage_listener = listener
+
+
+def _report(usage: Dict[str, Any]) -> None:
+    if _usage_listener is not None:
+        _usage_listener(usage)
+
+
+def pending() -> int:
+    """Tasks submitted to the pool and not finished yet, including queued ones."""
+    return _pending
+
+
+def _count_pending(delta: int) -> None:
+    global _pending
+    with _pending_lock:
+        _pending += delta
+
+
+def _submit(task: Callable, *args) -> Future:
+    outer: Future = Future()
+    _count_pending(1)
+    outer.add_done_callback(lambda f: _count_pending(-1))
+    _dispatch(outer, 0, 0, task, args)
+    return outer
+
+
+def _dispatch(outer: Future, attempt: int, requeues: int, task: Callable, args: tuple) -> None:
+    from concurrent.futures.process import BrokenProcessPool
+
+    if outer.cancelled():
+        return
+    token = next(_tokens)
+    pool = get_pool()
+    try:
+        inner = pool.submit(_run_reported, token, task, args)
+    except BrokenProcessPool:
+        # broke before anyone noticed; the first task submitted after that replaces it
+        _retire(pool)
+        pool = get_pool()
+        inner = pool.submit(_run_reported, token, task, args)
+    # cancelling the caller's future also drops the task if no worker has picked it up yet
+    outer.add_done_callback(lambda f: inner.cancel() if f.cancelled() else None)
+    inner.add_done_callback(partial(_settle, outer, attempt, requeues, token, pool, task, args))
+
+
+def _worker_of(token: int) -> Optional[int]:
+    """The pid of the worker that picked up task ``token``, None if none did."""
+    with _started_lock:
+        while _started is not None and not _started.empty():
+            started, pid = _started.get()
+            _started_on[started] = pid
+        return _started_on.pop(token, None)
+
+
+def _died(pid: Optional[int]) -> bool:
+    import multiprocessing
+
+    # runs before the executor terminates the surviving workers, so only the crashed one is gone
+    return pid is not None and pid not in {p.pid for p in multiprocessing.active_children()}
+
+
+def _settle(outer: Future, attempt: int, requeues: int, token: int, pool, task: Callable,
+            args: tuple, inner: Future) -> None:
+    from concurrent.futures.process import BrokenProcessPool
+
+    pid = _worker_of(token)
+    if outer.cancelled():
+        return
+    try:
+        result, usage = inner.result()
+    except BrokenProcessPool:
+        _retire(pool)
+        if not _died(pid) and requeues < MAX_REQUEUES:
+            # queued behind the replay that killed a worker, or torn down alongside it
+            _dispatch(outer, attempt, requeues + 1, task, args)
+            return
+        if attempt == 0:
+            _dispatch(outer, 1, requeues, task, args)
+            return
+        _report({'task': task.__name__, 'peak_rss_mb': None, 'cpu_seconds': None, 'limit': 'crash'})
+        _resolve(outer.set_exception, ResourceLimitExceeded('crash', 'Parser worker died while parsing this replay'))
+        return
+    except ResourceLimitExceeded as e:
+        _retire(pool)
+        _report({'task': task.__name__, 'peak_rss_mb': None, 'cpu_seconds': None, 'limit': e.kind})
+        _resolve(outer.set_exception, e)
+        return
+    except BaseException as e:
+        _resolve(outer.set_exception, e)
+        return
+    _report(usage)
+    _resolve(outer.set_result, result)
+
+
+def _resolve(setter: Callable, value) -> None:
+    try:
+        setter(value)
+    except InvalidStateError:
+        pass  # the caller cancelled it while the task was running
+
+
+def submit_parse(data: bytes, options: Dict[str, Any]) -> Future:
+    """Parse one replay in a worker; the future resolves to ``parse_replay_task``'s dict."""
+    return _submit(parse_replay_task, data, options)
+
+
+def submit_upload(data: bytes, options: Dict[str, Any]) -> Future:
+    """``/upload``'s parse in a worker; resolves to ``(body, status, encoded timeline or None)``."""
+    return _submit(upload_task, data, options)
+
+
+def submit_timelines(data: bytes, time_budget: Optional[float] = None) -> Future:
+    """Every player's ``format=json`` timeline in a worker (see ``timeline_document``)."""
+    return _submit(timelines_task, data, time_budget)
+
+
+def submit_all_players(data: bytes, options: Dict[str, Any], time_budget: Optional[float] = None) -> Future:
+    """Extract every player's build order in a worker (see ``build_orders_for_all_players``)."""
+    return _submit(all_players_task, data, options, time_budget)
+
+
+def submit_timeline(data: bytes, options: Dict[str, Any]) -> Future:
+    """The requested player's structured timeline in a worker (see ``timeline_for_bytes``).
+
+    Resolves to ``(player, encoded timeline)``; decode with ``timeline_codec``.
+    """
+    return _submit(timeline_task, data, options)
+
+
+# ---- worker side -----------------------------------------------------
+_memory_cap: Optional[int] = None  # bytes of address space, as set in _init_worker
+_sampler = None  # this worker's StackSampler, started in _init_worker
+_cpu_limited = False
+_cpu_signals = 0  # SIGXCPU arrives once per CPU second past the soft limit
+
+
+def _proc_status(field: str) -> Optional[int]:
+    """A ``kB`` field of /proc/self/status in bytes, or None where there is none."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss() -> bool:
+    # Linux: writing 5 to clear_refs resets VmHWM, making it a per-task high-water mark
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss() -> Optional[int]:
+    peak = _proc_status('VmHWM')
+    if peak is None and resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # lifetime peak
+    return peak
+
+
+def _on_sigxcpu(signum, frame):
+    global _cpu_limited, _cpu_signals
+    _cpu_signals += 1
+    if _cpu_limited:
+        if _cpu_signals > CPU_GRACE_SECONDS:
+            os._exit(1)  # still running a grace period later: the limit is being swallowed
+        return
+    _cpu_limited = True
+    raise _CpuLimit()
+
+
+def _exit_with_parent(parent: int) -> None:
+    # a killed server leaves its workers blocked on the call queue; don't outlive it
+    while os.getppid() == parent:
+        time.sleep(PARENT_POLL_SECONDS)
+    os._exit(1)
+
+
+def _init_worker(started) -> None:
+    global _memory_cap, _started, _sampler
+    _started = started
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)  # not the server's handler, forked along
+    threading.Thread(target=_exit_with_parent, args=(os.getppid(),), name='parent-watch', daemon=True).start()
+    if os.environ.get('GC_TUNING', '1') != '0':
+        # the inherited heap is never garbage; keep collections from touching (and copying) its pages
+        gc.freeze()
+    if SAMPLER_HZ > 0:
+        from sampler import StackSampler
+
+        _sampler = StackSampler(SAMPLER_HZ).start()
+    if resource is None:
+        return
+    if PARSE_MEMORY_MB > 0:
+        base = _proc_status('VmSize') or 0
+        _memory_cap = base + PARSE_MEMORY_MB * 1024 * 1024
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        if hard != resource.RLIM_INFINITY:
+            _memory_cap = min(_memory_cap, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (_memory_cap, hard))
+    if PARSE_CPU_SECONDS > 0:
+        signal.signal(signal.SIGXCPU, _on_sigxcpu)
+
+
+def _cpu_used() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _run_reported(token: int, task: Callable, args: tuple):
+    _started.put((token, os.getpid()))
+    return run_limited(task, *args)
+
+
+def run_limited(task: Callable, *args):
+    """Run ``task(*args)`` in a worker under the CPU cap; returns ``(result, usage)``.
+
+    Raises ``ResourceLimitExceeded`` when the task ran into a cap, even if the
+    parser caught the ``MemoryError`` and turned it into an error body.
+    """
+    global _cpu_limited, _cpu_signals
+    limited = resource is not None
+    cpu_before = _cpu_used() if limited else time.process_time()
+    if limited and PARSE_CPU_SECONDS > 0:
+        _cpu_limited = False
+        _cpu_signals = 0
+        # RLIMIT_CPU counts the whole process, so the cap moves with every task;
+        # the hard limit stays where it is (it could not be raised again)
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        resource.setrlimit(resource.RLIMIT_CPU, (int(cpu_before) + PARSE_CPU_SECONDS, hard))
+    reset_peak_rss()
+    size_before = _proc_status('VmPeak')
+    limit = None
+    if PARSE_CPU_SECONDS > 0:
+        # dumps the stuck stack to stderr and exits; the pool then retries / fails the task
+        faulthandler.dump_traceback_later(WATCHDOG_SECONDS, exit=True)
+    try:
+        with _sampler.track() if _sampler is not None else nullcontext():
+            result = task(*args)
+    except _CpuLimit:
+        limit = 'cpu'
+    except MemoryError:
+        limit = 'memory'
+    finally:
+        if PARSE_CPU_SECONDS > 0:
+            faulthandler.cancel_dump_traceback_later()
+        if limited and PARSE_CPU_SECONDS > 0:
+            _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+            resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+    cpu_seconds = (_cpu_used() if limited else time.process_time()) - cpu_before
+    if limit is None and _cpu_limited:
+        limit = 'cpu'
+    if limit is None and _memory_cap is not None:
+        # a MemoryError the parser reported as a broken replay still hit the cap.
+        # VmPeak never resets, so only a task that pushed it up this close is blamed
+        peak_size = _proc_status('VmPeak')
+        if (peak_size is not None and peak_size >= _memory_cap * MEMORY_HIT_RATIO
+                and (size_before is None or peak_size > size_before)):
+            limit = 'memory'
+    if limit == 'memory':
+        raise ResourceLimitExceeded('memory', f'Replay needs more than {PARSE_MEMORY_MB} MB to parse')
+    if limit == 'cpu':
+        raise ResourceLimitExceeded('cpu', f'Replay took more than {PARSE_CPU_SECONDS}s of CPU to parse')
+    peak = peak_rss()
+    usage = {
+        'task': task.__name__,
+        'peak_rss_mb': round(peak / (1024 * 1024), 1) if peak is not None else None,
+        'cpu_seconds': round(cpu_seconds, 3),
+        'limit': None,
+        'stacks': _sampler.drain() if _sampler is not None else {},
+    }
+    return result, usage
+
+
+def parse_replay_task(data: bytes, options: Dict[str, Any]) -> Dict[str, Any]:
+    # imported here so the worker shares the exact extraction code of /upload
+    from app import build_order_for_bytes
+
+    body, status = build_order_for_bytes(data, options)
+    return {'status': status, 'build_order': body}
+
+
+def upload_task(data: bytes, options: Dict[str, Any]):
+    from app import build_order_for_bytes
+
+    # a complete parse's encoded rows go back with the text, so the server can
+    # cache them and re-render other display options without a worker
+    blobs = []
+    body, status = build_order_for_bytes(data, options, on_timeline=blobs.append)
+    return body, status, blobs[0] if blobs else None
+
+
+def timelines_task(data: bytes, time_budget: Optional[float]) -> Dict[str, Any]:
+    from app import timeline_document
+
+    return timeline_document(data, time_budget)
+
+
+def all_players_task(data: bytes, options: Dict[str, Any], time_budget: Optional[float]) -> Dict[str, Any]:
+    from app import build_orders_for_all_players
+
+    try:
+        return build_orders_for_all_players(data, options, time_budget)
+    except Exception as e:
+        # a broken replay is reported on its own line, it does not fail the batch
+        return {'error': f'Failed to load replay: {e}'}
+
+
+def timeline_task(data: bytes, options: Dict[str, Any]):
+    from app import timeline_for_bytes
+    from timeline_codec import encode_timeline
+
+    player, timeline = timeline_for_bytes(data, options)
+    return player, encode_timeline(timeline)  # a fraction of the pickled dicts